@@ -100,9 +100,9 @@ def matview_search_filter(filters, model, for_downloads=False):
             # flatten IDs
             transaction_ids = list(itertools.chain.from_iterable(transaction_ids))
             logger.info('Found {} transactions based on keyword: {}'.format(len(transaction_ids), keyword))
-            transaction_ids = [str(transaction_id) for transaction_id in transaction_ids]
-            queryset &= queryset.extra(
-                where=['"transaction_normalized"."id" = ANY(\'{{{}}}\'::int[])'.format(','.join(transaction_ids))])
+            # Semi-join against the unnested array so Postgres can hash it instead of scanning the array per row
+            queryset &= queryset.extra(where=['"transaction_normalized"."id" IN (SELECT UNNEST(\'{{{}}}\'::int[]))'
+                                              .format(','.join(map(str, transaction_ids)))])
 
         elif key == "time_period":
             min_date = API_SEARCH_MIN_DATE
@@ -88,10 +88,10 @@ def subaward_filter(filters, for_downloads=False):
             # flatten IDs
             transaction_ids = list(itertools.chain.from_iterable(transaction_ids))
             logger.info('Found {} transactions based on keyword: {}'.format(len(transaction_ids), keyword))
-            transaction_ids = [str(transaction_id) for transaction_id in transaction_ids]
             queryset = queryset.filter(latest_transaction_id__isnull=False)
-            queryset &= queryset.extra(
-                where=['"latest_transaction_id" = ANY(\'{{{}}}\'::int[])'.format(','.join(transaction_ids))])
+            # Semi-join against the unnested array so Postgres can hash it instead of scanning the array per row
+            queryset &= queryset.extra(where=['"latest_transaction_id" IN (SELECT UNNEST(\'{{{}}}\'::int[]))'
+                                              .format(','.join(map(str, transaction_ids)))])
 
         elif key == "time_period":
             min_date = API_SEARCH_MIN_DATE
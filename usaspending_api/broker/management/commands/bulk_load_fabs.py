@@ -11,6 +11,7 @@ from usaspending_api.etl.management.load_base import load_data_into_model, forma
 from usaspending_api.references.helpers import canonicalize_location_dict
 from usaspending_api.references.models import RefCountryCode, Location, LegalEntity, Agency, ToptierAgency, \
     SubtierAgency
+from usaspending_api.references.reference_helpers import enrich_locations
 from usaspending_api.etl.award_helpers import update_awards, update_award_categories
 
 BATCH_SIZE = 100000
@@ -243,9 +244,6 @@ class Command(BaseCommand):
                 as_dict=True)
 
             loc_instance = Location(**location_instance_data)
-            loc_instance.load_city_county_data()
-            loc_instance.fill_missing_state_data()
-            loc_instance.fill_missing_zip5()
 
             if pop_flag:
                 pop_bulk.append(loc_instance)
@@ -254,10 +252,10 @@ class Command(BaseCommand):
 
         if pop_flag:
             logger.info('Bulk creating POP Locations (batch_size: {})...'.format(BATCH_SIZE))
-            Location.objects.bulk_create(pop_bulk, batch_size=BATCH_SIZE)
+            Location.objects.bulk_create(enrich_locations(pop_bulk), batch_size=BATCH_SIZE)
         else:
             logger.info('Bulk creating LE Locations (batch_size: {})...'.format(BATCH_SIZE))
-            Location.objects.bulk_create(lel_bulk, batch_size=BATCH_SIZE)
+            Location.objects.bulk_create(enrich_locations(lel_bulk), batch_size=BATCH_SIZE)
 
     def load_legal_entity(self, fabs_broker_data, total_rows):
 
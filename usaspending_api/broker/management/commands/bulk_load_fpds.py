@@ -1,5 +1,6 @@
 import logging
 from datetime import datetime
+from itertools import groupby
 
 from django.core.management.base import BaseCommand
 from django.db import connections, connection, transaction as db_transaction
@@ -14,6 +15,7 @@ from usaspending_api.etl.management.load_base import load_data_into_model, forma
 from usaspending_api.references.helpers import canonicalize_location_dict
 from usaspending_api.references.models import RefCountryCode, Location, LegalEntity, Agency, ToptierAgency, \
     SubtierAgency
+from usaspending_api.references.reference_helpers import enrich_locations
 
 BATCH_SIZE = 100000
 
@@ -61,6 +63,39 @@ le_field_map = {
 }
 
 
+def clear_bulk_lists():
+    """Empties the per-row lists shared by the load steps, so that the next chunk of rows starts at index 0"""
+    for bulk_list in (fpds_bulk, pop_bulk, lel_bulk, legal_entity_lookup, legal_entity_bulk, awarding_agency_list,
+                      funding_agency_list, award_lookup, award_bulk, parent_award_lookup, parent_award_bulk,
+                      transaction_normalized_bulk):
+        del bulk_list[:]
+
+
+def diff_sorted_ids(broker_ids, usaspending_ids):
+    """
+    Merges two ascending streams of detached_award_procurement_ids in a single pass, holding neither in memory.
+    Returns the ids only the Broker has (to insert) and the ids only USAspending has (to delete), both ascending
+    """
+    to_insert, to_delete = [], []
+
+    # Repeated ids count once, as they did when the ids were diffed as sets
+    broker_ids = (key for key, _ in groupby(broker_ids))
+    usaspending_ids = (key for key, _ in groupby(usaspending_ids))
+
+    broker_id, usaspending_id = next(broker_ids, None), next(usaspending_ids, None)
+    while broker_id is not None or usaspending_id is not None:
+        if usaspending_id is None or (broker_id is not None and broker_id < usaspending_id):
+            to_insert.append(broker_id)
+            broker_id = next(broker_ids, None)
+        elif broker_id is None or usaspending_id < broker_id:
+            to_delete.append(usaspending_id)
+            usaspending_id = next(usaspending_ids, None)
+        else:
+            broker_id, usaspending_id = next(broker_ids, None), next(usaspending_ids, None)
+
+    return to_insert, to_delete
+
+
 class Command(BaseCommand):
     help = "Update historical transaction data for a fiscal year from the Broker."
 
@@ -106,16 +141,32 @@ class Command(BaseCommand):
             for sa in SubtierAgency.objects
             .annotate(n_agencies=Count('agency')).filter(n_agencies=1)
         }
-        self.award_map = {award.piid: award for award in Award.objects.filter(piid__isnull=False)}
-        self.le_map = {(le.recipient_unique_id, le.recipient_name): le for le in LegalEntity.objects.all()}
+
+    def set_chunk_lookup_maps(self, fpds_broker_data):
+        """Fetches only the Awards and LegalEntities the rows of this chunk can be matched to"""
+        piids = set()
+        recipient_unique_ids, recipient_names = set(), set()
+        for row in fpds_broker_data:
+            piids.update(piid for piid in (row.get('piid'), row.get('parent_award_id')) if piid)
+            recipient_unique_ids.add(row['awardee_or_recipient_uniqu'] or '')
+            recipient_names.add(row['awardee_or_recipient_legal'] or '')
+
+        self.award_map = {award.piid: award for award in Award.objects.filter(piid__in=piids)}
+        self.le_map = {
+            (le.recipient_unique_id, le.recipient_name): le
+            for le in LegalEntity.objects.filter(recipient_unique_id__in=recipient_unique_ids,
+                                                 recipient_name__in=recipient_names)
+        }
 
     def diff_fpds_data(self, db_cursor, ds_cursor, fiscal_year=None):
+        """Both cursors should be server-side (chunked) cursors, so that the ids are streamed instead of fetched"""
         db_query = 'SELECT detached_award_procurement_id ' \
             'FROM detached_award_procurement'
         db_arguments = []
 
         ds_query = 'SELECT detached_award_procurement_id ' \
-                   'FROM transaction_fpds'
+                   'FROM transaction_fpds ' \
+                   'WHERE detached_award_procurement_id IS NOT NULL'
         ds_arguments = []
 
         if fiscal_year:
@@ -124,31 +175,22 @@ class Command(BaseCommand):
             else:
                 db_query += ' WHERE'
 
-            if ds_arguments:
-                ds_query += ' AND'
-            else:
-                ds_query += ' WHERE'
-
             fy_begin = '10/01/' + str(fiscal_year - 1)
             fy_end = '09/30/' + str(fiscal_year)
 
             db_query += ' action_date::Date BETWEEN %s AND %s'
             db_arguments += [fy_begin, fy_end]
 
-            ds_query += ' action_date::Date BETWEEN %s AND %s'
+            ds_query += ' AND action_date::Date BETWEEN %s AND %s'
             ds_arguments += [fy_begin, fy_end]
 
+        db_query += ' ORDER BY detached_award_procurement_id'
+        ds_query += ' ORDER BY detached_award_procurement_id'
+
         db_cursor.execute(db_query, db_arguments)
         ds_cursor.execute(ds_query, ds_arguments)
 
-        db_dict = dictfetchall(db_cursor)
-        ds_dict = dictfetchall(ds_cursor)
-
-        db_set = set(map(lambda db_entry: int(db_entry['detached_award_procurement_id']), db_dict))
-        ds_set = set(map(lambda ds_entry: int(ds_entry['detached_award_procurement_id']), ds_dict))
-
-        to_insert = db_set - ds_set
-        to_delete = ds_set - db_set
+        to_insert, to_delete = diff_sorted_ids((int(row[0]) for row in db_cursor), (int(row[0]) for row in ds_cursor))
 
         logger.info('Number of records to insert: %s' % str(len(to_insert)))
         logger.info('Number of records to delete: %s' % str(len(to_delete)))
@@ -244,9 +286,6 @@ class Command(BaseCommand):
                 as_dict=True)
 
             loc_instance = Location(**location_instance_data)
-            loc_instance.load_city_county_data()
-            loc_instance.fill_missing_state_data()
-            loc_instance.fill_missing_zip5()
 
             if pop_flag:
                 pop_bulk.append(loc_instance)
@@ -255,10 +294,10 @@ class Command(BaseCommand):
 
         if pop_flag:
             logger.info('Bulk creating POP Locations (batch_size: {})...'.format(BATCH_SIZE))
-            Location.objects.bulk_create(pop_bulk, batch_size=BATCH_SIZE)
+            Location.objects.bulk_create(enrich_locations(pop_bulk), batch_size=BATCH_SIZE)
         else:
             logger.info('Bulk creating LE Locations (batch_size: {})...'.format(BATCH_SIZE))
-            Location.objects.bulk_create(lel_bulk, batch_size=BATCH_SIZE)
+            Location.objects.bulk_create(enrich_locations(lel_bulk), batch_size=BATCH_SIZE)
 
     def load_legal_entity(self, fpds_broker_data, total_rows):
 
@@ -496,13 +535,20 @@ class Command(BaseCommand):
             help="Year for which to run the historical load"
         )
 
+        parser.add_argument(
+            '--chunk_size',
+            type=int,
+            default=BATCH_SIZE,
+            help="How many new Broker rows to fetch and load at a time"
+        )
+
     @db_transaction.atomic
     def handle(self, *args, **options):
         logger.info('Starting FPDS bulk data load...')
 
         db_cursor = connections['data_broker'].cursor()
-        ds_cursor = connection.cursor()
         fiscal_year = options.get('fiscal_year')
+        chunk_size = options['chunk_size']
 
         if fiscal_year:
             fiscal_year = fiscal_year[0]
@@ -511,9 +557,9 @@ class Command(BaseCommand):
 
         logger.info('Processing data for Fiscal Year ' + str(fiscal_year))
 
-        with timer('Diff-ing FPDS data', logger.info):
-            to_insert, to_delete = self.diff_fpds_data(db_cursor=db_cursor,
-                                                       ds_cursor=ds_cursor,
+        with timer('Diff-ing FPDS data', logger.info), connections['data_broker'].chunked_cursor() as db_id_cursor, \
+                connection.chunked_cursor() as ds_id_cursor:
+            to_insert, to_delete = self.diff_fpds_data(db_cursor=db_id_cursor, ds_cursor=ds_id_cursor,
                                                        fiscal_year=fiscal_year)
 
         total_rows = len(to_insert)
@@ -527,32 +573,15 @@ class Command(BaseCommand):
             # Set lookups after deletions to only get latest
             self.set_lookup_maps()
 
-            with timer('Get Broker FPDS data', logger.info):
-                fpds_broker_data = self.get_fpds_data(
-                    db_cursor=db_cursor, fiscal_year=fiscal_year, to_insert=to_insert)
-
-            with timer('Loading POP Location data', logger.info):
-                self.load_locations(fpds_broker_data=fpds_broker_data, total_rows=total_rows, pop_flag=True)
-
-            with timer('Loading LE Location data', logger.info):
-                self.load_locations(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
+            award_update_ids = set()
+            for chunk_start in range(0, total_rows, chunk_size):
+                logger.info('Loading rows {} to {} of {}'.format(chunk_start + 1,
+                                                                 min(chunk_start + chunk_size, total_rows),
+                                                                 total_rows))
+                award_update_ids.update(self.load_chunk(db_cursor, fiscal_year,
+                                                        to_insert[chunk_start:chunk_start + chunk_size]))
 
-            with timer('Loading Legal Entity data', logger.info):
-                self.load_legal_entity(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
-
-            with timer('Loading Parent Award data', logger.info):
-                self.load_parent_awards(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
-
-            with timer('Loading Award data', logger.info):
-                self.load_awards(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
-
-            with timer('Loading Transaction Normalized data', logger.info):
-                self.load_transaction_normalized(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
-
-            with timer('Loading Transaction FPDS data', logger.info):
-                self.load_transaction_fpds(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
-
-            award_update_id_list = [award.id for award in award_lookup]
+            award_update_id_list = list(award_update_ids)
 
             with timer('Updating awards to reflect their latest associated transaction info', logger.info):
                 update_awards(tuple(award_update_id_list))
@@ -564,3 +593,36 @@ class Command(BaseCommand):
                 update_award_categories(tuple(award_update_id_list))
         else:
             logger.info('Nothing to insert...FINISHED!')
+
+    def load_chunk(self, db_cursor, fiscal_year, to_insert):
+        """Loads one chunk of new Broker rows and returns the ids of the awards it touched"""
+        clear_bulk_lists()
+        total_rows = len(to_insert)
+
+        with timer('Get Broker FPDS data', logger.info):
+            fpds_broker_data = self.get_fpds_data(db_cursor=db_cursor, fiscal_year=fiscal_year, to_insert=to_insert)
+
+        self.set_chunk_lookup_maps(fpds_broker_data)
+
+        with timer('Loading POP Location data', logger.info):
+            self.load_locations(fpds_broker_data=fpds_broker_data, total_rows=total_rows, pop_flag=True)
+
+        with timer('Loading LE Location data', logger.info):
+            self.load_locations(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
+
+        with timer('Loading Legal Entity data', logger.info):
+            self.load_legal_entity(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
+
+        with timer('Loading Parent Award data', logger.info):
+            self.load_parent_awards(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
+
+        with timer('Loading Award data', logger.info):
+            self.load_awards(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
+
+        with timer('Loading Transaction Normalized data', logger.info):
+            self.load_transaction_normalized(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
+
+        with timer('Loading Transaction FPDS data', logger.info):
+            self.load_transaction_fpds(fpds_broker_data=fpds_broker_data, total_rows=total_rows)
+
+        return [award.id for award in award_lookup]
@@ -9,7 +9,7 @@ from datetime import datetime, timedelta, timezone
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import connections, transaction
-from django.db.models import Count
+from django.db.models import Case, Count, IntegerField, Sum, When
 
 from usaspending_api.awards.models import TransactionFPDS, TransactionNormalized, Award
 from usaspending_api.broker import lookups
@@ -20,8 +20,12 @@ from usaspending_api.common.helpers.generic_helper import fy, timer, upper_case_
 from usaspending_api.etl.award_helpers import (update_awards, update_contract_awards, update_award_categories,
                                                award_types)
 from usaspending_api.etl.broker_etl_helpers import dictfetchall
-from usaspending_api.etl.management.load_base import load_data_into_model, format_date, create_location
-from usaspending_api.references.models import LegalEntity, Agency
+from usaspending_api.etl.management.load_base import create_location, format_date, load_data_into_model
+from usaspending_api.etl.transaction_batch_helpers import (
+    bulk_create_locations, dedupe_broker_rows, get_or_create_summary_awards, upsert_transactions
+)
+from usaspending_api.references.models import LegalEntity
+from usaspending_api.references.reference_helpers import agency_resolver
 
 
 logger = logging.getLogger("console")
@@ -29,6 +33,77 @@ logger = logging.getLogger("console")
 AWARD_UPDATE_ID_LIST = []
 BATCH_FETCH_SIZE = 25000
 
+PLACE_OF_PERFORMANCE_FIELD_MAP = {
+    "location_country_code": "place_of_perform_country_c",
+    "country_name": "place_of_perf_country_desc",
+    "state_code": "place_of_performance_state",
+    "state_name": "place_of_perfor_state_desc",
+    "city_name": "place_of_perform_city_name",
+    "county_name": "place_of_perform_county_na",
+    "county_code": "place_of_perform_county_co",
+    "zip_4a": "place_of_performance_zip4a",
+    "congressional_code": "place_of_performance_congr",
+    "zip_last4": "place_of_perform_zip_last4",
+    "zip5": "place_of_performance_zip5",
+}
+
+LEGAL_ENTITY_LOCATION_FIELD_MAP = {
+    "location_country_code": "legal_entity_country_code",
+    "country_name": "legal_entity_country_name",
+    "state_code": "legal_entity_state_code",
+    "state_name": "legal_entity_state_descrip",
+    "city_name": "legal_entity_city_name",
+    "county_name": "legal_entity_county_name",
+    "county_code": "legal_entity_county_code",
+    "address_line1": "legal_entity_address_line1",
+    "address_line2": "legal_entity_address_line2",
+    "address_line3": "legal_entity_address_line3",
+    "zip4": "legal_entity_zip4",
+    "congressional_code": "legal_entity_congressional",
+    "zip_last4": "legal_entity_zip_last4",
+    "zip5": "legal_entity_zip5",
+}
+
+CONTRACT_FIELD_MAP = {"description": "award_description"}
+
+
+def generate_unique_award_id(row):
+    # Generate the unique Award ID
+    # "CONT_AW_" + agency_id + referenced_idv_agency_iden + piid + parent_award_id
+    return (
+        "CONT_AW_" +
+        (row["agency_id"] if row["agency_id"] else "-NONE-") +
+        "_" +
+        (row["referenced_idv_agency_iden"] if row["referenced_idv_agency_iden"] else "-NONE-") +
+        "_" +
+        (row["piid"] if row["piid"] else "-NONE-") +
+        "_" +
+        (row["parent_award_id"] if row["parent_award_id"] else "-NONE-")
+    )
+
+
+def parse_last_modified(row):
+    if row["last_modified"] and len(str(row["last_modified"])) == len("YYYY-MM-DD HH:MM:SS"):  # 19 characters
+        dt_fmt = "%Y-%m-%d %H:%M:%S"
+    else:
+        dt_fmt = "%Y-%m-%d %H:%M:%S.%f"  # try using this even if last_modified isn't a valid string
+
+    try:
+        return datetime.strptime(str(row["last_modified"]), dt_fmt).date()
+    except ValueError:  # handle odd-string formats and NULLs from the upstream FPDS-NG system
+        info_message = "Invalid value '{}' does not match: '{}'".format(row["last_modified"], dt_fmt)
+        logger.info(info_message)
+        return None
+
+
+def build_summary_award(row, generated_unique_id):
+    # The Award that Award.get_or_create_summary_award would create for the row
+    return Award(generated_unique_award_id=generated_unique_id, piid=row["piid"], is_fpds=True)
+
+
+def set_parent_award_piid(award, row):
+    award.parent_award_piid = row.get("parent_award_id")
+
 
 class Command(BaseCommand):
     help = "Sync USAspending DB FPDS data using Broker for new or modified records and S3 for deleted IDs"
@@ -117,31 +192,26 @@ class Command(BaseCommand):
             yield dictfetchall(db_cursor)  # this returns an OrderedDict
 
     def find_related_awards(self, transactions):
-        related_award_ids = [result[0] for result in transactions.values_list("award_id")]
-        tn_count = (
-            TransactionNormalized.objects.filter(award_id__in=related_award_ids)
+        # Compare, in a single query, the number of transactions of each related award with how many of them are
+        # among `transactions`
+        award_counts = (
+            TransactionNormalized.objects.filter(award_id__in=transactions.values("award_id"))
             .values("award_id")
-            .annotate(transaction_count=Count("id"))
-            .values_list("award_id", "transaction_count")
-        )
-        tn_count_filtered = (
-            transactions.values("award_id")
-            .annotate(transaction_count=Count("id"))
-            .values_list("award_id", "transaction_count")
+            .annotate(
+                transaction_count=Count("id"),
+                filtered_count=Sum(
+                    Case(When(id__in=transactions.values("id"), then=1), default=0, output_field=IntegerField())
+                ),
+            )
+            .values_list("award_id", "transaction_count", "filtered_count")
         )
-        tn_count_mapping = {award_id: transaction_count for award_id, transaction_count in tn_count}
-        tn_count_filtered_mapping = {award_id: transaction_count for award_id, transaction_count in tn_count_filtered}
         # only delete awards if and only if all their transactions are deleted, otherwise update the award
-        update_awards = [
-            award_id
-            for award_id, transaction_count in tn_count_mapping.items()
-            if tn_count_filtered_mapping[award_id] != transaction_count
-        ]
-        delete_awards = [
-            award_id
-            for award_id, transaction_count in tn_count_mapping.items()
-            if tn_count_filtered_mapping[award_id] == transaction_count
-        ]
+        update_awards, delete_awards = [], []
+        for award_id, transaction_count, filtered_count in award_counts:
+            if filtered_count != transaction_count:
+                update_awards.append(award_id)
+            else:
+                delete_awards.append(award_id)
         return update_awards, delete_awards
 
     def delete_stale_fpds(self, ids_to_delete):
@@ -185,50 +255,22 @@ class Command(BaseCommand):
             db_query = "".join(queries)
             db_cursor.execute(db_query, [])
 
-    def insert_all_new_fpds(self, total_insert):
+    def insert_all_new_fpds(self, total_insert, batch=False):
         for to_insert in self.fetch_fpds_data_generator(total_insert):
             start = time.perf_counter()
-            self.insert_new_fpds(to_insert=to_insert, total_rows=len(to_insert))
+            if batch:
+                self.upsert_fpds_batch(to_insert=to_insert)
+            else:
+                self.insert_new_fpds(to_insert=to_insert, total_rows=len(to_insert))
             logger.info("Insertion took {:.2f}s".format(time.perf_counter() - start))
 
     def insert_new_fpds(self, to_insert, total_rows):
-        place_of_performance_field_map = {
-            "location_country_code": "place_of_perform_country_c",
-            "country_name": "place_of_perf_country_desc",
-            "state_code": "place_of_performance_state",
-            "state_name": "place_of_perfor_state_desc",
-            "city_name": "place_of_perform_city_name",
-            "county_name": "place_of_perform_county_na",
-            "county_code": "place_of_perform_county_co",
-            "zip_4a": "place_of_performance_zip4a",
-            "congressional_code": "place_of_performance_congr",
-            "zip_last4": "place_of_perform_zip_last4",
-            "zip5": "place_of_performance_zip5",
-        }
-
-        legal_entity_location_field_map = {
-            "location_country_code": "legal_entity_country_code",
-            "country_name": "legal_entity_country_name",
-            "state_code": "legal_entity_state_code",
-            "state_name": "legal_entity_state_descrip",
-            "city_name": "legal_entity_city_name",
-            "county_name": "legal_entity_county_name",
-            "county_code": "legal_entity_county_code",
-            "address_line1": "legal_entity_address_line1",
-            "address_line2": "legal_entity_address_line2",
-            "address_line3": "legal_entity_address_line3",
-            "zip4": "legal_entity_zip4",
-            "congressional_code": "legal_entity_congressional",
-            "zip_last4": "legal_entity_zip_last4",
-            "zip5": "legal_entity_zip5",
-        }
-
         for index, row in enumerate(to_insert, 1):
             upper_case_dict_values(row)
 
             # Create new LegalEntityLocation and LegalEntity from the row data
             legal_entity_location = create_location(
-                legal_entity_location_field_map, row, {"recipient_flag": True, "is_fpds": True}
+                LEGAL_ENTITY_LOCATION_FIELD_MAP, row, {"recipient_flag": True, "is_fpds": True}
             )
             recipient_name = row["awardee_or_recipient_legal"]
             legal_entity = LegalEntity.objects.create(
@@ -244,24 +286,13 @@ class Command(BaseCommand):
             legal_entity = load_data_into_model(legal_entity, row, value_map=legal_entity_value_map, save=True)
 
             # Create the place of performance location
-            pop_location = create_location(place_of_performance_field_map, row, {"place_of_performance_flag": True})
+            pop_location = create_location(PLACE_OF_PERFORMANCE_FIELD_MAP, row, {"place_of_performance_flag": True})
 
             # Find the toptier awards from the subtier awards
-            awarding_agency = Agency.get_by_subtier_only(row["awarding_sub_tier_agency_c"])
-            funding_agency = Agency.get_by_subtier_only(row["funding_sub_tier_agency_co"])
-
-            # Generate the unique Award ID
-            # "CONT_AW_" + agency_id + referenced_idv_agency_iden + piid + parent_award_id
-            generated_unique_id = (
-                "CONT_AW_" +
-                (row["agency_id"] if row["agency_id"] else "-NONE-") +
-                "_" +
-                (row["referenced_idv_agency_iden"] if row["referenced_idv_agency_iden"] else "-NONE-") +
-                "_" +
-                (row["piid"] if row["piid"] else "-NONE-") +
-                "_" +
-                (row["parent_award_id"] if row["parent_award_id"] else "-NONE-")
-            )
+            awarding_agency = agency_resolver.get_by_subtier_only(row["awarding_sub_tier_agency_c"])
+            funding_agency = agency_resolver.get_by_subtier_only(row["funding_sub_tier_agency_co"])
+
+            generated_unique_id = generate_unique_award_id(row)
 
             # Create the summary Award
             (created, award) = Award.get_or_create_summary_award(
@@ -273,18 +304,6 @@ class Command(BaseCommand):
             # Append row to list of Awards updated
             AWARD_UPDATE_ID_LIST.append(award.id)
 
-            if row["last_modified"] and len(str(row["last_modified"])) == len("YYYY-MM-DD HH:MM:SS"):  # 19 characters
-                dt_fmt = "%Y-%m-%d %H:%M:%S"
-            else:
-                dt_fmt = "%Y-%m-%d %H:%M:%S.%f"  # try using this even if last_modified isn't a valid string
-
-            try:
-                last_mod_date = datetime.strptime(str(row["last_modified"]), dt_fmt).date()
-            except ValueError:  # handle odd-string formats and NULLs from the upstream FPDS-NG system
-                info_message = "Invalid value '{}' does not match: '{}'".format(row["last_modified"], dt_fmt)
-                logger.info(info_message)
-                last_mod_date = None
-
             award_type, award_type_desc = award_types(row)
 
             parent_txn_value_map = {
@@ -296,7 +315,7 @@ class Command(BaseCommand):
                 "period_of_performance_start_date": format_date(row["period_of_performance_star"]),
                 "period_of_performance_current_end_date": format_date(row["period_of_performance_curr"]),
                 "action_date": format_date(row["action_date"]),
-                "last_modified_date": last_mod_date,
+                "last_modified_date": parse_last_modified(row),
                 "transaction_unique_id": row["detached_award_proc_unique"],
                 "generated_unique_award_id": generated_unique_id,
                 "is_fpds": True,
@@ -304,12 +323,10 @@ class Command(BaseCommand):
                 "type_description": award_type_desc,
             }
 
-            contract_field_map = {"description": "award_description"}
-
             transaction_normalized_dict = load_data_into_model(
                 TransactionNormalized(),  # thrown away
                 row,
-                field_map=contract_field_map,
+                field_map=CONTRACT_FIELD_MAP,
                 value_map=parent_txn_value_map,
                 as_dict=True,
             )
@@ -343,6 +360,85 @@ class Command(BaseCommand):
             legal_entity.transaction_unique_id = detached_award_proc_unique
             legal_entity.save()
 
+    def upsert_fpds_batch(self, to_insert):
+        """
+        Set-based version of insert_new_fpds. Instead of a dozen round trips per row, the rows of a fetched chunk are
+        prepared in memory and each table is written with a bulk insert (or a staged bulk update) per chunk.
+        """
+        rows = dedupe_broker_rows(to_insert, "detached_award_proc_unique")
+
+        # Create the LegalEntity and place of performance Locations
+        legal_entity_locations = bulk_create_locations(
+            rows, LEGAL_ENTITY_LOCATION_FIELD_MAP, {"recipient_flag": True, "is_fpds": True}
+        )
+        pop_locations = bulk_create_locations(rows, PLACE_OF_PERFORMANCE_FIELD_MAP, {"place_of_performance_flag": True})
+
+        # Create the LegalEntities, already mapped back to their transaction
+        legal_entities = []
+        for row, legal_entity_location in zip(rows, legal_entity_locations):
+            recipient_name = row["awardee_or_recipient_legal"]
+            legal_entity = LegalEntity(
+                recipient_unique_id=row["awardee_or_recipient_uniqu"],
+                recipient_name=recipient_name if recipient_name is not None else "",
+            )
+            legal_entity_value_map = {
+                "location": legal_entity_location,
+                "business_categories": get_business_categories(row=row, data_type="fpds"),
+                "is_fpds": True,
+            }
+            set_legal_entity_boolean_fields(row)
+            legal_entity = load_data_into_model(legal_entity, row, value_map=legal_entity_value_map, save=False)
+            legal_entity.transaction_unique_id = row["detached_award_proc_unique"]
+            legal_entities.append(legal_entity)
+        LegalEntity.objects.bulk_create(legal_entities)
+
+        # Find or create the summary Awards, all of them pointing to their parent award
+        generated_unique_ids = [generate_unique_award_id(row) for row in rows]
+        awards = get_or_create_summary_awards(
+            rows, generated_unique_ids, build_summary_award, set_parent_award_piid, ["parent_award_piid"]
+        )
+
+        # Append the chunk's Awards to the list of Awards updated
+        AWARD_UPDATE_ID_LIST.extend(award.id for award in awards.values())
+
+        transactions = []
+        chunk = zip(rows, legal_entities, pop_locations, generated_unique_ids)
+        for row, legal_entity, pop_location, generated_unique_id in chunk:
+            award_type, award_type_desc = award_types(row)
+
+            parent_txn_value_map = {
+                "award": awards[generated_unique_id],
+                "awarding_agency": agency_resolver.get_by_subtier_only(row["awarding_sub_tier_agency_c"]),
+                "funding_agency": agency_resolver.get_by_subtier_only(row["funding_sub_tier_agency_co"]),
+                "recipient": legal_entity,
+                "place_of_performance": pop_location,
+                "period_of_performance_start_date": format_date(row["period_of_performance_star"]),
+                "period_of_performance_current_end_date": format_date(row["period_of_performance_curr"]),
+                "action_date": format_date(row["action_date"]),
+                "last_modified_date": parse_last_modified(row),
+                "transaction_unique_id": row["detached_award_proc_unique"],
+                "generated_unique_award_id": generated_unique_id,
+                "is_fpds": True,
+                "type": award_type,
+                "type_description": award_type_desc,
+            }
+
+            transaction_normalized_dict = load_data_into_model(
+                TransactionNormalized(),  # thrown away
+                row,
+                field_map=CONTRACT_FIELD_MAP,
+                value_map=parent_txn_value_map,
+                as_dict=True,
+            )
+
+            contract_instance = load_data_into_model(TransactionFPDS(), row, as_dict=True)  # thrown away
+            transactions.append((transaction_normalized_dict, contract_instance))
+
+        # Update the existing TransactionNormalized and TransactionFPDS, and create the new ones
+        created = upsert_transactions(rows, transactions, "detached_award_proc_unique", TransactionFPDS)
+
+        logger.info("Upserted {} FPDS transactions ({} new)".format(len(rows), created))
+
     def add_arguments(self, parser):
         parser.add_argument(
             "--date",
@@ -351,6 +447,12 @@ class Command(BaseCommand):
             type=str,
             help="(OPTIONAL) Date from which to start the nightly loader. Expected format: YYYY-MM-DD",
         )
+        parser.add_argument(
+            "--batch",
+            action="store_true",
+            dest="batch",
+            help="(OPTIONAL) Upsert each fetched chunk of FPDS records with set-based statements instead of row by row",
+        )
 
     @transaction.atomic
     def handle(self, *args, **options):
@@ -386,7 +488,7 @@ class Command(BaseCommand):
         if len(total_insert) > 0:
             # Add FPDS records
             with timer("insertion of new FPDS data in batches", logger.info):
-                self.insert_all_new_fpds(total_insert)
+                self.insert_all_new_fpds(total_insert, batch=options["batch"])
 
             # Update Awards based on changed FPDS records
             with timer("updating awards to reflect their latest associated transaction info", logger.info):
@@ -10,6 +10,7 @@ from usaspending_api.common.helpers.generic_helper import upper_case_dict_values
 from usaspending_api.etl.award_helpers import update_award_subawards
 from usaspending_api.etl.broker_etl_helpers import dictfetchall
 from usaspending_api.references.models import Agency, Cfda, RefCountryCode, RefCityCountyCode, LegalEntity
+from usaspending_api.references.reference_helpers import agency_resolver
 
 logger = logging.getLogger('console')
 exception_logger = logging.getLogger("exceptions")
@@ -531,7 +532,7 @@ def get_valid_awarding_agency(row):
 
     # Get the awarding agency
     if valid_subtier_code:
-        agency = Agency.get_by_subtier(agency_subtier_code)
+        agency = agency_resolver.get_by_subtier(agency_subtier_code)
 
     return agency
 
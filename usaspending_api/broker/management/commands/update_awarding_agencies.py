@@ -6,6 +6,7 @@ from usaspending_api.awards.models import TransactionNormalized, TransactionFABS
 from usaspending_api.awards.models import Award
 from usaspending_api.common.helpers.generic_helper import timer
 from usaspending_api.references.models import Agency
+from usaspending_api.references.reference_helpers import agency_resolver
 
 
 logger = logging.getLogger('console')
@@ -102,8 +103,10 @@ class Command(BaseCommand):
                 continue
 
             # Update awarding and funding agency if awarding of funding agency is empty
-            awarding_agency = Agency.get_by_toptier_subtier(row['awarding_cgac_code'], row['awarding_subtier_code'])
-            funding_agency = Agency.get_by_toptier_subtier(row['funding_cgac_code'], row['funding_subtier_code'])
+            awarding_agency = agency_resolver.get_by_toptier_subtier(row['awarding_cgac_code'],
+                                                                     row['awarding_subtier_code'])
+            funding_agency = agency_resolver.get_by_toptier_subtier(row['funding_cgac_code'],
+                                                                    row['funding_subtier_code'])
 
             # Find the agency that this award transaction belongs to. If it doesn't exist, create it.
             awarding_agency = agency_no_sub_map.get((
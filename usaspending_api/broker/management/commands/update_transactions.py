@@ -4,11 +4,12 @@ from usaspending_api.common.helpers.generic_helper import fy
 from django.core.management.base import BaseCommand
 from django.db import connections, transaction as db_transaction, IntegrityError
 
-from usaspending_api.etl.broker_etl_helpers import dictfetchall
+from usaspending_api.etl.broker_etl_helpers import dictfetchmany
 from usaspending_api.awards.models import TransactionNormalized, TransactionFABS, TransactionFPDS
 from usaspending_api.awards.models import Award
 from usaspending_api.common.helpers.generic_helper import timer
 from usaspending_api.references.models import Agency, LegalEntity, SubtierAgency, ToptierAgency, Location
+from usaspending_api.references.reference_helpers import agency_resolver, enrich_locations
 from usaspending_api.etl.management.load_base import copy, get_or_create_location, format_date, load_data_into_model
 from usaspending_api.etl.award_helpers import update_awards, update_contract_awards, update_award_categories
 
@@ -16,6 +17,9 @@ from usaspending_api.etl.award_helpers import update_awards, update_contract_awa
 logger = logging.getLogger('console')
 exception_logger = logging.getLogger("exceptions")
 
+# How many Broker rows are held and bulk created at a time, however large the page is
+BATCH_SIZE = 50000
+
 # Lists to store for update_awards and update_contract_awards
 award_update_id_list = []
 award_contract_update_id_list = []
@@ -38,7 +42,7 @@ class Command(BaseCommand):
     help = "Update historical transaction data for a fiscal year from the Broker."
 
     @staticmethod
-    def update_transaction_assistance(db_cursor, fiscal_year=None, page=1, limit=500000):
+    def update_transaction_assistance(fiscal_year=None, page=1, limit=500000):
 
         # logger.info("Getting IDs for what's currently in the DB...")
         # current_ids = TransactionFABS.objects
@@ -68,10 +72,16 @@ class Command(BaseCommand):
         logger.info("Executing query on Broker DB => " + query % (arguments[0], arguments[1],
                                                                   arguments[2], arguments[3]))
 
-        db_cursor.execute(query, arguments)
+        # A server-side cursor, so that each page is streamed from the Broker rather than fetched at once. Named
+        # cursors can only execute once, so each query gets its own.
+        with connections['data_broker'].chunked_cursor() as db_cursor:
+            db_cursor.execute(query, arguments)
+
+            for award_financial_assistance_data in dictfetchmany(db_cursor, BATCH_SIZE):
+                Command.load_transaction_assistance(award_financial_assistance_data)
 
-        logger.info("Running dictfetchall on db_cursor")
-        award_financial_assistance_data = dictfetchall(db_cursor)
+    @staticmethod
+    def load_transaction_assistance(award_financial_assistance_data):
 
         legal_entity_location_field_map = {
             "address_line1": "legal_entity_address_line1",
@@ -139,7 +149,7 @@ class Command(BaseCommand):
 
         logger.info('Bulk creating {} legal entity location rows...'.format(len(lel_bulk)))
         try:
-            Location.objects.bulk_create(lel_bulk)
+            Location.objects.bulk_create(enrich_locations(lel_bulk))
         except IntegrityError:
             logger.info('!!! DUPLICATES FOUND. Continuing... ')
 
@@ -155,7 +165,7 @@ class Command(BaseCommand):
 
         logger.info('Bulk creating {} place of performance rows...'.format(len(pop_bulk)))
         try:
-            Location.objects.bulk_create(pop_bulk)
+            Location.objects.bulk_create(enrich_locations(pop_bulk))
         except IntegrityError:
             logger.info('!!! DUPLICATES FOUND. Continuing... ')
 
@@ -212,11 +222,11 @@ class Command(BaseCommand):
                     row['funding_agency_code'] = funding_cgac_code
 
                 # Find the award that this award transaction belongs to. If it doesn't exist, create it.
-                awarding_agency = Agency.get_by_toptier_subtier(
+                awarding_agency = agency_resolver.get_by_toptier_subtier(
                     row['awarding_agency_code'],
                     row["awarding_sub_tier_agency_c"]
                 )
-                funding_agency = Agency.get_by_toptier_subtier(
+                funding_agency = agency_resolver.get_by_toptier_subtier(
                     row['funding_agency_code'],
                     row["funding_sub_tier_agency_co"]
                 )
@@ -292,7 +302,7 @@ class Command(BaseCommand):
 ######################################################
 
     @staticmethod
-    def update_transaction_contract(db_cursor, fiscal_year=None, page=1, limit=500000):
+    def update_transaction_contract(fiscal_year=None, page=1, limit=500000):
 
         # logger.info("Getting IDs for what's currently in the DB...")
         # current_ids = TransactionFPDS.objects
@@ -322,10 +332,16 @@ class Command(BaseCommand):
         logger.info("Executing query on Broker DB => " + query % (arguments[0], arguments[1],
                                                                   arguments[2], arguments[3]))
 
-        db_cursor.execute(query, arguments)
+        # A server-side cursor, so that each page is streamed from the Broker rather than fetched at once. Named
+        # cursors can only execute once, so each query gets its own.
+        with connections['data_broker'].chunked_cursor() as db_cursor:
+            db_cursor.execute(query, arguments)
 
-        logger.info("Running dictfetchall on db_cursor")
-        procurement_data = dictfetchall(db_cursor)
+            for procurement_data in dictfetchmany(db_cursor, BATCH_SIZE):
+                Command.load_transaction_contract(procurement_data)
+
+    @staticmethod
+    def load_transaction_contract(procurement_data):
 
         legal_entity_location_field_map = {
             "address_line1": "legal_entity_address_line1",
@@ -430,7 +446,7 @@ class Command(BaseCommand):
                     row['funding_agency_code'] = funding_cgac_code
 
                 # Find the award that this award transaction belongs to. If it doesn't exist, create it.
-                awarding_agency = Agency.get_by_toptier_subtier(
+                awarding_agency = agency_resolver.get_by_toptier_subtier(
                     row['awarding_agency_code'],
                     row["awarding_sub_tier_agency_c"]
                 )
@@ -448,8 +464,8 @@ class Command(BaseCommand):
                 parent_txn_value_map = {
                     "award": award,
                     "awarding_agency": awarding_agency,
-                    "funding_agency": Agency.get_by_toptier_subtier(row['funding_agency_code'],
-                                                                    row["funding_sub_tier_agency_co"]),
+                    "funding_agency": agency_resolver.get_by_toptier_subtier(row['funding_agency_code'],
+                                                                             row["funding_sub_tier_agency_co"]),
                     "recipient": legal_entity,
                     "place_of_performance": pop_location,
                     "period_of_performance_start_date": format_date(row['period_of_performance_star']),
@@ -526,7 +542,6 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         logger.info('Starting historical data load...')
 
-        db_cursor = connections['data_broker'].cursor()
         fiscal_year = options.get('fiscal_year')
         page = options.get('page')
         limit = options.get('limit')
@@ -542,11 +557,11 @@ class Command(BaseCommand):
 
         if not options['assistance']:
             with timer('D1 historical data load', logger.info):
-                self.update_transaction_contract(db_cursor=db_cursor, fiscal_year=fiscal_year, page=page, limit=limit)
+                self.update_transaction_contract(fiscal_year=fiscal_year, page=page, limit=limit)
 
         if not options['contracts']:
             with timer('D2 historical data load', logger.info):
-                self.update_transaction_assistance(db_cursor=db_cursor, fiscal_year=fiscal_year, page=page, limit=limit)
+                self.update_transaction_assistance(fiscal_year=fiscal_year, page=page, limit=limit)
 
         with timer('updating awards to reflect their latest associated transaction info', logger.info):
             update_awards(tuple(award_update_id_list))
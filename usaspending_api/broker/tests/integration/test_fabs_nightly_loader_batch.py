@@ -0,0 +1,107 @@
+import copy
+
+import pytest
+
+from usaspending_api.awards.models import Award, TransactionFABS, TransactionNormalized
+from usaspending_api.broker.management.commands import fabs_nightly_loader
+from usaspending_api.references.models import LegalEntity, Location
+
+
+def fabs_row(afa_generated_unique, **kwargs):
+    row = {
+        'published_award_financial_assistance_id': 1, 'afa_generated_unique': afa_generated_unique,
+        'record_type': 2, 'fain': 'FAIN1', 'uri': None, 'awarding_sub_tier_agency_c': '1700',
+        'funding_sub_tier_agency_co': None, 'awardee_or_recipient_legal': 'recipient one',
+        'awardee_or_recipient_uniqu': '123456789', 'ultimate_parent_unique_ide': None, 'business_types': 'R',
+        'business_types_desc': 'small business', 'assistance_type': '02', 'assistance_type_desc': 'block grant',
+        'award_description': 'description', 'federal_action_obligation': 100, 'action_date': '2018-09-30',
+        'period_of_performance_star': '2018-01-01', 'period_of_performance_curr': '2019-01-01',
+        'modified_at': '2018-10-01 12:00:00', 'legal_entity_country_code': 'USA', 'legal_entity_city_name': 'Reston',
+        'legal_entity_state_code': 'va', 'legal_entity_zip5': '20190', 'place_of_perform_country_c': 'USA',
+        'place_of_performance_city': 'Arlington', 'place_of_perfor_state_code': 'VA',
+    }
+    row.update(kwargs)
+    return row
+
+
+BROKER_ROWS = [
+    fabs_row('EXISTING_TRANSACTION', federal_action_obligation=200),
+    fabs_row('NEW_TRANSACTION', action_date='2018-10-01'),
+    # Record types 1 and 3 look the award up by uri and fain
+    fabs_row('NEW_URI_AWARD', record_type=1, fain=None, uri='uri1'),
+    fabs_row('NEW_FAIN_AWARD', record_type=3, fain='FAIN2'),
+    # Seen twice in the chunk: the last version wins
+    fabs_row('DUPLICATE', award_description='first version'),
+    fabs_row('DUPLICATE', award_description='second version', action_date='2019-10-01'),
+]
+
+
+def load_broker_rows(monkeypatch, batch):
+    # Created with fixed values, so both loads start from the same data
+    existing_award = Award.objects.create(generated_unique_award_id='ASST_AW_1700_FAIN1_-NONE-', fain='FAIN1')
+    existing_transaction = TransactionNormalized.objects.create(award=existing_award, action_date='2018-01-01')
+    TransactionFABS.objects.create(transaction=existing_transaction, afa_generated_unique='EXISTING_TRANSACTION',
+                                   federal_action_obligation=1)
+
+    rows = copy.deepcopy(BROKER_ROWS)
+    monkeypatch.setattr(fabs_nightly_loader.Command, 'fetch_fabs_data_generator', staticmethod(lambda ids: [rows]))
+    monkeypatch.setattr(fabs_nightly_loader, 'AWARD_UPDATE_ID_LIST', [])
+    fabs_nightly_loader.Command().insert_all_new_fabs(all_new_to_insert=[1], batch=batch)
+
+    # Row by row, each occurrence of a duplicated transaction gets its own LegalEntity and Locations, of which only
+    # the last stay referenced; only the referenced ones are compared
+    recipient_ids = TransactionNormalized.objects.values('recipient_id')
+    location_ids = set(TransactionNormalized.objects.values_list('place_of_performance_id', flat=True)) | set(
+        LegalEntity.objects.filter(legal_entity_id__in=recipient_ids).values_list('location_id', flat=True))
+    loaded = {
+        'transaction_normalized': values(
+            TransactionNormalized.objects.order_by('transaction_unique_id'),
+            ['award__generated_unique_award_id', 'recipient__recipient_name', 'place_of_performance__city_name'],
+            ['id', 'award_id', 'recipient_id', 'place_of_performance_id', 'create_date', 'update_date']),
+        'transaction_fabs': values(TransactionFABS.objects.order_by('afa_generated_unique'), [], ['transaction_id']),
+        'awards': values(Award.objects.order_by('generated_unique_award_id'), [],
+                         ['id', 'create_date', 'update_date', 'latest_transaction_id']),
+        'locations': values(Location.objects.filter(location_id__in=location_ids)
+                            .order_by('recipient_flag', 'city_name'), [],
+                            ['location_id', 'create_date', 'update_date']),
+        'legal_entities': values(LegalEntity.objects.filter(legal_entity_id__in=recipient_ids)
+                                 .order_by('transaction_unique_id'), ['location__city_name'],
+                                 ['legal_entity_id', 'location_id', 'create_date', 'update_date']),
+        'existing_award_updated': Award.objects.get(id=existing_award.id).update_date > existing_award.update_date,
+        'award_update_ids': sorted(set(Award.objects.filter(id__in=fabs_nightly_loader.AWARD_UPDATE_ID_LIST)
+                                       .values_list('generated_unique_award_id', flat=True))),
+    }
+
+    for model in (TransactionFABS, TransactionNormalized, Award, LegalEntity, Location):
+        model.objects.all().delete()
+    return loaded
+
+
+def values(queryset, related_fields, excluded_fields):
+    fields = [field.attname for field in queryset.model._meta.concrete_fields if field.attname not in excluded_fields]
+    return list(queryset.values(*(fields + related_fields)))
+
+
+@pytest.mark.django_db
+def test_batch_upsert_matches_row_by_row(monkeypatch):
+    row_by_row = load_broker_rows(monkeypatch, batch=False)
+    batch = load_broker_rows(monkeypatch, batch=True)
+
+    for table in row_by_row:
+        assert batch[table] == row_by_row[table], table
+
+    transactions = {transaction['transaction_unique_id']: transaction
+                    for transaction in batch['transaction_normalized']}
+    assert len(transactions) == 5
+    assert transactions['DUPLICATE']['description'] == 'SECOND VERSION'
+    assert transactions['DUPLICATE']['fiscal_year'] == 2020
+    assert transactions['NEW_TRANSACTION']['fiscal_year'] == 2019
+    assert transactions['EXISTING_TRANSACTION']['federal_action_obligation'] == 200
+    assert transactions['NEW_URI_AWARD']['award__generated_unique_award_id'] == 'ASST_AW_1700_-NONE-_URI1'
+
+    awards = {award['generated_unique_award_id']: award for award in batch['awards']}
+    assert awards['ASST_AW_1700_-NONE-_URI1']['uri'] == 'URI1'
+    assert awards['ASST_AW_1700_-NONE-_URI1']['fain'] is None
+    assert awards['ASST_AW_1700_FAIN2_-NONE-']['fain'] == 'FAIN2'
+    assert batch['existing_award_updated']
+    assert batch['award_update_ids'] == sorted(awards)
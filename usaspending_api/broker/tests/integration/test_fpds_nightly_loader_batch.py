@@ -0,0 +1,132 @@
+import copy
+
+import pytest
+from model_mommy import mommy
+
+from usaspending_api.awards.models import Award, TransactionFPDS, TransactionNormalized
+from usaspending_api.broker.management.commands import fpds_nightly_loader
+from usaspending_api.references.models import LegalEntity, Location
+
+
+def fpds_row(detached_award_proc_unique, **kwargs):
+    row = {
+        'detached_award_procurement_id': 1, 'detached_award_proc_unique': detached_award_proc_unique,
+        'agency_id': '9700', 'referenced_idv_agency_iden': None, 'piid': 'PIID1', 'parent_award_id': 'PARENT1',
+        'awarding_sub_tier_agency_c': '1700', 'funding_sub_tier_agency_co': None,
+        'awardee_or_recipient_legal': 'contractor one', 'awardee_or_recipient_uniqu': '123456789',
+        'ultimate_parent_unique_ide': None, 'small_business_competitive': 'true', 'contracting_officers_deter': 'S',
+        'pulled_from': 'award', 'contract_award_type': 'D', 'contract_award_type_desc': 'definitive contract',
+        'award_description': 'description', 'federal_action_obligation': 100, 'action_date': '2018-09-30',
+        'period_of_performance_star': '2018-01-01', 'period_of_performance_curr': '2019-01-01',
+        'last_modified': '2018-10-01 12:00:00', 'legal_entity_country_code': 'USA', 'legal_entity_city_name': 'Reston',
+        'legal_entity_state_code': 'va', 'legal_entity_zip5': '20190', 'place_of_perform_country_c': 'USA',
+        'place_of_perform_city_name': 'Arlington', 'place_of_performance_state': 'VA',
+    }
+    row.update(kwargs)
+    return row
+
+
+BROKER_ROWS = [
+    fpds_row('EXISTING_TRANSACTION', federal_action_obligation=200, parent_award_id='NEW_PARENT'),
+    fpds_row('NEW_TRANSACTION', action_date='2018-10-01', parent_award_id='NEW_PARENT'),
+    fpds_row('NEW_AWARD', piid='PIID2', parent_award_id=None, pulled_from='IDV', idv_type='B', type_of_idc='A',
+             type_of_idc_description='indefinite delivery'),
+    # Seen twice in the chunk: the last version wins
+    fpds_row('DUPLICATE', piid='PIID3', award_description='first version'),
+    fpds_row('DUPLICATE', piid='PIID3', award_description='second version', action_date='2019-10-01'),
+]
+
+
+def load_broker_rows(monkeypatch, batch):
+    # Created with fixed values, so both loads start from the same data
+    existing_award = Award.objects.create(generated_unique_award_id='CONT_AW_9700_-NONE-_PIID1_PARENT1',
+                                          piid='PIID1', parent_award_piid='PARENT1', is_fpds=True)
+    existing_transaction = TransactionNormalized.objects.create(award=existing_award, action_date='2018-01-01')
+    TransactionFPDS.objects.create(transaction=existing_transaction, detached_award_proc_unique='EXISTING_TRANSACTION',
+                                   federal_action_obligation=1)
+
+    rows = copy.deepcopy(BROKER_ROWS)
+    monkeypatch.setattr(fpds_nightly_loader.Command, 'fetch_fpds_data_generator', staticmethod(lambda ids: [rows]))
+    monkeypatch.setattr(fpds_nightly_loader, 'AWARD_UPDATE_ID_LIST', [])
+    fpds_nightly_loader.Command().insert_all_new_fpds(total_insert=[1], batch=batch)
+
+    # Row by row, each occurrence of a duplicated transaction gets its own LegalEntity and Locations, of which only
+    # the last stay referenced; only the referenced ones are compared
+    recipient_ids = TransactionNormalized.objects.values('recipient_id')
+    location_ids = set(TransactionNormalized.objects.values_list('place_of_performance_id', flat=True)) | set(
+        LegalEntity.objects.filter(legal_entity_id__in=recipient_ids).values_list('location_id', flat=True))
+    loaded = {
+        'transaction_normalized': values(
+            TransactionNormalized.objects.order_by('transaction_unique_id'),
+            ['award__generated_unique_award_id', 'recipient__recipient_name', 'place_of_performance__city_name'],
+            ['id', 'award_id', 'recipient_id', 'place_of_performance_id', 'create_date', 'update_date']),
+        'transaction_fpds': values(TransactionFPDS.objects.order_by('detached_award_proc_unique'), [],
+                                   ['transaction_id']),
+        'awards': values(Award.objects.order_by('generated_unique_award_id'), [],
+                         ['id', 'create_date', 'update_date', 'latest_transaction_id']),
+        'locations': values(Location.objects.filter(location_id__in=location_ids)
+                            .order_by('recipient_flag', 'city_name'), [],
+                            ['location_id', 'create_date', 'update_date']),
+        'legal_entities': values(LegalEntity.objects.filter(legal_entity_id__in=recipient_ids)
+                                 .order_by('transaction_unique_id'), ['location__city_name'],
+                                 ['legal_entity_id', 'location_id', 'create_date', 'update_date']),
+        'existing_award_updated': Award.objects.get(id=existing_award.id).update_date > existing_award.update_date,
+        'award_update_ids': sorted(set(Award.objects.filter(id__in=fpds_nightly_loader.AWARD_UPDATE_ID_LIST)
+                                       .values_list('generated_unique_award_id', flat=True))),
+    }
+
+    for model in (TransactionFPDS, TransactionNormalized, Award, LegalEntity, Location):
+        model.objects.all().delete()
+    return loaded
+
+
+def values(queryset, related_fields, excluded_fields):
+    fields = [field.attname for field in queryset.model._meta.concrete_fields if field.attname not in excluded_fields]
+    return list(queryset.values(*(fields + related_fields)))
+
+
+@pytest.mark.django_db
+def test_batch_upsert_matches_row_by_row(monkeypatch):
+    row_by_row = load_broker_rows(monkeypatch, batch=False)
+    batch = load_broker_rows(monkeypatch, batch=True)
+
+    for table in row_by_row:
+        assert batch[table] == row_by_row[table], table
+
+    transactions = {transaction['transaction_unique_id']: transaction
+                    for transaction in batch['transaction_normalized']}
+    assert len(transactions) == 4
+    assert transactions['DUPLICATE']['description'] == 'SECOND VERSION'
+    assert transactions['DUPLICATE']['fiscal_year'] == 2020
+    assert transactions['NEW_TRANSACTION']['fiscal_year'] == 2019
+    assert transactions['EXISTING_TRANSACTION']['federal_action_obligation'] == 200
+    assert transactions['NEW_AWARD']['type'] == 'IDV_B_A'
+
+    awards = {award['generated_unique_award_id']: award for award in batch['awards']}
+    # The last row of an award sets its parent award
+    assert awards['CONT_AW_9700_-NONE-_PIID1_PARENT1']['parent_award_piid'] == 'NEW_PARENT'
+    assert awards['CONT_AW_9700_-NONE-_PIID2_-NONE-']['parent_award_piid'] is None
+    assert awards['CONT_AW_9700_-NONE-_PIID2_-NONE-']['is_fpds']
+    assert batch['existing_award_updated']
+    assert batch['award_update_ids'] == sorted(awards)
+
+
+@pytest.mark.django_db
+def test_find_related_awards():
+    partly_deleted_award = mommy.make('awards.Award')
+    deleted_award = mommy.make('awards.Award')
+    untouched_award = mommy.make('awards.Award')
+    deleted_transaction_ids = [
+        mommy.make('awards.TransactionNormalized', award=partly_deleted_award).id,
+        mommy.make('awards.TransactionNormalized', award=deleted_award).id,
+        mommy.make('awards.TransactionNormalized', award=deleted_award).id,
+    ]
+    mommy.make('awards.TransactionNormalized', award=partly_deleted_award)
+    mommy.make('awards.TransactionNormalized', award=untouched_award)
+
+    update_awards, delete_awards = fpds_nightly_loader.Command().find_related_awards(
+        TransactionNormalized.objects.filter(id__in=deleted_transaction_ids))
+
+    # An award is only deleted along with all of its transactions
+    assert update_awards == [partly_deleted_award.id]
+    assert delete_awards == [deleted_award.id]
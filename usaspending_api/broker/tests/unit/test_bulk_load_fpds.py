@@ -0,0 +1,22 @@
+from usaspending_api.broker.management.commands.bulk_load_fpds import diff_sorted_ids
+
+
+def test_diff_sorted_ids():
+    to_insert, to_delete = diff_sorted_ids([1, 2, 4, 6, 7, 9], [2, 3, 4, 5, 9, 10])
+    assert to_insert == [1, 6, 7]
+    assert to_delete == [3, 5, 10]
+
+
+def test_diff_sorted_ids_matches_set_difference():
+    broker_ids = [1, 1, 3, 5, 8, 8, 13]
+    usaspending_ids = [2, 3, 3, 8, 21]
+
+    to_insert, to_delete = diff_sorted_ids(iter(broker_ids), iter(usaspending_ids))
+    assert to_insert == sorted(set(broker_ids) - set(usaspending_ids))
+    assert to_delete == sorted(set(usaspending_ids) - set(broker_ids))
+
+
+def test_diff_sorted_ids_empty():
+    assert diff_sorted_ids([], []) == ([], [])
+    assert diff_sorted_ids([1, 2], []) == ([1, 2], [])
+    assert diff_sorted_ids([], [1, 2]) == ([], [1, 2])
@@ -2,6 +2,7 @@ from datetime import datetime
 import logging
 
 from django.db import connection
+from psycopg2.extras import execute_values
 
 from usaspending_api.common.exceptions import InvalidParameterException
 from usaspending_api.common.helpers.sql_helpers import read_sql_file
@@ -59,3 +60,43 @@ def update_c_to_d_linkages(type):
     logger.info('Count of unlinked %s records after updates: %s' % (type, str(ending_unlinked_count)))
 
     logger.info('Finished all queries in %s seconds' % str(datetime.now() - total_start))
+
+
+def bulk_update(model, instances, fields, page_size=1000):
+    """
+    Writes `fields` of already saved model instances back to the database as a set: the new values are staged in a
+    temporary table, which is then joined to the model's table on its primary key in a single UPDATE.
+
+    Returns the number of rows updated.
+    """
+    if not instances:
+        return 0
+
+    quote_name = connection.ops.quote_name
+    pk_field = model._meta.pk
+    model_fields = [model._meta.get_field(field) for field in fields if model._meta.get_field(field) != pk_field]
+    table = quote_name(model._meta.db_table)
+    temp_table = quote_name('temp_{}_update'.format(model._meta.db_table))
+    columns = [quote_name(field.column) for field in [pk_field] + model_fields]
+
+    rows = [
+        [pk_field.get_db_prep_save(instance.pk, connection)] +
+        [field.get_db_prep_save(field.pre_save(instance, False), connection) for field in model_fields]
+        for instance in instances
+    ]
+
+    with connection.cursor() as cursor:
+        # Selecting from the table gives the staged values the table's column types, without its constraints
+        cursor.execute('CREATE TEMPORARY TABLE {} AS SELECT {} FROM {} WITH NO DATA'.format(
+            temp_table, ', '.join(columns), table))
+        execute_values(cursor.cursor, 'INSERT INTO {} ({}) VALUES %s'.format(temp_table, ', '.join(columns)),
+                       rows, page_size=page_size)
+        cursor.execute('UPDATE {table} AS t SET {values} FROM {temp_table} AS s WHERE t.{pk} = s.{pk}'.format(
+            table=table,
+            values=', '.join('{0} = s.{0}'.format(column) for column in columns[1:]),
+            temp_table=temp_table,
+            pk=columns[0]))
+        updated = cursor.rowcount
+        cursor.execute('DROP TABLE {}'.format(temp_table))
+
+    return updated
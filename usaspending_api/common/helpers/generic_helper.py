@@ -129,11 +129,17 @@ def min_and_max_from_date_ranges(filter_time_periods):
     return (dt.strptime(min_date, "%Y-%m-%d"), dt.strptime(max_date, "%Y-%m-%d"))
 
 
-def create_full_time_periods(min_date, max_date, group, columns):
-    cols = {col: 0 for col in columns.keys()}
-    fiscal_years = [int(fy) for fy in range(generate_fiscal_year(min_date), generate_fiscal_year(max_date) + 1)]
+def generate_fiscal_period_calendar(min_date, max_date, group):
+    """ Yields every (fiscal year, period) from the one of min_date to the one of max_date, in order
+
+        Args:
+            group: 'fy', 'quarter' or 'month'; for 'fy' the period is the fiscal year itself
+    """
+    first_fy, last_fy = generate_fiscal_year(min_date), generate_fiscal_year(max_date)
     if group == "fy":
-        return [{**cols, **{"time_period": {"fy": str(fy)}}} for fy in fiscal_years]
+        for fy in range(first_fy, last_fy + 1):
+            yield fy, fy
+        return
 
     if group == "month":
         period = int(generate_fiscal_month(min_date))
@@ -144,14 +150,21 @@ def create_full_time_periods(min_date, max_date, group, columns):
         ending = int(generate_fiscal_year_and_quarter(max_date).split('-Q')[-1])
         rollover = 4
 
-    results = []
-    for fy in fiscal_years:
-        while period <= rollover and not (period > ending and fy == fiscal_years[-1]):
-            results.append({**cols, **{"time_period": {"fy": str(fy), group: str(period)}}})
+    for fy in range(first_fy, last_fy + 1):
+        while period <= rollover and not (period > ending and fy == last_fy):
+            yield fy, period
             period += 1
         period = 1
 
-    return results
+
+def create_full_time_periods(min_date, max_date, group, columns):
+    cols = {col: 0 for col in columns.keys()}
+    if group == "fy":
+        return [{**cols, **{"time_period": {"fy": str(fy)}}}
+                for fy, _ in generate_fiscal_period_calendar(min_date, max_date, group)]
+
+    return [{**cols, **{"time_period": {"fy": str(fy), group: str(period)}}}
+            for fy, period in generate_fiscal_period_calendar(min_date, max_date, group)]
 
 
 def bolster_missing_time_periods(filter_time_periods, queryset, date_range_type, columns):
@@ -171,13 +184,13 @@ def bolster_missing_time_periods(filter_time_periods, queryset, date_range_type,
     min_date, max_date = min_and_max_from_date_ranges(filter_time_periods)
     results = create_full_time_periods(min_date, max_date, date_range_type, columns)
 
+    # Index the periods by their (fiscal year, period) so each row is matched in a single lookup
+    results_by_period = {(item["time_period"]["fy"], item["time_period"][date_range_type]): item for item in results}
     for row in queryset:
-        for item in results:
-            same_year = str(item["time_period"]["fy"]) == str(row["fy"])
-            same_period = str(item["time_period"][date_range_type]) == str(row[date_range_type])
-            if same_year and same_period:
-                for column_name, column_in_queryset in columns.items():
-                    item[column_name] = row[column_in_queryset]
+        item = results_by_period.get((str(row["fy"]), str(row[date_range_type])))
+        if item is not None:
+            for column_name, column_in_queryset in columns.items():
+                item[column_name] = row[column_in_queryset]
 
     for result in results:
         result['time_period']['fiscal_year'] = result['time_period']['fy']
@@ -0,0 +1,42 @@
+import pytest
+
+from model_mommy import mommy
+
+from usaspending_api.awards.models import Award, TransactionFABS, TransactionNormalized
+from usaspending_api.common.helpers.etl_helpers import bulk_update
+
+
+@pytest.mark.django_db
+def test_bulk_update():
+    award = mommy.make(Award, id=1)
+    mommy.make(TransactionNormalized, id=1, award=award, description='old 1', action_date='2018-01-01')
+    mommy.make(TransactionNormalized, id=2, award=award, description='old 2', action_date='2018-01-01')
+    mommy.make(TransactionNormalized, id=3, award=award, description='untouched', action_date='2018-01-01')
+
+    updated = bulk_update(
+        TransactionNormalized,
+        [
+            TransactionNormalized(id=1, award_id=1, description='new 1', action_date='2018-10-01'),
+            TransactionNormalized(id=2, award_id=1, description=None, action_date='2018-01-01'),
+        ],
+        ['description', 'action_date'],
+    )
+
+    assert updated == 2
+    transactions = TransactionNormalized.objects.order_by('id')
+    assert [str(t.action_date) for t in transactions] == ['2018-10-01', '2018-01-01', '2018-01-01']
+    assert [t.description for t in transactions] == ['new 1', None, 'untouched']
+
+
+@pytest.mark.django_db
+def test_bulk_update_one_to_one_primary_key():
+    transaction = mommy.make(TransactionNormalized, id=1)
+    mommy.make(TransactionFABS, transaction=transaction, afa_generated_unique='ABC', fain='OLD')
+
+    bulk_update(TransactionFABS, [TransactionFABS(transaction_id=1, fain='NEW')], {'fain'})
+
+    assert TransactionFABS.objects.get(afa_generated_unique='ABC').fain == 'NEW'
+
+
+def test_bulk_update_nothing_to_update():
+    assert bulk_update(TransactionNormalized, [], ['description']) == 0
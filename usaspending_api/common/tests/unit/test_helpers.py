@@ -9,8 +9,10 @@ from django_mock_queries.query import MockSet
 import pytest
 
 # Imports from your apps
+from usaspending_api.common.helpers.generic_helper import bolster_missing_time_periods
 from usaspending_api.common.helpers.generic_helper import check_valid_toptier_agency
 from usaspending_api.common.helpers.generic_helper import generate_fiscal_period
+from usaspending_api.common.helpers.generic_helper import generate_fiscal_period_calendar
 from usaspending_api.common.helpers.generic_helper import generate_fiscal_year
 
 
@@ -106,3 +108,22 @@ def test_malformed_date_month_year():
     date = datetime.strptime('10/2018', '%m/%Y').date
     with pytest.raises(Exception):
         generate_fiscal_year(date)
+
+
+def test_generate_fiscal_period_calendar():
+    min_date = datetime.strptime('2018-08-01', '%Y-%m-%d')
+    max_date = datetime.strptime('2019-01-01', '%Y-%m-%d')
+    assert list(generate_fiscal_period_calendar(min_date, max_date, 'fy')) == [(2018, 2018), (2019, 2019)]
+    assert list(generate_fiscal_period_calendar(min_date, max_date, 'quarter')) == [(2018, 4), (2019, 1), (2019, 2)]
+    assert list(generate_fiscal_period_calendar(min_date, max_date, 'month')) == [
+        (2018, 11), (2018, 12), (2019, 1), (2019, 2), (2019, 3), (2019, 4)]
+
+
+def test_bolster_missing_time_periods():
+    time_periods = [{'start_date': '2018-10-01', 'end_date': '2019-03-31'}]
+    queryset = [{'fy': 2019, 'quarter': 2, 'sum': 12.0}, {'fy': 2020, 'quarter': 1, 'sum': 5.0}]
+    results = bolster_missing_time_periods(time_periods, queryset, 'quarter', {'aggregated_amount': 'sum'})
+    assert results == [
+        {'aggregated_amount': 0, 'time_period': {'fiscal_year': '2019', 'quarter': '1'}},
+        {'aggregated_amount': 12.0, 'time_period': {'fiscal_year': '2019', 'quarter': '2'}},
+    ]
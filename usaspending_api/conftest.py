@@ -12,12 +12,23 @@ from django_mock_queries.query import MockSet
 # Imports from your apps
 from usaspending_api.common.helpers.generic_helper import generate_matviews
 from usaspending_api.etl.broker_etl_helpers import PhonyCursor
+from usaspending_api.references.helpers import clear_reference_data_cache
+from usaspending_api.references.reference_helpers import agency_resolver, city_county_index
 
 
 logger = logging.getLogger('console')
 VALID_DB_CURSORS = ['default', 'data_broker']
 
 
+@pytest.fixture(autouse=True)
+def reset_reference_data_cache():
+    """Reference tables are mocked or created per test, so they must not be served from a previous test's cache"""
+    clear_reference_data_cache()
+    agency_resolver.invalidate()
+    city_county_index.invalidate()
+    yield
+
+
 @pytest.fixture()
 def mock_db_cursor(monkeypatch, request):
     db_cursor_dict = request.param
@@ -41,11 +41,43 @@ def es_client_query(index, body, timeout="1m", retries=1):
     return None
 
 
+def es_client_msearch(searches, retries=1):
+    """Runs several (index, body) searches in a single _msearch round trip; returns the list of their responses"""
+    if CLIENT is None:
+        create_es_client()
+    if CLIENT is None:  # If CLIENT is still None, don't even attempt to connect to the cluster
+        retries = 0
+    elif retries > 20:
+        retries = 20
+    elif retries < 1:
+        retries = 1
+    body = []
+    for index, search_body in searches:
+        body.extend([{"index": index}, search_body])
+    for attempt in range(retries):
+        response = _es_msearch(body=body)
+        if response is None:
+            logger.info("Failure using these: body={}".format(json.dumps(body)))
+        else:
+            return response["responses"]
+    logger.error("Unable to reach elasticsearch cluster. {} attempt(s) made".format(retries))
+    return None
+
+
 def _es_search(index, body, timeout):
+    return _es_call("search", index=index, body=body, timeout=timeout)
+
+
+def _es_msearch(body):
+    return _es_call("msearch", body=body)
+
+
+def _es_call(client_method, **kwargs):
+    """Calls the named Elasticsearch client method, logging any error and returning None in its place"""
     error_template = "[ERROR] ({type}) with ElasticSearch cluster: {e}"
     result = None
     try:
-        result = CLIENT.search(index=index, body=body, timeout=timeout)
+        result = getattr(CLIENT, client_method)(**kwargs)
     except NameError as e:
         logger.error(error_template.format(type="Hostname", e=str(e)))
     except (ConnectionError, ConnectionTimeout) as e:
@@ -11,4 +11,8 @@ REFRESH MATERIALIZED VIEW CONCURRENTLY summary_view_cfda_number;
 REFRESH MATERIALIZED VIEW CONCURRENTLY summary_view_naics_codes;
 REFRESH MATERIALIZED VIEW CONCURRENTLY summary_view_psc_codes;
 REFRESH MATERIALIZED VIEW CONCURRENTLY universal_award_matview;
-REFRESH MATERIALIZED VIEW CONCURRENTLY universal_transaction_matview;
\ No newline at end of file
+REFRESH MATERIALIZED VIEW CONCURRENTLY universal_transaction_matview;
+
+-- Award downloads are reused until the matviews they read from change
+INSERT INTO download_data_watermark (data_type, update_date) VALUES ('award', NOW())
+ON CONFLICT (data_type) DO UPDATE SET update_date = EXCLUDED.update_date;
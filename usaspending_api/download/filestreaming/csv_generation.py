@@ -1,22 +1,26 @@
+import io
 import json
 import logging
 import multiprocessing
 import os
 import re
 import shutil
+import signal
 import subprocess
+import sys
 import tempfile
 import time
 import zipfile
-import csv
 
+from contextlib import contextmanager
 from django.conf import settings
+from django.db.models import Max, Min
 
 from usaspending_api.awards.v2.lookups.lookups import contract_type_mapping, assistance_type_mapping, idv_type_mapping
 from usaspending_api.common.helpers.generic_helper import generate_raw_quoted_query
 from usaspending_api.common.exceptions import InvalidParameterException
 from usaspending_api.download.helpers import (verify_requested_columns_available, multipart_upload, split_csv,
-                                              write_to_download_log as write_to_log)
+                                              split_csv_stream, write_to_download_log as write_to_log)
 from usaspending_api.download.filestreaming.csv_source import CsvSource
 from usaspending_api.download.lookups import JOB_STATUS_DICT, VALUE_MAPPINGS
 
@@ -24,6 +28,10 @@ DOWNLOAD_VISIBILITY_TIMEOUT = 60*10
 MAX_VISIBILITY_TIMEOUT = 60*60*4
 EXCEL_ROW_LIMIT = 1000000
 WAIT_FOR_PROCESS_SLEEP = 5
+# A partitioned source is split into this many id ranges per partition worker, so uneven ranges still balance out
+SLICES_PER_PARTITION_WORKER = 4
+# Requests limited to fewer rows than this are not worth partitioning
+PARTITION_MIN_LIMIT = 100000
 
 logger = logging.getLogger('console')
 
@@ -50,9 +58,15 @@ def generate_csvs(download_job, sqs_message=None):
         # Generate sources from the JSON request object
         sources = get_csv_sources(json_request)
         for source in sources:
-            # Parse and write data to the file
             download_job.number_of_columns = max(download_job.number_of_columns, len(source.columns(columns)))
-            parse_source(source, columns, download_job, working_dir, start_time, sqs_message, file_path, limit)
+
+        if settings.DOWNLOAD_PARTITION_WORKERS > 1 and (not limit or limit >= PARTITION_MIN_LIMIT):
+            # Run every source's id range slices concurrently, writing them to the file in order as they finish
+            parse_sources_in_partitions(sources, columns, download_job, working_dir, sqs_message, file_path, limit)
+        else:
+            for source in sources:
+                # Parse and write data to the file
+                parse_source(source, columns, download_job, working_dir, start_time, sqs_message, file_path, limit)
         download_job.file_size = os.stat(file_path).st_size
     except Exception as e:
         # Set error message; job_status_id will be set in generate_zip.handle()
@@ -130,45 +144,37 @@ def get_csv_sources(json_request):
     return csv_sources
 
 
-def parse_source(source, columns, download_job, working_dir, start_time, message, zipfile_path, limit):
-    """Write to csv and zip files using the source data"""
+def get_source_name(source, download_job):
     d_map = {'d1': 'contracts', 'd2': 'assistance', 'treasury_account': 'treasury_account',
              'federal_account': 'federal_account'}
     if download_job and download_job.monthly_download:
         # Use existing detailed filename from parent file for monthly files
         # e.g. `019_Assistance_Delta_20180917_%s.csv`
-        source_name = strip_file_extension(download_job.file_name)
-    else:
-        source_name = '{}_{}_{}'.format(source.agency_code, d_map[source.file_type],
-                                        VALUE_MAPPINGS[source.source_type]['download_name'])
+        return strip_file_extension(download_job.file_name)
+    return '{}_{}_{}'.format(source.agency_code, d_map[source.file_type],
+                             VALUE_MAPPINGS[source.source_type]['download_name'])
+
+
+def parse_source(source, columns, download_job, working_dir, start_time, message, zipfile_path, limit):
+    """Write to csv and zip files using the source data"""
+    source_name = get_source_name(source, download_job)
     source_query = source.row_emitter(columns)
-    source_path = os.path.join(working_dir, '{}.csv'.format(source_name))
 
     # Generate the query file; values, limits, dates fixed
     temp_file, temp_file_path = generate_temp_query_file(source_query, limit, source, download_job, columns)
 
     start_time = time.time()
+    row_count = multiprocessing.Value('q', 0)
     try:
-        # Create a separate process to run the PSQL command; wait
-        psql_process = multiprocessing.Process(target=execute_psql, args=(temp_file_path, source_path, download_job,))
+        # Create a separate process to stream the PSQL output into split CSVs within the zip; wait
+        psql_process = multiprocessing.Process(target=execute_psql_to_zip,
+                                               args=(temp_file_path, zipfile_path, working_dir, source_name, row_count,
+                                                     download_job,))
         psql_process.start()
         wait_for_process(psql_process, start_time, download_job, message)
 
-        # The process below modifies the download job and thus cannot be in a separate process
-        # Assuming the process to count the number of lines in a CSV file takes less than DOWNLOAD_VISIBILITY_TIMEOUT
-        #  in case the visibility times out before then
-        if message:
-            message.change_visibility(VisibilityTimeout=DOWNLOAD_VISIBILITY_TIMEOUT)
-        # Log how many rows we have
-        with open(source_path, 'r') as source_csv:
-            download_job.number_of_rows += sum(1 for row in csv.reader(source_csv)) - 1
-            download_job.save()
-
-        # Create a separate process to split the large csv into smaller csvs and write to zip; wait
-        zip_process = multiprocessing.Process(target=split_and_zip_csvs, args=(zipfile_path, source_path, source_name,
-                                                                               download_job))
-        zip_process.start()
-        wait_for_process(zip_process, start_time, download_job, message)
+        # Log how many rows we have; counted while streaming, so the CSVs never need to be re-read
+        download_job.number_of_rows += row_count.value
         download_job.save()
     except Exception as e:
         raise e
@@ -178,6 +184,130 @@ def parse_source(source, columns, download_job, working_dir, start_time, message
         os.remove(temp_file_path)
 
 
+def parse_sources_in_partitions(sources, columns, download_job, working_dir, message, zipfile_path, limit):
+    """Write to csv and zip files using the source data, querying id range slices of every source concurrently
+
+    Each slice runs as its own PSQL process, at most DOWNLOAD_PARTITION_WORKERS at a time. Meanwhile a zip process
+    streams the slices into the zip source by source and slice by slice, as soon as each one is finished, so the file
+    layout matches parse_source and only the slices waiting their turn are kept on disk. With a limit, every slice is
+    limited too and the zip process stops once a source has that many rows.
+    """
+    start_time = time.time()
+    temp_files = []
+    source_slices = []
+    try:
+        slice_processes = []
+        for source_index, source in enumerate(sources):
+            slice_paths = []
+            for slice_index, slice_query in enumerate(get_source_slices(source, columns)):
+                temp_file, temp_file_path = generate_temp_query_file(slice_query, limit, source, download_job, columns)
+                temp_files.append((temp_file, temp_file_path))
+
+                slice_path = os.path.join(working_dir, 'slice_{}_{}.csv'.format(source_index, slice_index))
+                slice_paths.append(slice_path)
+                slice_processes.append(multiprocessing.Process(target=execute_psql_slice,
+                                                               args=(temp_file_path, slice_path, download_job,)))
+            source_slices.append((get_source_name(source, download_job), slice_paths))
+
+        row_counts = [multiprocessing.Value('q', 0) for _ in source_slices]
+        zip_process = multiprocessing.Process(target=zip_csv_slices,
+                                              args=(source_slices, zipfile_path, working_dir, row_counts, limit,
+                                                    download_job,))
+
+        write_to_log(message='Running {} slices on {} processes'.format(
+            len(slice_processes), settings.DOWNLOAD_PARTITION_WORKERS), download_job=download_job)
+        run_processes(slice_processes, settings.DOWNLOAD_PARTITION_WORKERS, start_time, download_job, message,
+                      consumer=zip_process)
+
+        download_job.number_of_rows += sum(row_count.value for row_count in row_counts)
+        download_job.save()
+    finally:
+        # Remove temporary files, and any slices left behind by stopped processes
+        for temp_file, temp_file_path in temp_files:
+            os.close(temp_file)
+            os.remove(temp_file_path)
+        for source_name, slice_paths in source_slices:
+            for slice_path in slice_paths:
+                for leftover_path in (slice_path, slice_path + '.part'):
+                    if os.path.exists(leftover_path):
+                        os.remove(leftover_path)
+
+
+def get_source_slices(source, columns):
+    """Splits the source's query into id ranges, or returns it whole if it can't be partitioned"""
+    source_query = source.row_emitter(columns)
+    partition_field = VALUE_MAPPINGS[source.source_type].get('partition_field')
+    if not partition_field:
+        return [source_query]
+
+    bounds = source.queryset.aggregate(min_value=Min(partition_field), max_value=Max(partition_field))
+    if bounds['min_value'] is None:
+        return [source_query]
+
+    return [source_query.filter(**{'{}__gte'.format(partition_field): range_start,
+                                   '{}__lt'.format(partition_field): range_end})
+            for range_start, range_end in get_id_ranges(bounds['min_value'], bounds['max_value'],
+                                                        settings.DOWNLOAD_PARTITION_WORKERS *
+                                                        SLICES_PER_PARTITION_WORKER)]
+
+
+def get_id_ranges(min_id, max_id, slice_count):
+    """Splits [min_id, max_id] into at most slice_count consecutive, equally wide [start, end) ranges"""
+    range_width = -(-(max_id - min_id + 1) // slice_count)
+    return [(range_start, min(range_start + range_width, max_id + 1))
+            for range_start in range(min_id, max_id + 1, range_width)]
+
+
+def execute_psql_slice(temp_sql_file_path, slice_path, download_job):
+    """Executes a slice's PSQL command, only putting its CSV at slice_path once it is complete"""
+    execute_psql(temp_sql_file_path, slice_path + '.part', download_job)
+    os.rename(slice_path + '.part', slice_path)
+
+
+def zip_csv_slices(source_slices, zipfile_path, working_dir, row_counts, limit, download_job):
+    """Streams each source's CSV slices, in order and keeping only the first header, into split CSVs in the zip"""
+    try:
+        with zipfile.ZipFile(zipfile_path, 'a', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zipped_csvs:
+            for (source_name, slice_paths), row_count in zip(source_slices, row_counts):
+                log_time = time.time()
+                row_count.value = write_csv_stream_to_zip(chain_csv_slices(slice_paths), zipped_csvs, working_dir,
+                                                          source_name, max_rows=limit)
+                write_to_log(message='Wrote {} rows of {} to zip from {} slices, took {} seconds'.format(
+                    row_count.value, source_name, len(slice_paths), time.time() - log_time),
+                    download_job=download_job)
+    except Exception as e:
+        logger.error(e)
+        raise e
+
+
+def chain_csv_slices(slice_paths):
+    """Yields the lines of each CSV slice in order, skipping the header of all but the first, waiting for each slice
+    to be finished"""
+    for slice_index, slice_path in enumerate(slice_paths):
+        while not os.path.exists(slice_path):
+            time.sleep(WAIT_FOR_PROCESS_SLEEP / 5)
+        with open(slice_path, 'r', newline='') as slice_file:
+            header = slice_file.readline()
+            if slice_index == 0:
+                yield header
+            for line in slice_file:
+                yield line
+        os.remove(slice_path)
+
+
+def write_csv_stream_to_zip(csv_stream, zipped_csvs, working_dir, source_name, max_rows=None):
+    """Splits the CSV stream every EXCEL_ROW_LIMIT rows into the open zip, stopping after max_rows rows if given;
+    returns the number of rows written"""
+    output_template = '{}_%s.csv'.format(source_name)
+    rows_written = 0
+    for split_csv_part, part_rows in split_csv_stream(csv_stream, working_dir, row_limit=EXCEL_ROW_LIMIT,
+                                                      output_name_template=output_template, max_rows=max_rows):
+        zipped_csvs.write(split_csv_part, os.path.basename(split_csv_part))
+        os.remove(split_csv_part)
+        rows_written += part_rows
+    return rows_written
+
+
 def split_and_zip_csvs(zipfile_path, source_path, source_name, download_job=None):
     try:
         # Split CSV into separate files
@@ -237,6 +367,81 @@ def finish_download(download_job):
     return download_job.file_name
 
 
+def run_processes(processes, max_processes, start_time, download_job, message, consumer=None):
+    """Run the processes, at most max_processes at a time; throw errors for timeouts or Process exceptions
+
+    A consumer process runs alongside them, outside of max_processes, and is waited for too. Once it has finished, any
+    processes still running or pending are no longer needed and are stopped.
+    """
+    pending = list(processes)
+    running = []
+    if consumer:
+        consumer.start()
+        running.append(consumer)
+    while pending or running:
+        if consumer and not consumer.is_alive() and consumer.exitcode == 0:
+            terminate_processes(running)
+            return
+
+        while pending and len([process for process in running if process is not consumer]) < max_processes:
+            process = pending.pop(0)
+            process.start()
+            running.append(process)
+
+        if message:
+            message.change_visibility(VisibilityTimeout=DOWNLOAD_VISIBILITY_TIMEOUT)
+
+        for process in list(running):
+            if not process.is_alive():
+                running.remove(process)
+                if process.exitcode != 0:
+                    terminate_processes(running)
+                    raise Exception('Command failed. Please see the logs for details.')
+
+        if (time.time() - start_time) >= MAX_VISIBILITY_TIMEOUT:
+            for process in running:
+                write_to_log(message='Attempting to terminate process (pid {})'.format(process.pid),
+                             download_job=download_job, is_error=True)
+            terminate_processes(running)
+            raise TimeoutError('DownloadJob {} lasted longer than {} hours'.format(
+                download_job.download_job_id, str(MAX_VISIBILITY_TIMEOUT / 3600)))
+
+        if running:
+            time.sleep(WAIT_FOR_PROCESS_SLEEP / 5)
+
+
+def terminate_processes(processes):
+    """Sends SIGTERM to the processes, which stop their PSQL commands on it, and waits for them to exit"""
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+@contextmanager
+def sigterm_stops_subprocesses():
+    """While in the block, SIGTERM kills the process group of each subprocess added to the yielded list, then exits
+
+    PSQL commands are started in their own session, so they can be killed along with anything they started; without
+    this, terminating the Python process that started them leaves them running their queries.
+    """
+    subprocesses = []
+
+    def handle_sigterm(signum, frame):
+        for subprocess_to_kill in subprocesses:
+            try:
+                os.killpg(subprocess_to_kill.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(128 + signum)
+
+    previous_handler = signal.signal(signal.SIGTERM, handle_sigterm)
+    try:
+        yield subprocesses
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+
+
 def wait_for_process(process, start_time, download_job, message):
     """Wait for the process to complete, throw errors for timeouts or Process exceptions"""
     log_time = time.time()
@@ -259,6 +464,7 @@ def wait_for_process(process, start_time, download_job, message):
             write_to_log(message='Attempting to terminate process (pid {})'.format(process.pid),
                          download_job=download_job, is_error=True)
             process.terminate()
+            process.join()
             e = TimeoutError('DownloadJob {} lasted longer than {} hours'.format(download_job.download_job_id,
                                                                                  str(MAX_VISIBILITY_TIMEOUT / 3600)))
         else:
@@ -331,9 +537,14 @@ def execute_psql(temp_sql_file_path, source_path, download_job):
     try:
         log_time = time.time()
 
-        cat_command = subprocess.Popen(['cat', temp_sql_file_path], stdout=subprocess.PIPE)
-        subprocess.check_output(['psql', '-o', source_path, retrieve_db_string(), '-v', 'ON_ERROR_STOP=1'],
-                                stdin=cat_command.stdout, stderr=subprocess.STDOUT)
+        with open(temp_sql_file_path, 'r') as sql_file, sigterm_stops_subprocesses() as subprocesses:
+            psql_process = subprocess.Popen(['psql', '-o', source_path, retrieve_db_string(), '-v', 'ON_ERROR_STOP=1'],
+                                            stdin=sql_file, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                            start_new_session=True)
+            subprocesses.append(psql_process)
+            psql_output = psql_process.communicate()[0]
+        if psql_process.returncode != 0:
+            raise subprocess.CalledProcessError(psql_process.returncode, '[redacted]', psql_output)
 
         write_to_log(message='Wrote {}, took {} seconds'.format(os.path.basename(source_path), time.time() - log_time),
                      download_job=download_job)
@@ -353,6 +564,49 @@ def execute_psql(temp_sql_file_path, source_path, download_job):
         raise e
 
 
+def execute_psql_to_zip(temp_sql_file_path, zipfile_path, working_dir, source_name, row_count, download_job):
+    """Executes a single PSQL command within its own Subprocess, streaming its output into split CSVs in the zip
+
+    The \\copy output is read once: rows are counted into `row_count` and split every EXCEL_ROW_LIMIT rows as they
+    arrive, and each finished piece is added to the zip and removed before the next one is written.
+    """
+    try:
+        log_time = time.time()
+
+        with open(temp_sql_file_path, 'r') as sql_file, tempfile.TemporaryFile() as psql_errors, \
+                sigterm_stops_subprocesses() as subprocesses:
+            psql_process = subprocess.Popen(['psql', retrieve_db_string(), '-v', 'ON_ERROR_STOP=1'], stdin=sql_file,
+                                            stdout=subprocess.PIPE, stderr=psql_errors, start_new_session=True)
+            subprocesses.append(psql_process)
+            psql_output = io.TextIOWrapper(psql_process.stdout, encoding='utf-8', newline='')
+
+            with zipfile.ZipFile(zipfile_path, 'a', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zipped_csvs:
+                row_count.value = write_csv_stream_to_zip(psql_output, zipped_csvs, working_dir, source_name)
+
+            psql_output.close()
+            if psql_process.wait() != 0:
+                psql_errors.seek(0)
+                raise subprocess.CalledProcessError(psql_process.returncode, '[redacted]', psql_errors.read())
+
+        write_to_log(message='Wrote {} rows of {} to zip, took {} seconds'.format(
+            row_count.value, source_name, time.time() - log_time),
+                     download_job=download_job)
+    except subprocess.CalledProcessError as e:
+        # Not logging the command as it can contain the database connection string
+        logger.error(e)
+        logger.error(e.output)
+        # temp file contains '\copy ([SQL]) To STDOUT with CSV HEADER' so the SQL is 7 chars in up to the last 27 chars
+        sql = subprocess.check_output(['cat', temp_sql_file_path]).decode()[7:-27]
+        logger.error('Faulty SQL: {}'.format(sql))
+        raise e
+    except Exception as e:
+        logger.error(e)
+        # temp file contains '\copy ([SQL]) To STDOUT with CSV HEADER' so the SQL is 7 chars in up to the last 27 chars
+        sql = subprocess.check_output(['cat', temp_sql_file_path]).decode()[7:-27]
+        logger.error('Faulty SQL: {}'.format(sql))
+        raise e
+
+
 def retrieve_db_string():
     """It is necessary for this to be a function so the test suite can mock the connection string"""
     return os.environ['DOWNLOAD_DATABASE_URL']
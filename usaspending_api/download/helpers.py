@@ -1,5 +1,6 @@
 import boto3
 import csv
+import hashlib
 import logging
 import math
 import os
@@ -7,9 +8,14 @@ import pandas as pd
 
 from datetime import datetime
 from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
 from rest_framework.exceptions import ParseError
 
+from usaspending_api.broker.models import ExternalDataLoadDate
 from usaspending_api.common.exceptions import InvalidParameterException
+from usaspending_api.download.models import DownloadDataWatermark
+from usaspending_api.submissions.models import SubmissionAttributes
 
 logger = logging.getLogger('console')
 
@@ -96,6 +102,31 @@ def verify_requested_columns_available(sources, requested):
         raise InvalidParameterException('Unknown columns: {}'.format(bad_cols))
 
 
+def get_data_load_watermark(request_type):
+    """Returns a string that changes whenever the data behind a request_type's downloads is loaded or removed
+
+    Submission loads and deletions stamp the 'account' watermark, and refreshing the matviews stamps the 'award' one
+    (see refresh_matviews.sql). Until a type has been stamped, the latest submission update or data load date is used.
+    """
+    data_type = 'account' if request_type == 'account' else 'award'
+    watermark = DownloadDataWatermark.objects.filter(data_type=data_type).values_list('update_date', flat=True).first()
+    if watermark is None and data_type == 'account':
+        watermark = SubmissionAttributes.objects.aggregate(watermark=Max('update_date'))['watermark']
+    elif watermark is None:
+        watermark = ExternalDataLoadDate.objects.aggregate(watermark=Max('last_load_date'))['watermark']
+    return watermark.isoformat() if watermark else ''
+
+
+def stamp_data_load_watermark(data_type):
+    """Moves the data_type's download watermark forward, so no download made before now is reused"""
+    DownloadDataWatermark.objects.update_or_create(data_type=data_type, defaults={'update_date': timezone.now()})
+
+
+def generate_download_fingerprint(ordered_json_request, watermark):
+    """Fingerprints a normalized json_request, so identical requests against the same data load share a file"""
+    return hashlib.sha256('{}|{}'.format(ordered_json_request, watermark).encode('utf-8')).hexdigest()
+
+
 def multipart_upload(bucketname, regionname, source_path, keyname):
     s3client = boto3.client('s3', region_name=regionname)
     source_size = os.stat(source_path).st_size
@@ -180,6 +211,55 @@ def split_csv(file_path, delimiter=',', row_limit=10000, output_name_template='o
     return split_csvs
 
 
+def split_csv_stream(csv_stream, output_path, delimiter=',', row_limit=10000, output_name_template='output_%s.csv',
+                     max_rows=None):
+    """Splits a stream of CSV text into multiple pieces while it is being read.
+
+    Unlike split_csv, the source is never written to disk as a whole. Each piece starts with the header row of the
+    stream and is closed before it is yielded, so the caller can zip and remove it before the next one is written.
+    Arguments:
+        `csv_stream`: A text stream (opened with newline='') whose first row is the header.
+        `row_limit`: The number of data rows you want in each output file. 10,000 by default.
+        `output_name_template`: A %s-style template for the numbered output files.
+        `max_rows`: If given, the stream is only read up to this many data rows.
+    Yields:
+        (path of the finished piece, number of data rows written to it)
+    """
+    reader = csv.reader(csv_stream, delimiter=delimiter)
+    headers = next(reader, None)
+    if headers is None:
+        return
+
+    current_piece = 1
+    current_out_path = os.path.join(output_path, output_name_template % current_piece)
+    current_out_file = open(current_out_path, 'w')
+    try:
+        current_out_writer = csv.writer(current_out_file, delimiter=delimiter)
+        current_out_writer.writerow(headers)
+        current_rows = 0
+        total_rows = 0
+        for row in reader:
+            if total_rows == max_rows:
+                break
+            if current_rows == row_limit:
+                current_out_file.close()
+                yield current_out_path, current_rows
+
+                current_piece += 1
+                current_out_path = os.path.join(output_path, output_name_template % current_piece)
+                current_out_file = open(current_out_path, 'w')
+                current_out_writer = csv.writer(current_out_file, delimiter=delimiter)
+                current_out_writer.writerow(headers)
+                current_rows = 0
+            current_out_writer.writerow(row)
+            current_rows += 1
+            total_rows += 1
+        current_out_file.close()
+        yield current_out_path, current_rows
+    finally:
+        current_out_file.close()
+
+
 def pull_modified_agencies_cgacs():
     # Get a cgac_codes from the modified_agencies_list
     cgac_codes = []
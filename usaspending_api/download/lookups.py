@@ -34,7 +34,8 @@ VALUE_MAPPINGS = {
         'download_name': 'prime_awards',
         'contract_data': 'award__latest_transaction__contract_data',
         'assistance_data': 'award__latest_transaction__assistance_data',
-        'filter_function': universal_award_matview_filter
+        'filter_function': universal_award_matview_filter,
+        'partition_field': 'award_id'
     },
     # Transaction Level
     'transactions': {
@@ -44,7 +45,8 @@ VALUE_MAPPINGS = {
         'download_name': 'prime_transactions',
         'contract_data': 'transaction__contract_data',
         'assistance_data': 'transaction__assistance_data',
-        'filter_function': universal_transaction_matview_filter
+        'filter_function': universal_transaction_matview_filter,
+        'partition_field': 'transaction_id'
     },
     # SubAward Level
     'sub_awards': {
@@ -54,7 +56,8 @@ VALUE_MAPPINGS = {
         'download_name': 'subawards',
         'contract_data': 'award__latest_transaction__contract_data',
         'assistance_data': 'award__latest_transaction__assistance_data',
-        'filter_function': subaward_download
+        'filter_function': subaward_download,
+        'partition_field': 'subaward_id'
     },
     # Appropriations Account Data
     'account_balances': {
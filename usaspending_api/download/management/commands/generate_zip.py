@@ -1,8 +1,14 @@
 import botocore
+import json
 import logging
+import multiprocessing
+import os
+import signal
+import time
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
+from django.db import connections
 
 from usaspending_api.common.csv_helpers import sqs_queue
 from usaspending_api.download.helpers import write_to_download_log as write_to_log
@@ -11,50 +17,202 @@ from usaspending_api.download.models import DownloadJob
 from usaspending_api.download.filestreaming import csv_generation
 
 DEFAULT_VISIBILITY_TIMEOUT = 60*30
+# How long a message the worker pool cannot take yet stays hidden before it is received again
+DEFERRED_VISIBILITY_TIMEOUT = 60*5
+# Downloads expected to hold at most this many rows are processed in the fast lane
+FAST_LANE_DOWNLOAD_ROWS = 50000
+WORKER_POOL_SLEEP = 5
 
 logger = logging.getLogger('console')
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='the number of DownloadJobs to process concurrently')
+        parser.add_argument('--slow-lane-workers', type=int, default=None,
+                            help='the number of those workers that may process large downloads at the same time; '
+                                 'defaults to half of the workers')
+
     def handle(self, *args, **options):
         """Run the application."""
         queue = sqs_queue(queue_name=settings.BULK_DOWNLOAD_SQS_QUEUE_NAME)
 
+        workers = max(options['workers'], 1)
+        if workers > 1:
+            slow_lane_workers = options['slow_lane_workers'] or max(workers // 2, 1)
+            DownloadWorkerPool(queue, workers, min(slow_lane_workers, workers)).run()
+            return
+
         write_to_log(message='Starting SQS polling')
         while True:
-            second_attempt = True
-            try:
-                # Grabs one (or more) messages from the queue
-                messages = queue.receive_messages(WaitTimeSeconds=10, MessageAttributeNames=['All'],
-                                                  VisibilityTimeout=DEFAULT_VISIBILITY_TIMEOUT)
-                for message in messages:
-                    write_to_log(message='Message Received: {}'.format(message))
-                    if message.body is not None:
-                        # Retrieve and update the job
-                        download_job = DownloadJob.objects.filter(download_job_id=int(message.body)).first()
-                        second_attempt = download_job.error_message is not None
-
-                        # Retrieve the data and write to the CSV(s)
-                        csv_generation.generate_csvs(download_job=download_job, sqs_message=message)
-
-                        # If successful, we do not want to run again; delete
-                        message.delete()
-            except Exception as e:
-                # Handle uncaught exceptions in validation process
-                logger.error(e)
-                write_to_log(message=str(e), download_job=download_job, is_error=True)
-
-                if download_job:
-                    download_job.error_message = str(e)
-                    download_job.job_status_id = JOB_STATUS_DICT['failed' if second_attempt else 'ready']
-                    download_job.save()
-            finally:
-                # Set visibility to 0 so that another attempt can be made to process in SQS immediately, instead of
-                # waiting for the timeout window to expire
-                for message in messages:
-                    try:
-                        message.change_visibility(VisibilityTimeout=0)
-                    except botocore.exceptions.ClientError:
-                        # TODO: check existence instead of catching error
+            # Grabs one (or more) messages from the queue
+            messages = queue.receive_messages(WaitTimeSeconds=10, MessageAttributeNames=['All'],
+                                              VisibilityTimeout=DEFAULT_VISIBILITY_TIMEOUT)
+            for message in messages:
+                process_message(message)
+
+
+class DownloadWorkerPool:
+    """Processes DownloadJobs from the SQS queue in up to `workers` concurrent processes
+
+    Downloads are split into two lanes: small downloads (the fast lane) may use any free worker, while all other
+    downloads (the slow lane, e.g. full-agency bulk downloads) may only occupy `slow_lane_workers` of them, so small
+    requests are never stuck behind long-running ones. A slow lane download received while the slow lane is full is
+    hidden for DEFERRED_VISIBILITY_TIMEOUT, for another box or a freed up worker to pick up later. On SIGINT or SIGTERM,
+    or if polling fails, the in-flight downloads are stopped, put back to 'ready' and their messages made visible again
+    for another box to pick up.
+    """
+
+    def __init__(self, queue, workers, slow_lane_workers):
+        self.queue = queue
+        self.workers = workers
+        self.slow_lane_workers = slow_lane_workers
+        self.running = []
+        self.shutting_down = False
+
+    def run(self):
+        def signal_handler(signum, frame):
+            write_to_log(message='Received interrupt signal, shutting down the download worker pool')
+            self.shutting_down = True
+
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+        write_to_log(message='Starting SQS polling with {} workers ({} slow lane)'.format(self.workers,
+                                                                                          self.slow_lane_workers))
+        try:
+            while not self.shutting_down:
+                self.remove_finished_workers()
+
+                free_workers = self.workers - len(self.running)
+                if free_workers == 0:
+                    time.sleep(WORKER_POOL_SLEEP)
+                    continue
+
+                # SQS returns at most 10 messages per request
+                messages = self.queue.receive_messages(WaitTimeSeconds=10, MessageAttributeNames=['All'],
+                                                       VisibilityTimeout=DEFAULT_VISIBILITY_TIMEOUT,
+                                                       MaxNumberOfMessages=min(free_workers, 10))
+                for message_index, message in enumerate(messages):
+                    if self.shutting_down:
+                        release_message(message)
                         continue
+                    try:
+                        self.dispatch(message)
+                    except Exception:
+                        # Hand this and the rest of the received messages back before giving up
+                        for unprocessed_message in messages[message_index:]:
+                            release_message(unprocessed_message)
+                        raise
+        finally:
+            self.stop_workers()
+
+    def dispatch(self, message):
+        try:
+            download_job_id = int(message.body)
+        except (TypeError, ValueError):
+            download_job_id = None
+        download_job = None
+        if download_job_id is not None:
+            download_job = DownloadJob.objects.filter(download_job_id=download_job_id).first()
+        if download_job is None:
+            write_to_log(message='No DownloadJob found for message {}'.format(message.body), is_error=True)
+            release_message(message, DEFERRED_VISIBILITY_TIMEOUT)
+            return
+
+        slow_lane = not is_fast_lane_download(download_job)
+        if slow_lane and sum(1 for worker in self.running if worker['slow_lane']) >= self.slow_lane_workers:
+            # Let another box, or this one once a slow lane worker frees up, pick it up; not at once, which would only
+            # receive it again
+            release_message(message, DEFERRED_VISIBILITY_TIMEOUT)
+            return
+
+        # Forked processes must not share the parent's database connections
+        connections.close_all()
+        process = multiprocessing.Process(target=run_worker, args=(message,))
+        process.start()
+        self.running.append({'process': process, 'message': message, 'slow_lane': slow_lane,
+                             'download_job_id': download_job.download_job_id})
+
+    def remove_finished_workers(self):
+        for worker in list(self.running):
+            if not worker['process'].is_alive():
+                if worker['process'].exitcode != 0:
+                    write_to_log(message='Worker for DownloadJob {} exited with code {}'.format(
+                        worker['download_job_id'], worker['process'].exitcode), is_error=True)
+                    release_message(worker['message'])
+                self.running.remove(worker)
+
+    def stop_workers(self):
+        for worker in self.running:
+            write_to_log(message='Stopping DownloadJob {} (pid {})'.format(worker['download_job_id'],
+                                                                           worker['process'].pid))
+            try:
+                # Stop the worker along with the processes it started, which stop their PSQL commands on SIGTERM
+                os.killpg(worker['process'].pid, signal.SIGTERM)
+            except ProcessLookupError:
+                # The worker has not made its own process group yet
+                worker['process'].terminate()
+            worker['process'].join()
+            DownloadJob.objects.filter(download_job_id=worker['download_job_id']) \
+                .update(job_status_id=JOB_STATUS_DICT['ready'])
+            release_message(worker['message'])
+        self.running = []
+
+
+def is_fast_lane_download(download_job):
+    """Downloads limited to at most FAST_LANE_DOWNLOAD_ROWS rows; the row count of an earlier attempt is used when the
+    download is being retried. Requests without a limit of their own are given MAX_DOWNLOAD_LIMIT, so they are slow."""
+    if download_job.number_of_rows:
+        return download_job.number_of_rows <= FAST_LANE_DOWNLOAD_ROWS
+    limit = json.loads(download_job.json_request or '{}').get('limit')
+    return bool(limit) and int(limit) <= FAST_LANE_DOWNLOAD_ROWS
+
+
+def run_worker(message):
+    # The pool's signal handlers are inherited by the fork; let SIGTERM stop the worker, and reach every process it
+    # starts through the worker's own process group
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.setpgrp()
+    process_message(message)
+
+
+def process_message(message):
+    download_job = None
+    second_attempt = True
+    try:
+        write_to_log(message='Message Received: {}'.format(message))
+        if message.body is not None:
+            # Retrieve and update the job
+            download_job = DownloadJob.objects.filter(download_job_id=int(message.body)).first()
+            second_attempt = download_job.error_message is not None
+
+            # Retrieve the data and write to the CSV(s)
+            csv_generation.generate_csvs(download_job=download_job, sqs_message=message)
+
+            # If successful, we do not want to run again; delete
+            message.delete()
+    except Exception as e:
+        # Handle uncaught exceptions in validation process
+        logger.error(e)
+        write_to_log(message=str(e), download_job=download_job, is_error=True)
+
+        if download_job:
+            download_job.error_message = str(e)
+            download_job.job_status_id = JOB_STATUS_DICT['failed' if second_attempt else 'ready']
+            download_job.save()
+    finally:
+        # Set visibility to 0 so that another attempt can be made to process in SQS immediately, instead of
+        # waiting for the timeout window to expire
+        release_message(message)
+
+
+def release_message(message, visibility_timeout=0):
+    try:
+        message.change_visibility(VisibilityTimeout=visibility_timeout)
+    except botocore.exceptions.ClientError:
+        # TODO: check existence instead of catching error
+        pass
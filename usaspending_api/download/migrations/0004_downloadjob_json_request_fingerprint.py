@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-22 14:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('download', '0003_auto_20180306_1726'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadjob',
+            name='json_request_fingerprint',
+            field=models.TextField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-02-04 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('download', '0004_downloadjob_json_request_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DownloadDataWatermark',
+            fields=[
+                ('data_type', models.TextField(primary_key=True, serialize=False)),
+                ('update_date', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'download_data_watermark',
+                'managed': True,
+            },
+        ),
+    ]
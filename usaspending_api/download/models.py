@@ -26,6 +26,7 @@ class DownloadJob(models.Model):
     update_date = models.DateTimeField(auto_now=True, null=True)
     monthly_download = models.BooleanField(default=False)
     json_request = models.TextField(blank=True, null=True)
+    json_request_fingerprint = models.TextField(blank=True, null=True, db_index=True)
 
     class Meta:
         managed = True
@@ -36,3 +37,13 @@ class DownloadJob(models.Model):
             return timezone.now() - self.create_date
         elif self.job_status.name in ('finished', 'failed'):
             return self.update_date - self.create_date
+
+
+class DownloadDataWatermark(models.Model):
+    """When the data behind a type of download ('award' or 'account') last changed; downloads are reused until then"""
+    data_type = models.TextField(primary_key=True)
+    update_date = models.DateTimeField(null=False)
+
+    class Meta:
+        managed = True
+        db_table = 'download_data_watermark'
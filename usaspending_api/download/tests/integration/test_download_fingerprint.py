@@ -0,0 +1,47 @@
+import pytest
+
+from datetime import date
+from model_mommy import mommy
+
+from usaspending_api.download.helpers import (generate_download_fingerprint, get_data_load_watermark,
+                                              stamp_data_load_watermark)
+
+
+@pytest.mark.django_db
+def test_award_download_fingerprint_changes_with_data_load():
+    mommy.make('broker.ExternalDataLoadDate', last_load_date=date(2019, 1, 1), external_data_type_id=1)
+    first_fingerprint = generate_download_fingerprint('{"filters": {}}', get_data_load_watermark('award'))
+
+    assert first_fingerprint == generate_download_fingerprint('{"filters": {}}', get_data_load_watermark('award'))
+    assert first_fingerprint != generate_download_fingerprint('{"filters": {"a": 1}}',
+                                                              get_data_load_watermark('award'))
+
+    mommy.make('broker.ExternalDataLoadDate', last_load_date=date(2019, 1, 2), external_data_type_id=2)
+
+    assert get_data_load_watermark('award') == '2019-01-02'
+    assert first_fingerprint != generate_download_fingerprint('{"filters": {}}', get_data_load_watermark('award'))
+
+
+@pytest.mark.django_db
+def test_account_download_watermark_without_submissions():
+    assert get_data_load_watermark('account') == ''
+
+
+@pytest.mark.django_db
+def test_download_watermark_is_stamped_by_loads():
+    mommy.make('broker.ExternalDataLoadDate', last_load_date=date(2019, 1, 1), external_data_type_id=1)
+    mommy.make('submissions.SubmissionAttributes')
+    unstamped_account_watermark = get_data_load_watermark('account')
+
+    stamp_data_load_watermark('account')
+    account_watermark = get_data_load_watermark('account')
+
+    assert account_watermark not in ('', unstamped_account_watermark)
+    assert get_data_load_watermark('award') == '2019-01-01'
+
+    # Every stamp moves the watermark forward, whatever the submissions left behind look like
+    stamp_data_load_watermark('account')
+    stamp_data_load_watermark('award')
+
+    assert get_data_load_watermark('account') > account_watermark
+    assert get_data_load_watermark('award') != '2019-01-01'
@@ -1,7 +1,17 @@
+import csv
+import io
+import multiprocessing
+import os
+import pytest
+import subprocess
+import sys
+import time
+
 from unittest.mock import MagicMock
 
 from usaspending_api.awards.v2.lookups.lookups import award_type_mapping
 from usaspending_api.download.filestreaming import csv_generation
+from usaspending_api.download.helpers import split_csv_stream
 from usaspending_api.download.lookups import VALUE_MAPPINGS
 
 
@@ -180,3 +190,133 @@ def test_apply_annotations_to_sql_subquery():
                            "table.\"othercode\") AS \"alias_one\", two AS \"alias_two\", three AS \"alias_three\", "
                            "four AS \"alias_four\", five AS \"alias_five\" FROM table WHERE six = 'something'")
     assert annotated_sql == annotated_string
+
+
+def test_split_csv_stream(tmpdir):
+    csv_stream = io.StringIO('id,name\r\n1,one\r\n2,"two\nlines"\r\n3,three\r\n4,four\r\n5,five\r\n', newline='')
+
+    parts = []
+    for part_path, part_rows in split_csv_stream(csv_stream, str(tmpdir), row_limit=2,
+                                                 output_name_template='source_%s.csv'):
+        with open(part_path, 'r') as part_file:
+            parts.append((os.path.basename(part_path), part_rows, list(csv.reader(part_file))))
+        # Pieces are handed over finished, so they can be removed before the next one is written
+        os.remove(part_path)
+
+    assert parts == [
+        ('source_1.csv', 2, [['id', 'name'], ['1', 'one'], ['2', 'two\nlines']]),
+        ('source_2.csv', 2, [['id', 'name'], ['3', 'three'], ['4', 'four']]),
+        ('source_3.csv', 1, [['id', 'name'], ['5', 'five']]),
+    ]
+
+
+def test_split_csv_stream_header_only(tmpdir):
+    parts = list(split_csv_stream(io.StringIO('id,name\r\n', newline=''), str(tmpdir), row_limit=2))
+
+    assert parts == [(os.path.join(str(tmpdir), 'output_1.csv'), 0)]
+
+
+def test_chain_csv_slices(tmpdir):
+    slice_paths = []
+    slices = ['id,name\r\n1,one\r\n', 'id,name\r\n', 'id,name\r\n2,"two\nlines"\r\n']
+    for slice_index, slice_contents in enumerate(slices):
+        slice_path = os.path.join(str(tmpdir), 'slice_{}.csv'.format(slice_index))
+        with open(slice_path, 'w', newline='') as slice_file:
+            slice_file.write(slice_contents)
+        slice_paths.append(slice_path)
+
+    rows = list(csv.reader(csv_generation.chain_csv_slices(slice_paths)))
+
+    assert rows == [['id', 'name'], ['1', 'one'], ['2', 'two\nlines']]
+    assert not any(os.path.exists(slice_path) for slice_path in slice_paths)
+
+
+def test_split_csv_stream_max_rows(tmpdir):
+    csv_stream = io.StringIO('id,name\r\n1,one\r\n2,two\r\n3,three\r\n', newline='')
+
+    parts = list(split_csv_stream(csv_stream, str(tmpdir), row_limit=1, max_rows=2))
+
+    assert [part_rows for part_path, part_rows in parts] == [1, 1]
+
+
+def test_get_id_ranges():
+    assert csv_generation.get_id_ranges(1, 10, 4) == [(1, 4), (4, 7), (7, 10), (10, 11)]
+    assert csv_generation.get_id_ranges(5, 6, 4) == [(5, 6), (6, 7)]
+    assert csv_generation.get_id_ranges(3, 3, 4) == [(3, 4)]
+    # Every id is covered exactly once, whatever the widths round to
+    id_ranges = csv_generation.get_id_ranges(17, 1000, 16)
+    assert len(id_ranges) == 16
+    assert [id_range[0] for id_range in id_ranges[1:]] == [id_range[1] for id_range in id_ranges[:-1]]
+    assert (id_ranges[0][0], id_ranges[-1][1]) == (17, 1001)
+
+
+def sleep_for(seconds):
+    time.sleep(seconds)
+
+
+def fail():
+    sys.exit(1)
+
+
+def start_sleep_subprocess(subprocess_pid):
+    with csv_generation.sigterm_stops_subprocesses() as subprocesses:
+        sleep_process = subprocess.Popen(['sleep', '60'], start_new_session=True)
+        subprocesses.append(sleep_process)
+        subprocess_pid.value = sleep_process.pid
+        sleep_process.wait()
+
+
+def is_running(pid):
+    try:
+        with open('/proc/{}/stat'.format(pid)) as stat_file:
+            return stat_file.read().split(')')[-1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def test_run_processes():
+    processes = [multiprocessing.Process(target=sleep_for, args=(0.1,)) for _ in range(3)]
+
+    csv_generation.run_processes(processes, 2, time.time(), MagicMock(), None)
+
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+
+
+def test_run_processes_failure_stops_the_rest():
+    processes = [multiprocessing.Process(target=fail), multiprocessing.Process(target=sleep_for, args=(60,))]
+
+    with pytest.raises(Exception, match='Command failed'):
+        csv_generation.run_processes(processes, 2, time.time(), MagicMock(), None)
+
+    # Stopped processes are waited for, not left behind
+    assert not processes[1].is_alive()
+    assert processes[1].exitcode is not None
+
+
+def test_run_processes_stops_once_the_consumer_is_done():
+    processes = [multiprocessing.Process(target=sleep_for, args=(60,)) for _ in range(3)]
+    consumer = multiprocessing.Process(target=sleep_for, args=(0.1,))
+
+    csv_generation.run_processes(processes, 2, time.time(), MagicMock(), None, consumer=consumer)
+
+    assert consumer.exitcode == 0
+    assert not any(process.is_alive() for process in processes[:2])
+    # Processes still waiting for a turn are never started
+    assert processes[2].pid is None
+
+
+def test_sigterm_stops_subprocesses():
+    subprocess_pid = multiprocessing.Value('q', 0)
+    process = multiprocessing.Process(target=start_sleep_subprocess, args=(subprocess_pid,))
+    process.start()
+    while not subprocess_pid.value:
+        time.sleep(0.01)
+
+    csv_generation.terminate_processes([process])
+
+    assert process.exitcode != 0
+    for _ in range(100):
+        if not is_running(subprocess_pid.value):
+            break
+        time.sleep(0.01)
+    assert not is_running(subprocess_pid.value)
@@ -0,0 +1,52 @@
+import json
+import pytest
+
+from django.conf import settings
+from unittest.mock import MagicMock
+
+from usaspending_api.download.management.commands import generate_zip
+from usaspending_api.download.management.commands.generate_zip import (DEFERRED_VISIBILITY_TIMEOUT,
+                                                                       FAST_LANE_DOWNLOAD_ROWS, DownloadWorkerPool,
+                                                                       is_fast_lane_download)
+from usaspending_api.download.models import DownloadJob
+
+
+def download_job(number_of_rows=None, **json_request):
+    return DownloadJob(number_of_rows=number_of_rows, json_request=json.dumps(json_request))
+
+
+def test_is_fast_lane_download():
+    assert is_fast_lane_download(download_job(limit=100))
+    assert is_fast_lane_download(download_job(limit=FAST_LANE_DOWNLOAD_ROWS))
+    # Requests without a limit of their own are given the maximum one
+    assert not is_fast_lane_download(download_job(limit=settings.MAX_DOWNLOAD_LIMIT))
+    assert not is_fast_lane_download(download_job())
+    # A retried download is classified by the rows it held
+    assert not is_fast_lane_download(download_job(number_of_rows=FAST_LANE_DOWNLOAD_ROWS + 1, limit=100))
+    assert is_fast_lane_download(download_job(number_of_rows=10, limit=settings.MAX_DOWNLOAD_LIMIT))
+
+
+def test_dispatch_releases_malformed_messages():
+    message = MagicMock(body='not a job id')
+
+    # Never reaches the database, which these unit tests have no access to
+    DownloadWorkerPool(MagicMock(), 2, 1).dispatch(message)
+
+    message.change_visibility.assert_called_once_with(VisibilityTimeout=DEFERRED_VISIBILITY_TIMEOUT)
+
+
+def test_run_stops_workers_when_polling_fails(monkeypatch):
+    monkeypatch.setattr(generate_zip.signal, 'signal', lambda signum, handler: None)
+    messages = [MagicMock(body='1'), MagicMock(body='2')]
+    queue = MagicMock()
+    queue.receive_messages.return_value = messages
+    pool = DownloadWorkerPool(queue, 2, 1)
+    pool.dispatch = MagicMock(side_effect=Exception('database went away'))
+    pool.stop_workers = MagicMock()
+
+    with pytest.raises(Exception, match='database went away'):
+        pool.run()
+
+    pool.stop_workers.assert_called_once_with()
+    for message in messages:
+        message.change_visibility.assert_called_once_with(VisibilityTimeout=0)
@@ -1,6 +1,5 @@
 import boto3
 import copy
-import datetime
 import json
 import os
 import re
@@ -30,7 +29,8 @@ from usaspending_api.core.validator.award_filter import AWARD_FILTER
 from usaspending_api.core.validator.tinyshield import TinyShield
 from usaspending_api.download.filestreaming import csv_generation
 from usaspending_api.download.filestreaming.s3_handler import S3Handler
-from usaspending_api.download.helpers import (check_types_and_assign_defaults, parse_limit, validate_time_periods,
+from usaspending_api.download.helpers import (check_types_and_assign_defaults, generate_download_fingerprint,
+                                              get_data_load_watermark, parse_limit, validate_time_periods,
                                               write_to_download_log as write_to_log)
 from usaspending_api.download.lookups import (JOB_STATUS_DICT, VALUE_MAPPINGS, SHARED_AWARD_FILTER_DEFAULTS, CFO_CGACS,
                                               YEAR_CONSTRAINT_FILTER_DEFAULTS, ROW_CONSTRAINT_FILTER_DEFAULTS,
@@ -51,13 +51,14 @@ class BaseDownloadViewSet(APIDocumentationView):
         json_request['request_type'] = request_type
         ordered_json_request = json.dumps(order_nested_object(json_request))
 
-        # Check if the same request has been called today
-        updated_date_timestamp = datetime.datetime.strftime(datetime.datetime.utcnow(), '%Y-%m-%d')
+        # Check if the same request has been made since the underlying data was last loaded
+        fingerprint = generate_download_fingerprint(ordered_json_request, get_data_load_watermark(request_type))
         cached_download = DownloadJob.objects. \
-            filter(json_request=ordered_json_request, update_date__gte=updated_date_timestamp). \
-            exclude(job_status_id=4).values('download_job_id', 'file_name')
+            filter(json_request_fingerprint=fingerprint). \
+            exclude(job_status_id=JOB_STATUS_DICT['failed']). \
+            order_by('-job_status_id', '-download_job_id').values('download_job_id', 'file_name')
         if cached_download and not settings.IS_LOCAL:
-            # By returning the cached files, there should be no duplicates on a daily basis
+            # By returning the cached files (finished ones first), the same data is only ever queried once
             write_to_log(message='Generating file from cached download job ID: {}'
                          .format(cached_download[0]['download_job_id']))
             cached_filename = cached_download[0]['file_name']
@@ -73,7 +74,8 @@ class BaseDownloadViewSet(APIDocumentationView):
 
         download_job = DownloadJob.objects.create(job_status_id=JOB_STATUS_DICT['ready'],
                                                   file_name=timestamped_file_name,
-                                                  json_request=ordered_json_request)
+                                                  json_request=ordered_json_request,
+                                                  json_request_fingerprint=fingerprint)
 
         write_to_log(message='Starting new download job'.format(download_job.download_job_id),
                      download_job=download_job, other_params={'request_addr': get_remote_addr(request)})
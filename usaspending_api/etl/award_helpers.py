@@ -2,6 +2,7 @@ import logging
 
 from django.db import connection
 from usaspending_api.awards.models import Award, Agency
+from usaspending_api.references.reference_helpers import agency_resolver
 from usaspending_api.awards.models import TransactionNormalized
 from django.db.models import Case, Value, When, TextField
 
@@ -9,6 +10,72 @@ from django.db.models import Case, Value, When, TextField
 logger = logging.getLogger('console')
 
 
+# Number of award ids update_awards rolls up per statement when given a list of them
+UPDATE_AWARDS_CHUNK_SIZE = 50000
+
+# Each award column update_awards maintains, and its value in terms of the award's latest transaction (l), earliest
+# transaction (e) and the totals over all of its transactions (also on l)
+AWARD_ROLLUP_COLUMNS = [
+    ('awarding_agency_id', 'l.awarding_agency_id'),
+    ('certified_date', 'l.action_date'),
+    ('date_signed', 'e.action_date'),
+    ('description', 'e.description'),
+    ('funding_agency_id', 'l.funding_agency_id'),
+    ('last_modified_date', 'l.last_modified_date'),
+    ('period_of_performance_current_end_date', 'l.period_of_performance_current_end_date'),
+    ('period_of_performance_start_date', 'e.period_of_performance_start_date'),
+    ('place_of_performance_id', 'l.place_of_performance_id'),
+    ('recipient_id', 'l.recipient_id'),
+    ('total_obligation', 'l.total_obligation'),
+    ('total_funding_amount', 'l.total_funding_amount'),
+    ('total_subsidy_cost', 'l.total_subsidy_cost'),
+    ('total_loan_value', 'l.total_loan_value'),
+    ('non_federal_funding_amount', 'l.non_federal_funding_amount'),
+    ('latest_transaction_id', 'l.id'),
+    ('type', 'l.type'),
+    ('category', "CASE WHEN l.type IN ('A', 'B', 'C', 'D') THEN 'contract'"
+                 "  WHEN l.type IN ('02', '03', '04', '05') THEN 'grant'"
+                 "  WHEN l.type in ('06', '10') THEN 'direct payment'"
+                 "  WHEN l.type in ('07', '08') THEN 'loans'"
+                 "  WHEN l.type = '09' THEN 'insurance'"
+                 "  WHEN l.type = '11' THEN 'other'"
+                 "  WHEN l.type LIKE 'IDV%' THEN 'idv'"
+                 "  ELSE NULL END"),
+    ('type_description', 'l.type_description'),
+]
+
+# Ranks every transaction of the awards being updated from both ends and totals them, in a single pass over
+# transaction_normalized; the award's latest and earliest transactions are then read back from that pass. Awards whose
+# derived values did not change are not written.
+UPDATE_AWARDS_SQL = """
+WITH txn AS (
+    SELECT
+        tn.id, tn.award_id, tn.action_date, tn.awarding_agency_id, tn.funding_agency_id, tn.last_modified_date,
+        tn.period_of_performance_current_end_date, tn.period_of_performance_start_date, tn.place_of_performance_id,
+        tn.recipient_id, tn.type, tn.type_description, tn.description,
+        ROW_NUMBER() OVER (PARTITION BY tn.award_id ORDER BY tn.action_date DESC, tn.id DESC) AS latest_rank,
+        ROW_NUMBER() OVER (PARTITION BY tn.award_id ORDER BY tn.action_date, tn.id) AS earliest_rank,
+        SUM(tn.federal_action_obligation) OVER award_txns AS total_obligation,
+        SUM(tn.original_loan_subsidy_cost) OVER award_txns AS total_subsidy_cost,
+        SUM(tn.funding_amount) OVER award_txns AS total_funding_amount,
+        SUM(tn.face_value_loan_guarantee) OVER award_txns AS total_loan_value,
+        SUM(tn.non_federal_funding_amount) OVER award_txns AS non_federal_funding_amount
+    FROM transaction_normalized tn
+    {award_id_join}
+    WINDOW award_txns AS (PARTITION BY tn.award_id)
+),
+award_rollup AS (
+    SELECT l.award_id, {rollup_columns}
+    FROM txn l
+    JOIN txn e ON e.award_id = l.award_id AND e.earliest_rank = 1
+    WHERE l.latest_rank = 1
+)
+UPDATE awards a
+SET {set_columns}
+FROM award_rollup r
+WHERE r.award_id = a.id AND ({award_columns}) IS DISTINCT FROM ({derived_columns})"""
+
+
 def update_awards(award_tuple=None):
     """
     Awards can have one or more transactions. We maintain some information on the award model that needs to be updated
@@ -20,90 +87,36 @@ def update_awards(award_tuple=None):
     That said, the complex update of award fields based on the earliest, latest, and aggregate values of the child
     transactions was problematic to do in a set-based way via the ORM. These updates do need to be set-based, as
     looping through and updating individual award records would be an ETL bottleneck.
+
+    Given award ids, they are rolled up UPDATE_AWARDS_CHUNK_SIZE at a time through a temporary table. Returns the
+    number of awards whose values changed.
     """
     logger.info("Running update_awards() in usaspending/et/award_helpers.py")
 
-    # common table expression for each award's latest transaction
-    sql_txn_latest = (
-        "txn_latest AS ("
-        "SELECT DISTINCT ON (award_id) *, "
-        "CASE WHEN type IN ('A', 'B', 'C', 'D') THEN 'contract'"
-        "  WHEN type IN ('02', '03', '04', '05') THEN 'grant'"
-        "  WHEN type in ('06', '10') THEN 'direct payment'"
-        "  WHEN type in ('07', '08') THEN 'loans'"
-        "  WHEN type = '09' THEN 'insurance'"
-        "  WHEN type = '11' THEN 'other'"
-        "  WHEN type LIKE 'IDV%%' THEN 'idv'"
-        "  ELSE NULL END AS category "
-        "FROM transaction_normalized ")
-    if award_tuple:
-        sql_txn_latest += "WHERE award_id IN %s "
-    sql_txn_latest += "ORDER BY award_id, action_date DESC) "
-
-    # common table expression for each award's earliest transaction
-    sql_txn_earliest = (
-        'txn_earliest AS ('
-        'SELECT DISTINCT ON (award_id) * '
-        'FROM transaction_normalized ')
-    if award_tuple:
-        sql_txn_earliest += 'WHERE award_id IN %s '
-    sql_txn_earliest += 'ORDER BY award_id, action_date) '
-
-    # common table expression for each award's summarized data (currently the only we summarize is
-    # federal_actio_obligation, but we can add more as necessary)
-    sql_txn_totals = (
-        'txn_totals AS ('
-        'SELECT award_id, SUM(federal_action_obligation) AS total_obligation, '
-        'SUM(original_loan_subsidy_cost) AS total_subsidy_cost, '
-        'SUM(funding_amount) AS total_funding_amount, '
-        'SUM(face_value_loan_guarantee) AS total_loan_value, '
-        'SUM(non_federal_funding_amount) AS non_federal_funding_amount '
-        'FROM transaction_normalized ')
-    if award_tuple:
-        sql_txn_totals += 'WHERE award_id IN %s '
-    sql_txn_totals += 'GROUP BY award_id) '
-
-    # construct a sql query that uses the common table expressions defined above and joins each of them to their
-    # corresopnding award. the joined data from earliest, latest, and summarized transactions are used to update awards
-    # fields as appropriate
-    sql_update = 'WITH {}, {}, {}'.format(sql_txn_latest, sql_txn_earliest, sql_txn_totals)
-    sql_update += (
-        'UPDATE awards a '
-        'SET awarding_agency_id = l.awarding_agency_id, '
-        'certified_date = l.action_date, '
-        'date_signed = e.action_date, '
-        'description = e.description, '
-        'funding_agency_id = l.funding_agency_id, '
-        'last_modified_date = l.last_modified_date, '
-        'period_of_performance_current_end_date = l.period_of_performance_current_end_date, '
-        'period_of_performance_start_date = e.period_of_performance_start_date, '
-        'place_of_performance_id = l.place_of_performance_id, '
-        'recipient_id = l.recipient_id, '
-        'total_obligation = t.total_obligation, '
-        'total_funding_amount = t.total_funding_amount, '
-        'total_subsidy_cost = t.total_subsidy_cost, '
-        'total_loan_value = t.total_loan_value, '
-        'non_federal_funding_amount = t.non_federal_funding_amount, '
-        'latest_transaction_id = l.id, '
-        'type = l.type, '
-        'category = l.category, '
-        'type_description = l.type_description '
-        'FROM txn_earliest e '
-        'JOIN txn_latest l '
-        'ON e.award_id = l.award_id '
-        'JOIN txn_totals t '
-        'ON l.award_id = t.award_id '
-        'WHERE t.award_id = a.id'
-    )
+    sql_update = UPDATE_AWARDS_SQL.format(
+        award_id_join='{award_id_join}',
+        rollup_columns=', '.join('{} AS {}'.format(value, column) for column, value in AWARD_ROLLUP_COLUMNS),
+        set_columns=', '.join('{0} = r.{0}'.format(column) for column, _ in AWARD_ROLLUP_COLUMNS),
+        award_columns=', '.join('a.{}'.format(column) for column, _ in AWARD_ROLLUP_COLUMNS),
+        derived_columns=', '.join('r.{}'.format(column) for column, _ in AWARD_ROLLUP_COLUMNS))
 
     with connection.cursor() as cursor:
-        # If another expression is added and includes %s, you must add the tuple for that string interpolation to this
-        # list (even if it uses the same one!)
-        if award_tuple:
-            cursor.execute(sql_update, [award_tuple, award_tuple, award_tuple])
-        else:
-            cursor.execute(sql_update)
-        rows = cursor.rowcount
+        if award_tuple is None or not len(award_tuple):
+            cursor.execute(sql_update.format(award_id_join=''))
+            return cursor.rowcount
+
+        award_ids = sorted(set(award_tuple))
+        cursor.execute('CREATE TEMPORARY TABLE IF NOT EXISTS temp_update_awards_ids (award_id BIGINT PRIMARY KEY)')
+        rows = 0
+        for chunk_start in range(0, len(award_ids), UPDATE_AWARDS_CHUNK_SIZE):
+            cursor.execute('TRUNCATE temp_update_awards_ids')
+            cursor.execute('INSERT INTO temp_update_awards_ids SELECT UNNEST(%s::BIGINT[])',
+                           [award_ids[chunk_start:chunk_start + UPDATE_AWARDS_CHUNK_SIZE]])
+            cursor.execute('ANALYZE temp_update_awards_ids')
+            cursor.execute(sql_update.format(
+                award_id_join='JOIN temp_update_awards_ids ids ON ids.award_id = tn.award_id'))
+            rows += cursor.rowcount
+        cursor.execute('DROP TABLE temp_update_awards_ids')
 
     return rows
 
@@ -310,7 +323,7 @@ def get_awarding_agency(row):
     else:
         # No matching transaction found, so find/create Award by using toptier agency only, since CGAC code is the only
         # piece of awarding agency info that we have.
-        return Agency.get_by_toptier(row.agency_identifier)
+        return agency_resolver.get_by_toptier(row.agency_identifier)
 
 
 def update_idv_awards(award_tuple=None):
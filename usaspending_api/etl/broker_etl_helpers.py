@@ -7,6 +7,8 @@ import logging
 
 logger = logging.getLogger('console')
 
+DICT_FETCH_SIZE = 10000
+
 
 def dictfetchall(cursor):
     if isinstance(cursor, PhonyCursor):
@@ -19,6 +21,27 @@ def dictfetchall(cursor):
         return [OrderedDict(zip(columns, row)) for row in cursor.fetchall()]
 
 
+def dictfetchmany(cursor, size=DICT_FETCH_SIZE):
+    """
+    Yields the rows of an executed cursor as lists of up to `size` dicts, so only one batch is held at a time.
+
+    Execute the query on a server-side cursor (connections[...].chunked_cursor()) for the rows to be streamed from the
+    database as well; a regular cursor still receives the whole result at once.
+    """
+    if isinstance(cursor, PhonyCursor):
+        results = cursor.results or []
+        for i in range(0, len(results), size):
+            yield results[i:i + size]
+        return
+
+    rows = cursor.fetchmany(size)
+    # A server-side cursor only has a description once rows have been fetched from it
+    columns = [col[0] for col in cursor.description]
+    while rows:
+        yield [OrderedDict(zip(columns, row)) for row in rows]
+        rows = cursor.fetchmany(size)
+
+
 class PhonyCursor:
     """Spoofs the db cursor responses."""
 
@@ -11,8 +11,9 @@ from datetime import datetime
 from django.db import connection
 from elasticsearch import helpers
 from elasticsearch import TransportError
+from multiprocessing import Condition, Value
 
-from time import perf_counter, sleep
+from time import perf_counter
 from usaspending_api import settings
 from usaspending_api.awards.v2.lookups.elasticsearch_lookups import indices_to_award_types
 # ==============================================================================
@@ -96,6 +97,49 @@ class DataJob:
         self.category = args[3]
         self.csv = args[4]
         self.count = None
+        self.size = 0
+
+
+class CsvBackPressure:
+    '''
+    Tracks the bytes of downloaded CSVs which are still waiting to be indexed, shared between the download process and
+    the ES index processes. The download process blocks (instead of polling) once `max_bytes` are pending and is woken
+    up as soon as an index process finishes a CSV. It stops waiting, with an error, once none of the `consumers` ES
+    index processes is left running to release the pending bytes.
+    '''
+    def __init__(self, max_bytes, consumers, timeout=10):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.pending_bytes = Value('q', 0)
+        self.running_consumers = Value('i', consumers)
+        self.condition = Condition()
+
+    def wait_for_room(self):
+        ''' Returns True if the caller had to wait for the ES index processes to catch up '''
+        with self.condition:
+            waited = False
+            while self.pending_bytes.value >= self.max_bytes:
+                if self.running_consumers.value <= 0:
+                    raise RuntimeError('No ES index process is left to index the {} bytes of pending CSVs'.format(
+                        self.pending_bytes.value))
+                waited = True
+                # Time out regularly in case a notification is missed
+                self.condition.wait(self.timeout)
+            return waited
+
+    def add(self, size):
+        with self.condition:
+            self.pending_bytes.value += size
+
+    def release(self, size):
+        with self.condition:
+            self.pending_bytes.value -= size
+            self.condition.notify_all()
+
+    def consumer_stopped(self):
+        with self.condition:
+            self.running_consumers.value -= 1
+            self.condition.notify_all()
 
 # ==============================================================================
 # Helper functions for several Django management commands focused on ETL into a Elasticsearch cluster
@@ -172,38 +216,39 @@ def db_rows_to_dict(cursor):
     ]
 
 
-def download_db_records(fetch_jobs, done_jobs, config):
+def download_db_records(fetch_jobs, done_jobs, config, back_pressure):
     while not fetch_jobs.empty():
-        if done_jobs.full():
-            printf({'msg': 'Paused downloading new CSVs so ES index process can catch up', 'f': 'Download'})
-            sleep(60)
-        else:
-            start = perf_counter()
-            job = fetch_jobs.get_nowait()
-            printf({'msg': 'Preparing to download "{}"'.format(job.csv), 'job': job.name, 'f': 'Download'})
-
-            sql_config = {
-                'starting_date': config['starting_date'],
-                'fiscal_year': job.fy,
-                'award_category': job.category,
-                'provide_deleted': config['provide_deleted']
-            }
-            copy_sql, _, count_sql = configure_sql_strings(sql_config, job.csv, [])
+        if back_pressure.wait_for_room():
+            printf({'msg': 'Resumed downloading new CSVs after ES index processes caught up', 'f': 'Download'})
+
+        start = perf_counter()
+        job = fetch_jobs.get_nowait()
+        printf({'msg': 'Preparing to download "{}"'.format(job.csv), 'job': job.name, 'f': 'Download'})
+
+        sql_config = {
+            'starting_date': config['starting_date'],
+            'fiscal_year': job.fy,
+            'award_category': job.category,
+            'provide_deleted': config['provide_deleted']
+        }
+        copy_sql, _, count_sql = configure_sql_strings(sql_config, job.csv, [])
 
-            if os.path.isfile(job.csv):
-                os.remove(job.csv)
+        if os.path.isfile(job.csv):
+            os.remove(job.csv)
 
-            job.count = download_csv(count_sql, copy_sql, job.csv, job.name, config['verbose'])
-            done_jobs.put(job)
-            printf({
-                'msg': 'CSV "{}" copy took {} seconds'.format(job.csv, perf_counter() - start),
-                'job': job.name,
-                'f': 'Download'
-            })
-            sleep(1)
+        job.count = download_csv(count_sql, copy_sql, job.csv, job.name, config['verbose'])
+        job.size = os.path.getsize(job.csv)
+        back_pressure.add(job.size)
+        done_jobs.put(job)
+        printf({
+            'msg': 'CSV "{}" copy took {} seconds'.format(job.csv, perf_counter() - start),
+            'job': job.name,
+            'f': 'Download'
+        })
 
-    # This "Null Job" is used to notify the other (ES data load) process this is the final job
-    done_jobs.put(DataJob(None, None, None, None, None))
+    # These "Null Jobs" are used to notify each of the other (ES data load) processes there are no more jobs
+    for _ in range(config['processes']):
+        done_jobs.put(DataJob(None, None, None, None, None))
     printf({'msg': 'All downloads from Postgres completed', 'f': 'Download'})
     return
 
@@ -226,18 +271,41 @@ def download_csv(count_sql, copy_sql, filename, job_id, verbose):
 
 
 def csv_chunk_gen(filename, chunksize, job_id):
+    '''
+    Yields the CSV header along with chunks of up to `chunksize` rows. Rows are kept as the lists of strings read by
+    csv.reader; use transaction_actions() to lazily turn a chunk into bulk actions.
+    '''
     printf({'msg': 'Opening {} (batch size = {})'.format(filename, chunksize), 'job': job_id, 'f': 'ES Ingest'})
-    # Panda's data type guessing causes issues for Elasticsearch. Explicitly cast using dictionary
-    dtype = {k: str for k in VIEW_COLUMNS}
-    for file_df in pd.read_csv(filename, dtype=dtype, header=0, chunksize=chunksize):
-        file_df = file_df.where(cond=(pd.notnull(file_df)), other=None)
-        yield file_df.to_dict(orient='records')
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader, None)
+        if columns is None:
+            return
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) == chunksize:
+                yield columns, chunk
+                chunk = []
+        if chunk:
+            yield columns, chunk
+
+
+def transaction_actions(columns, rows):
+    '''
+    Lazily generates bulk index actions from CSV rows. The "_source" of each action is serialized here, so the bulk
+    helper passes it through as-is. Values are all kept as strings (empty values become null) since type guessing
+    causes issues for Elasticsearch.
+    '''
+    for row in rows:
+        yield {'_source': json.dumps(dict(zip(columns, [value if value != '' else None for value in row])))}
 
 
-def es_data_loader(client, fetch_jobs, done_jobs, config):
-    while True:
-        if not done_jobs.empty():
-            job = done_jobs.get_nowait()
+def es_data_loader(client, done_jobs, config, back_pressure):
+    try:
+        while True:
+            # Blocks until the download process hands over a CSV
+            job = done_jobs.get()
             if job.name is None:
                 break
 
@@ -245,18 +313,19 @@ def es_data_loader(client, fetch_jobs, done_jobs, config):
             post_to_elasticsearch(client, job, config)
             if os.path.exists(job.csv) and not config['keep']:
                 os.remove(job.csv)
-        else:
-            printf({'msg': 'No Job. Sleeping 45s', 'f': 'ES Ingest'})
-            sleep(45)
+            back_pressure.release(job.size)
+    finally:
+        back_pressure.consumer_stopped()
 
     printf({'msg': 'Completed Elasticsearch data load', 'f': 'ES Ingest'})
     return
 
 
-def streaming_post_to_es(client, chunk, index_name, job_id=None, doc_type='transaction_mapping'):
+def parallel_post_to_es(client, chunk, index_name, job_id=None, doc_type='transaction_mapping', thread_count=4):
     success, failed = 0, 0
     try:
-        for ok, item in helpers.streaming_bulk(client, chunk, index=index_name, doc_type=doc_type):
+        for ok, item in helpers.parallel_bulk(client, chunk, thread_count=thread_count, index=index_name,
+                                              doc_type=doc_type):
             success = [success, success + 1][ok]
             failed = [failed + 1, failed][ok]
 
@@ -323,32 +392,31 @@ def test_mapping(client, index, config):
     return index_mapping == transaction_mapping
 
 
-def post_to_elasticsearch(client, job, config, chunksize=250000):
-    printf({'msg': 'Populating ES Index "{}"'.format(job.index), 'job': job.name, 'f': 'ES Ingest'})
-    start = perf_counter()
+def create_index(client, index, config):
     try:
-        does_index_exist = client.indices.exists(job.index)
+        does_index_exist = client.indices.exists(index)
     except Exception as e:
         print(e)
         raise SystemExit(1)
     if not does_index_exist:
-        printf({'msg': 'Creating index "{}"'.format(job.index), 'job':
-                job.name, 'f': 'ES Ingest'})
-        client.indices.create(index=job.index, body=config['mapping'])
-        client.indices.refresh(job.index)
-        if not test_mapping(client, job.index, config):
-            printf({'msg': 'MAPPING FAILED TO STICK TO {}'.format(job.index), 'job':
-                    job.name, 'f': 'ES Create'})
+        printf({'msg': 'Creating index "{}"'.format(index), 'f': 'ES Create'})
+        client.indices.create(index=index, body=config['mapping'])
+        client.indices.refresh(index)
+        if not test_mapping(client, index, config):
+            printf({'msg': 'MAPPING FAILED TO STICK TO {}'.format(index), 'f': 'ES Create'})
             raise SystemExit(1)
 
+
+def post_to_elasticsearch(client, job, config, chunksize=250000):
+    printf({'msg': 'Populating ES Index "{}"'.format(job.index), 'job': job.name, 'f': 'ES Ingest'})
+    start = perf_counter()
+
     csv_generator = csv_chunk_gen(job.csv, chunksize, job.name)
-    for count, chunk in enumerate(csv_generator):
-        if len(chunk) == 0:
-            printf({'msg': 'No documents to add/delete for chunk #{}'.format(count), 'f': 'ES Ingest', 'job': job.name})
-            continue
+    for count, (columns, chunk) in enumerate(csv_generator):
         iteration = perf_counter()
         if config['provide_deleted']:
-            id_list = [{'key': c[UNIVERSAL_TRANSACTION_ID_NAME], 'col': UNIVERSAL_TRANSACTION_ID_NAME} for c in chunk]
+            id_index = columns.index(UNIVERSAL_TRANSACTION_ID_NAME)
+            id_list = [{'key': row[id_index], 'col': UNIVERSAL_TRANSACTION_ID_NAME} for row in chunk]
             delete_transactions_from_es(client, id_list, job.name, config, job.index)
 
         current_rows = '({}-{})'.format(count * chunksize + 1, count * chunksize + len(chunk))
@@ -357,7 +425,9 @@ def post_to_elasticsearch(client, job, config, chunksize=250000):
             'job': job.name,
             'f': 'ES Ingest'
         })
-        streaming_post_to_es(client, chunk, job.index, job.name, doc_type=config['doc_type'])
+        actions = transaction_actions(columns, chunk)
+        parallel_post_to_es(client, actions, job.index, job.name, doc_type=config['doc_type'],
+                            thread_count=config['threads'])
         printf({
             'msg': 'Iteration group #{} took {}s'.format(count, perf_counter() - iteration),
             'job': job.name,
@@ -478,15 +548,17 @@ def filter_query(column, values, query_type="match_phrase"):
     }
 
 
-def delete_query(response):
-    return {
-        "query": {
-            "ids": {
-                "type": "transaction_mapping",
-                "values": [i['_id'] for i in response['hits']['hits']]
-            }
-        }
-    }
+def delete_actions(client, index, column, values, max_query_size):
+    '''
+    Lazily generates a bulk delete action for each document matching one of the values. Matching documents are looked
+    up 1000 values at a time, which keeps the search below the default bool query clause limit.
+    '''
+    for v in chunks(values, 1000):
+        body = filter_query(column, v)
+        body['_source'] = False
+        response = client.search(index=index, body=json.dumps(body), size=max_query_size)
+        for hit in response['hits']['hits']:
+            yield {'_op_type': 'delete', '_index': hit['_index'], '_type': hit['_type'], '_id': hit['_id']}
 
 
 def chunks(l, n):
@@ -510,35 +582,32 @@ def delete_transactions_from_es(client, id_list, job_id, config, index=None):
 
     if index is None:
         index = '{}-*'.format(config['root_index'])
-    start_ = client.search(index=index)['hits']['total']
-    printf({
-        'msg': 'Starting amount of indices ----- {}'.format(start_),
-        'f': 'ES Delete',
-        'job': job_id})
     col_to_items_dict = defaultdict(list)
     for l in id_list:
         col_to_items_dict[l['col']].append(l['key'])
 
+    deleted, not_found = 0, 0
     for column, values in col_to_items_dict.items():
         printf({'msg': 'Deleting {} of "{}"'.format(len(values), column), 'f': 'ES Delete', 'job': job_id})
-        values_generator = chunks(values, 1000)
-        for v in values_generator:
-            # IMPORTANT: This delete routine looks at just 1 index at a time. If there are duplicate records across
-            # multiple indexes, those duplicates will not be caught by this routine. It is left as is because at the
-            # time of this comment, we are migrating to using a single index.
-            body = filter_query(column, v)
-            response = client.search(index=index, body=json.dumps(body), size=config['max_query_size'])
-            delete_body = delete_query(response)
-            try:
-                client.delete_by_query(index=index, body=json.dumps(delete_body), refresh=True,
-                                       size=config['max_query_size'])
-            except Exception as e:
-                printf({'msg': '[ERROR][ERROR][ERROR]\n{}'.format(str(e)), 'f': 'ES Delete', 'job': job_id})
-    end_ = client.search(index=index)['hits']['total']
+        # IMPORTANT: This delete routine looks at just 1 index at a time. If there are duplicate records across
+        # multiple indexes, those duplicates will not be caught by this routine. It is left as is because at the
+        # time of this comment, we are migrating to using a single index.
+        actions = delete_actions(client, index, column, values, config['max_query_size'])
+        try:
+            # Deletes by _id take effect without a refresh. A 404 means a document was deleted since it was searched
+            for ok, item in helpers.streaming_bulk(client, actions, raise_on_error=False):
+                if ok:
+                    deleted += 1
+                elif item['delete'].get('status') == 404:
+                    not_found += 1
+                else:
+                    printf({'msg': '[ERROR][ERROR][ERROR]\n{}'.format(item), 'f': 'ES Delete', 'job': job_id})
+        except Exception as e:
+            printf({'msg': '[ERROR][ERROR][ERROR]\n{}'.format(str(e)), 'f': 'ES Delete', 'job': job_id})
 
     t = perf_counter() - start
-    total = str(start_ - end_)
-    printf({'msg': 'ES Deletes took {}s. Deleted {} records'.format(t, total), 'f': 'ES Delete', 'job': job_id})
+    msg = 'ES Deletes took {}s. Deleted {} records ({} already gone)'.format(t, deleted, not_found)
+    printf({'msg': msg, 'f': 'ES Delete', 'job': job_id})
     return
 
 
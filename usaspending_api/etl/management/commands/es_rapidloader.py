@@ -10,7 +10,9 @@ from time import sleep
 
 from usaspending_api import settings
 from usaspending_api.etl.es_etl_helpers import AWARD_DESC_CATEGORIES
+from usaspending_api.etl.es_etl_helpers import create_index
 from usaspending_api.etl.es_etl_helpers import csv_row_count
+from usaspending_api.etl.es_etl_helpers import CsvBackPressure
 from usaspending_api.etl.es_etl_helpers import DataJob
 from usaspending_api.etl.es_etl_helpers import deleted_transactions
 from usaspending_api.etl.es_etl_helpers import download_db_records
@@ -26,7 +28,7 @@ from usaspending_api.etl.es_etl_helpers import process_guarddog
 # 2. Iterate by job
 #   a. Download 1 CSV file by year and trans type
 #       i. Download the next CSV file until no more jobs need CSVs
-#   b. Upload CSV to Elasticsearch
+#   b. Upload CSV to Elasticsearch (several CSVs at a time, each one with several bulk threads)
 # 3. Take a snapshot of the index reloaded
 #
 # IF RELOADING ---
@@ -87,6 +89,21 @@ class Command(BaseCommand):
             '--snapshot',
             action='store_true',
             help='Take a snapshot of the current cluster and save to S3')
+        parser.add_argument(
+            '--processes',
+            default=2,
+            type=int,
+            help='Number of CSVs to upload to Elasticsearch concurrently')
+        parser.add_argument(
+            '--threads',
+            default=4,
+            type=int,
+            help='Number of bulk request threads used by each of the upload processes')
+        parser.add_argument(
+            '--max_pending_gb',
+            default=10,
+            type=float,
+            help='Pause downloading new CSVs while this many GB of downloaded CSVs are waiting to be uploaded')
 
     # used by parent class
     def handle(self, *args, **options):
@@ -104,6 +121,9 @@ class Command(BaseCommand):
         self.config['keep'] = options['keep']
         self.config['snapshot'] = options['snapshot']
         self.config['index_name'] = options['index_name']
+        self.config['processes'] = max(options['processes'], 1)
+        self.config['threads'] = max(options['threads'], 1)
+        self.config['max_pending_bytes'] = int(options['max_pending_gb'] * 1024 ** 3)
 
         mappingfile = os.path.join(settings.BASE_DIR, 'usaspending_api/etl/es_transaction_mapping.json')
         with open(mappingfile) as f:
@@ -151,7 +171,8 @@ class Command(BaseCommand):
     def controller(self):
 
         download_queue = Queue()  # Queue for jobs whch need a csv downloaded
-        es_ingest_queue = Queue(20)  # Queue for jobs which have a csv and are ready for ES ingest
+        es_ingest_queue = Queue()  # Queue for jobs which have a csv and are ready for ES ingest
+        back_pressure = CsvBackPressure(self.config['max_pending_bytes'], self.config['processes'])
 
         job_id = 0
         for fy in self.config['fiscal_years']:
@@ -169,6 +190,8 @@ class Command(BaseCommand):
                     # This is mostly for testing. If previous CSVs still exist skip the download for that file
                     if self.config['stale']:
                         new_job.count = csv_row_count(filename)
+                        new_job.size = os.path.getsize(filename)
+                        back_pressure.add(new_job.size)
                         printf({
                             'msg': 'Using existing file: {} | count {}'.format(filename, new_job.count),
                             'job': new_job.name,
@@ -186,11 +209,13 @@ class Command(BaseCommand):
         process_list.append(Process(
             name='Download Proccess',
             target=download_db_records,
-            args=(download_queue, es_ingest_queue, self.config)))
-        process_list.append(Process(
-            name='ES Index Process',
-            target=es_data_loader,
-            args=(ES, download_queue, es_ingest_queue, self.config)))
+            args=(download_queue, es_ingest_queue, self.config, back_pressure)))
+        for process_number in range(self.config['processes']):
+            process_list.append(Process(
+                name='ES Index Process {}'.format(process_number),
+                target=es_data_loader,
+                args=(ES, es_ingest_queue, self.config, back_pressure)))
+        index_processes = process_list[1:]
 
         process_list[0].start()  # Start Download process
 
@@ -204,7 +229,10 @@ class Command(BaseCommand):
                 printf({'msg': 'Waiting to start ES ingest until S3 deletes are complete'})
                 sleep(7)
 
-        process_list[1].start()  # start ES ingest process
+        # Create the index up front so the ES ingest processes don't race to create it
+        create_index(ES, self.config['index_name'], self.config)
+        for process in index_processes:
+            process.start()  # start ES ingest processes
 
         while True:
             sleep(10)
@@ -1,11 +1,17 @@
 import logging
+import multiprocessing
 import pytz
 
+from collections import OrderedDict
+
 from django.core.management.base import BaseCommand, CommandError
 from django.core.management import call_command
 from django.db import connections
 from datetime import datetime
 
+from usaspending_api.accounts.models import AppropriationAccountBalances
+from usaspending_api.financial_activities.models import FinancialAccountsByProgramActivityObjectClass
+
 logger = logging.getLogger('console')
 exception_logger = logging.getLogger("exceptions")
 
@@ -17,6 +23,8 @@ class Command(BaseCommand):
         parser.add_argument('fy', nargs=1, help='the fiscal year', type=int)
         parser.add_argument('quarter', nargs=1, help='the fiscal quarter to load', type=int)
         parser.add_argument('--safe', action='store_true', help='only list missing submissions from the FY/Quarter')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='the number of agencies whose submissions are loaded at the same time')
 
     def handle(self, *args, **options):
 
@@ -38,7 +46,7 @@ class Command(BaseCommand):
             return
 
         # Broker fiscal quarter values are 3-6-9-12, so if we take Q1-Q4...
-        quarter = int(quarter) * 3
+        fiscal_period = int(quarter) * 3
 
         broker_cursor.execute("SELECT submission.submission_id, MAX(certify_history.created_at) AS certified_at, \
                                   submission.cgac_code, submission.frec_code \
@@ -48,7 +56,7 @@ class Command(BaseCommand):
                                   AND submission.publish_status_id IN (2, 3) \
                                   AND submission.reporting_fiscal_year = {} \
                                   AND submission.reporting_fiscal_period = {} \
-                                  GROUP BY submission.submission_id;".format(fy, quarter))
+                                  GROUP BY submission.submission_id;".format(fy, fiscal_period))
 
         broker_submission_data = broker_cursor.fetchall()
 
@@ -76,7 +84,8 @@ class Command(BaseCommand):
             agency_name = broker_cursor.fetchone()[0]
 
             if certify_date > most_recently_loaded_date:
-                missing_submissions.append((submission_id, agency_name, certify_date, most_recently_loaded_date))
+                missing_submissions.append((submission_id, agency_name, certify_date, most_recently_loaded_date,
+                                            cgac or frec))
 
         logger.info("Total missing submissions: {}".format(len(missing_submissions)))
         logger.info("-----------------------------------")
@@ -87,10 +96,78 @@ class Command(BaseCommand):
 
         # Stuff happens here, if you don't flag '--safe'
         # The submission loader is atomic, so one of these failing should not affect subsequent submissions
-        if not options["safe"]:
-            for next_missing_sub in missing_submissions:
-                try:
-                    call_command('load_submission', '--noclean', '--nosubawards', next_missing_sub[0])
-                except CommandError:
-                    logger.info('Skipping submission ID {} due to CommandError (bad ID)'.format(next_missing_sub[0]))
-                    continue
+        if not options["safe"] and missing_submissions:
+            agency_submissions = group_submissions_by_agency(missing_submissions)
+            processes = max(options['processes'], 1)
+            logger.info('Loading {} submissions of {} agencies in {} processes'.format(
+                len(missing_submissions), len(agency_submissions), processes))
+
+            failed_submissions = []
+            try:
+                if processes == 1:
+                    results = map(load_agency_submissions, agency_submissions)
+                    failed_submissions = self.report_progress(results, len(missing_submissions))
+                else:
+                    # Forked processes must not share the parent's database connections
+                    connections.close_all()
+                    # A fresh process for each agency, so no loader state carries over from another agency's
+                    # submissions
+                    with multiprocessing.Pool(processes, maxtasksperchild=1) as pool:
+                        results = pool.imap_unordered(load_agency_submissions, agency_submissions)
+                        failed_submissions = self.report_progress(results, len(missing_submissions))
+            finally:
+                # Done once for all the submissions, which were loaded with --norefresh; whatever was committed
+                # before a failure is refreshed too
+                logger.info('Recomputing final_of_fy and rebuilding the Spending Explorer rollup...')
+                AppropriationAccountBalances.populate_final_of_fy()
+                FinancialAccountsByProgramActivityObjectClass.populate_final_of_fy()
+                call_command('load_spending_explorer_rollup', fiscal_year=[fy], quarter=[quarter])
+
+            if failed_submissions:
+                raise CommandError('Failed to load submission IDs: {}'.format(
+                    ', '.join(str(submission_id) for submission_id in sorted(failed_submissions))))
+
+    @staticmethod
+    def report_progress(results, total_submissions):
+        """Logs the progress as each agency's submissions are loaded, returning the ids of those that failed"""
+        processed = 0
+        failed_submissions = []
+        for agency_results in results:
+            for submission_id, error in agency_results:
+                processed += 1
+                if error:
+                    logger.info('Skipping submission ID {} due to {}'.format(submission_id, error))
+                    failed_submissions.append(submission_id)
+            logger.info('Processed {} of {} submissions'.format(processed, total_submissions))
+        logger.info('Failed to load {} of {} submissions'.format(len(failed_submissions), total_submissions))
+        return failed_submissions
+
+
+def group_submissions_by_agency(missing_submissions):
+    """
+    Lists the ids of the missing submissions of each agency (CGAC, or FREC when there is no CGAC), in the order they
+    were certified, so that an agency's resubmissions are loaded one after the other
+    """
+    agency_submissions = OrderedDict()
+    for next_missing_sub in sorted(missing_submissions, key=lambda missing_sub: missing_sub[2]):
+        agency_submissions.setdefault(next_missing_sub[4], []).append(next_missing_sub[0])
+    return list(agency_submissions.values())
+
+
+def load_agency_submissions(submission_ids):
+    """
+    Loads one agency's submissions in order, returning (submission id, why it was not loaded or None) for each. A
+    submission that fails is logged and skipped, so that it neither stops the agency's other submissions nor the other
+    agencies' loads.
+    """
+    results = []
+    for submission_id in submission_ids:
+        try:
+            call_command('load_submission', '--noclean', '--nosubawards', '--norefresh', submission_id)
+            results.append((submission_id, None))
+        except CommandError:
+            results.append((submission_id, 'CommandError (bad ID)'))
+        except Exception as e:
+            exception_logger.exception('Failed to load submission ID {}'.format(submission_id))
+            results.append((submission_id, '{}: {}'.format(type(e).__name__, e)))
+    return results
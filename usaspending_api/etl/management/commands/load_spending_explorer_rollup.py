@@ -0,0 +1,45 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from usaspending_api.financial_activities.models import SpendingExplorerRollup
+from usaspending_api.spending_explorer.v2.filters.rollup import build_rollup
+from usaspending_api.submissions.models import SubmissionAttributes
+
+logger = logging.getLogger('console')
+
+
+class Command(BaseCommand):
+    """
+    Builds the precomputed Spending Explorer drilldowns (SpendingExplorerRollup) from scratch. load_submission keeps
+    them up to date afterwards for the periods and agencies each submission changes.
+
+    A period cannot be requested until its submission window closes, so the rollup of a period loaded before then is
+    skipped. Run with --missing daily to build those periods once they can be requested.
+    """
+    help = 'Builds the Spending Explorer rollup for every fiscal period with submissions, or the ones given'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fiscal_year', type=int, nargs='+', help='the fiscal years to build')
+        parser.add_argument('--quarter', type=int, nargs='+', choices=[1, 2, 3, 4], help='the quarters to build')
+        parser.add_argument('--missing', action='store_true', help='only build the periods without a rollup yet')
+
+    def handle(self, *args, **options):
+        periods = SubmissionAttributes.objects.values_list('reporting_fiscal_year', 'reporting_fiscal_quarter'). \
+            filter(reporting_fiscal_year__isnull=False, reporting_fiscal_quarter__isnull=False).distinct(). \
+            order_by('reporting_fiscal_year', 'reporting_fiscal_quarter')
+        if options['fiscal_year']:
+            periods = periods.filter(reporting_fiscal_year__in=options['fiscal_year'])
+        if options['quarter']:
+            periods = periods.filter(reporting_fiscal_quarter__in=options['quarter'])
+
+        if options['missing']:
+            # Such as the periods skipped because they could not be requested yet when their submissions loaded
+            built = set(SpendingExplorerRollup.objects.values_list('fiscal_year', 'fiscal_quarter').distinct())
+            periods = [period for period in periods if period not in built]
+
+        for fiscal_year, fiscal_quarter in list(periods):
+            built = build_rollup(fiscal_year, fiscal_quarter)
+            if built is not None:
+                msg = 'Built {} Spending Explorer rollup rows for FY{} Q{}'
+                logger.info(msg.format(built, fiscal_year, fiscal_quarter))
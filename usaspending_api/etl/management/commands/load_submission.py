@@ -16,15 +16,16 @@ from usaspending_api.awards.models import Award, FinancialAccountsByAwards
 from usaspending_api.financial_activities.models import (
     FinancialAccountsByProgramActivityObjectClass, TasProgramActivityObjectClassQuarterly)
 from usaspending_api.common.helpers.generic_helper import upper_case_dict_values
+from usaspending_api.download.helpers import stamp_data_load_watermark
 from usaspending_api.references.models import ObjectClass, RefProgramActivity
 from usaspending_api.submissions.models import SubmissionAttributes
-from usaspending_api.etl.award_helpers import get_award_financial_transaction, get_awarding_agency
 from usaspending_api.etl.helpers import get_fiscal_quarter, get_previous_submission
 from usaspending_api.etl.broker_etl_helpers import dictfetchall, PhonyCursor
 from usaspending_api.etl.subaward_etl import load_subawards
 
 from usaspending_api.etl.management import load_base
 from usaspending_api.etl.management.load_base import load_data_into_model
+from usaspending_api.spending_explorer.v2.filters.rollup import refresh_rollup_for_submission
 
 # This dictionary will hold a map of tas_id -> treasury_account to ensure we don't keep hitting the databroker DB for
 # account data
@@ -33,6 +34,12 @@ TAS_ID_TO_ACCOUNT = {}
 # Lists to store for update_awards and update_contract_awards
 AWARD_UPDATE_ID_LIST = []
 
+# Number of File B rows inserted per bulk_create
+FILE_B_BATCH_SIZE = 10000
+
+# Number of File C award keys looked up per query, and of File C rows inserted per bulk_create
+FILE_C_BATCH_SIZE = 10000
+
 awards_cache = caches['awards']
 logger = logging.getLogger('console')
 
@@ -55,6 +62,14 @@ class Command(load_base.Command):
             default=False,
             help='Skips the D1/D2 subaward load for this submission.'
         )
+        parser.add_argument(
+            '--norefresh',
+            action='store_true',
+            dest='norefresh',
+            default=False,
+            help='Skips recomputing final_of_fy and rebuilding the Spending Explorer rollup, for callers that do it '
+                 'once after loading many submissions.'
+        )
         super(Command, self).add_arguments(parser)
 
     @transaction.atomic
@@ -105,6 +120,10 @@ class Command(load_base.Command):
         load_file_b(submission_attributes, prg_act_obj_cls_data, db_cursor)
         logger.info('Finished loading File B data, took {}'.format(datetime.now() - start_time))
 
+        if not options['norefresh']:
+            AppropriationAccountBalances.populate_final_of_fy()
+            FinancialAccountsByProgramActivityObjectClass.populate_final_of_fy(submission_attributes.submission_id)
+
         logger.info('Getting File C data')
         # we dont have sub-tier agency info, so we'll do our best
         # to match them to the more specific award records
@@ -133,6 +152,20 @@ class Command(load_base.Command):
         else:
             logger.info('Skipping subawards due to flags...')
 
+        if not options['norefresh']:
+            try:
+                start_time = datetime.now()
+                logger.info('Rebuilding the Spending Explorer rollup...')
+                refresh_rollup_for_submission(submission_attributes)
+                logger.info('Finished rebuilding the Spending Explorer rollup, took {}'.format(
+                    datetime.now() - start_time))
+            except Exception:
+                logger.warning('Error rebuilding the Spending Explorer rollup for this submission; its period is '
+                               'computed live until the rollup is rebuilt')
+
+        # Account downloads made before this load no longer match the data
+        stamp_data_load_watermark('account')
+
         # Once all the files have been processed, run any global cleanup/post-load tasks.
         # Cleanup not specific to this submission is run in the `.handle` method
         logger.info('Successfully loaded broker submission {}.'.format(options['submission_id'][0]))
@@ -179,6 +212,20 @@ def get_or_create_object_class_rw(row, logger):
                 (used only when the object_class is 3 digits instead of 4)
     """
 
+    # we couldn't find a matching object class record, so create one
+    # (note: is this really what we want to do? should we map to an 'unknown' instead?)
+    # should
+    obj_class, created = ObjectClass.objects.get_or_create(**get_object_class_filters(row))
+    if created:
+        logger.warning('Created missing object_class record for {}'.format(obj_class.object_class))
+
+    return obj_class
+
+
+def get_object_class_filters(row):
+    """The fields an object class record is looked up (or created) with, for the row arguments of
+    ``get_or_create_object_class_rw``"""
+
     if len(row.object_class) == 4:
         # this is a 4 digit object class, 1st digit = direct/reimbursable information
         direct_reimbursable = row.object_class[:1]
@@ -211,29 +258,66 @@ def get_or_create_object_class_rw(row, logger):
     else:
         major_object_class_name = 'Unknown'
 
-    # we couldn't find a matching object class record, so create one
-    # (note: is this really what we want to do? should we map to an 'unknown' instead?)
-    # should
-    obj_class, created = ObjectClass.objects.get_or_create(
-        major_object_class=major_object_class,
-        major_object_class_name=major_object_class_name,
-        object_class=object_class,
-        direct_reimbursable=direct_reimbursable)
-    if created:
-        logger.warning('Created missing object_class record for {}'.format(object_class))
+    return {
+        'major_object_class': major_object_class,
+        'major_object_class_name': major_object_class_name,
+        'object_class': object_class,
+        'direct_reimbursable': direct_reimbursable,
+    }
 
-    return obj_class
+
+def get_or_create_object_classes(object_class_keys, logger):
+    """Lookup the object class records of many rows at once.
+
+       (As ``get_or_create_object_class``, but the object classes are read in one query and the missing ones are
+       created with a single bulk_create.)
+
+        Args:
+            object_class_keys: (object class, direct/reimbursable flag) pairs from the broker
+        Returns:
+            dict of each distinct pair to its object class record
+    """
+    existing = {}
+    for obj_class in ObjectClass.objects.order_by('pk'):
+        existing.setdefault((obj_class.major_object_class, obj_class.major_object_class_name, obj_class.object_class,
+                             obj_class.direct_reimbursable), obj_class)
+
+    object_classes, missing = {}, {}
+    for object_class_key in set(object_class_keys):
+        filters = get_object_class_filters(Bunch(object_class=object_class_key[0],
+                                                 by_direct_reimbursable_fun=object_class_key[1]))
+        # direct_reimbursable is derived as an int from the flag, but is stored as text
+        if filters['direct_reimbursable'] is not None:
+            filters['direct_reimbursable'] = str(filters['direct_reimbursable'])
+        filter_key = (filters['major_object_class'], filters['major_object_class_name'], filters['object_class'],
+                      filters['direct_reimbursable'])
+
+        obj_class = existing.get(filter_key) or missing.get(filter_key)
+        if obj_class is None:
+            obj_class = missing[filter_key] = ObjectClass(**filters)
+        object_classes[object_class_key] = obj_class
+
+    ObjectClass.objects.bulk_create(list(missing.values()))
+    for obj_class in missing.values():
+        logger.warning('Created missing object_class record for {}'.format(obj_class.object_class))
+
+    return object_classes
+
+
+def get_program_activity_filters(row, submission_attributes):
+    """The fields a program activity record is looked up (or created) with"""
+    return {'program_activity_code': row['program_activity_code'],
+            'program_activity_name': row['program_activity_name'].upper() if row['program_activity_name']
+            else row['program_activity_name'],
+            'budget_year': submission_attributes.reporting_fiscal_year,
+            'responsible_agency_id': row['agency_identifier'],
+            'allocation_transfer_agency_id': row['allocation_transfer_agency'],
+            'main_account_code': row['main_account_code'], }
 
 
 def get_or_create_program_activity(row, submission_attributes):
     # We do it this way rather than .get_or_create because we do not want to duplicate existing pk's with null values
-    filters = {'program_activity_code': row['program_activity_code'],
-               'program_activity_name': row['program_activity_name'].upper() if row['program_activity_name']
-               else row['program_activity_name'],
-               'budget_year': submission_attributes.reporting_fiscal_year,
-               'responsible_agency_id': row['agency_identifier'],
-               'allocation_transfer_agency_id': row['allocation_transfer_agency'],
-               'main_account_code': row['main_account_code'], }
+    filters = get_program_activity_filters(row, submission_attributes)
     prg_activity = RefProgramActivity.objects.filter(**filters).first()
     if prg_activity is None and row['program_activity_code'] is not None:
         # If the PA has a blank name, create it with the value in the row.
@@ -245,6 +329,36 @@ def get_or_create_program_activity(row, submission_attributes):
     return prg_activity
 
 
+def get_or_create_program_activities(rows, submission_attributes):
+    """
+    As ``get_or_create_program_activity`` for each of the rows, but with the program activities of the submission's
+    fiscal year read in one query and the missing ones created with a single bulk_create.
+
+    Returns the program activity of each row, in the order of the rows.
+    """
+    key_fields = ('program_activity_code', 'program_activity_name', 'responsible_agency_id',
+                  'allocation_transfer_agency_id', 'main_account_code')
+
+    existing = {}
+    for prg_activity in RefProgramActivity.objects.filter(
+            budget_year=submission_attributes.reporting_fiscal_year).order_by('pk'):
+        existing.setdefault(tuple(getattr(prg_activity, field) for field in key_fields), prg_activity)
+
+    program_activities, missing = [], {}
+    for row in rows:
+        filters = get_program_activity_filters(row, submission_attributes)
+        filter_key = tuple(filters[field] for field in key_fields)
+
+        prg_activity = existing.get(filter_key) or missing.get(filter_key)
+        if prg_activity is None and filters['program_activity_code'] is not None:
+            prg_activity = missing[filter_key] = RefProgramActivity(**filters)
+        program_activities.append(prg_activity)
+
+    RefProgramActivity.objects.bulk_create(list(missing.values()))
+
+    return program_activities
+
+
 def get_treasury_appropriation_account_tas_lookup(tas_lookup_id, db_cursor):
     """Get the matching TAS object from the broker database and save it to our running list."""
     if tas_lookup_id in TAS_ID_TO_ACCOUNT:
@@ -368,8 +482,6 @@ def load_file_a(submission_attributes, appropriation_data, db_cursor):
         load_data_into_model(appropriation_balances, row, field_map=field_map, value_map=value_map, save=True,
                              reverse=reverse)
 
-    AppropriationAccountBalances.populate_final_of_fy()
-
     # Insert File A quarterly numbers for this submission
     AppropriationAccountBalancesQuarterly.insert_quarterly_numbers(submission_attributes.submission_id)
 
@@ -519,10 +631,15 @@ def load_file_b(submission_attributes, prg_act_obj_cls_data, db_cursor):
     # rows = row numbers skipped, corresponding to the original row numbers in the file that was submitted
     skipped_tas = {}
 
-    test_counter = 0
+    # the corresponding account balances rows (aka "File A" records) of the submission, by TAS
+    account_balances_by_tas = {}
+    for account_balances in AppropriationAccountBalances.objects.filter(
+            submission_id=submission_attributes.submission_id):
+        account_balances_by_tas.setdefault(account_balances.treasury_account_identifier_id, []).append(
+            account_balances)
+
+    rows_to_load = []
     for row in prg_act_obj_cls_data:
-        test_counter += 1
-        account_balances = None
         try:
             # Check and see if there is an entry for this TAS
             treasury_account, tas_rendering_label = get_treasury_appropriation_account_tas_lookup(row.get('tas_id'),
@@ -533,12 +650,23 @@ def load_file_b(submission_attributes, prg_act_obj_cls_data, db_cursor):
         except Exception:    # TODO: What is this trying to catch, actually?
             continue
 
-        # get the corresponding account balances row (aka "File A" record)
-        account_balances = AppropriationAccountBalances.objects.get(
-            treasury_account_identifier=treasury_account,
-            submission_id=submission_attributes.submission_id
-        )
-
+        account_balances = account_balances_by_tas.get(treasury_account.treasury_account_identifier, [])
+        if not account_balances:
+            msg = 'No File A record for {} in submission {}'
+            raise AppropriationAccountBalances.DoesNotExist(
+                msg.format(tas_rendering_label, submission_attributes.submission_id))
+        if len(account_balances) > 1:
+            msg = '{} File A records for {} in submission {}'
+            raise AppropriationAccountBalances.MultipleObjectsReturned(
+                msg.format(len(account_balances), tas_rendering_label, submission_attributes.submission_id))
+        rows_to_load.append((row, treasury_account, account_balances[0]))
+
+    object_classes = get_or_create_object_classes(
+        [(row['object_class'], row['by_direct_reimbursable_fun']) for row, _, _ in rows_to_load], logger)
+    program_activities = get_or_create_program_activities([row for row, _, _ in rows_to_load], submission_attributes)
+
+    financial_by_prg_act_obj_cls_list = []
+    for (row, treasury_account, account_balances), program_activity in zip(rows_to_load, program_activities):
         financial_by_prg_act_obj_cls = FinancialAccountsByProgramActivityObjectClass()
 
         value_map = {
@@ -547,17 +675,19 @@ def load_file_b(submission_attributes, prg_act_obj_cls_data, db_cursor):
             'reporting_period_end': submission_attributes.reporting_period_end,
             'treasury_account': treasury_account,
             'appropriation_account_balances': account_balances,
-            'object_class': get_or_create_object_class(row['object_class'], row['by_direct_reimbursable_fun'], logger),
-            'program_activity': get_or_create_program_activity(row, submission_attributes)
+            'object_class': object_classes[(row['object_class'], row['by_direct_reimbursable_fun'])],
+            'program_activity': program_activity
         }
 
-        load_data_into_model(financial_by_prg_act_obj_cls, row, value_map=value_map, save=True, reverse=reverse)
+        financial_by_prg_act_obj_cls_list.append(
+            load_data_into_model(financial_by_prg_act_obj_cls, row, value_map=value_map, reverse=reverse))
+
+    FinancialAccountsByProgramActivityObjectClass.objects.bulk_create(financial_by_prg_act_obj_cls_list,
+                                                                      batch_size=FILE_B_BATCH_SIZE)
 
     # Insert File B quarterly numbers for this submission
     TasProgramActivityObjectClassQuarterly.insert_quarterly_numbers(submission_attributes.submission_id)
 
-    FinancialAccountsByProgramActivityObjectClass.populate_final_of_fy()
-
     for key in skipped_tas:
         logger.info('Skipped %d rows due to missing TAS: %s', skipped_tas[key]['count'], key)
 
@@ -612,6 +742,56 @@ def find_matching_award(piid=None, parent_piid=None, fain=None, uri=None):
         return None
 
 
+def build_award_lookups(award_financial_rows):
+    """
+        Reads, in batches, every award (with a latest transaction) that any File C row could match on its piid, fain or
+        uri, and indexes the award ids by each combination of fields that find_matching_award filters on
+
+        :param award_financial_rows: File C rows, as dicts
+        :return: dict of 'piid', 'piid_parent', 'fain' and 'uri' lookups, each mapping its key to a list of award ids
+    """
+    award_lookups = {'piid': {}, 'piid_parent': {}, 'fain': {}, 'uri': {}}
+
+    for field in ('piid', 'fain', 'uri'):
+        values = list({row.get(field) for row in award_financial_rows if row.get(field)})
+        for batch_start in range(0, len(values), FILE_C_BATCH_SIZE):
+            awards = Award.objects.filter(latest_transaction_id__isnull=False,
+                                          **{field + '__in': values[batch_start:batch_start + FILE_C_BATCH_SIZE]})
+            for award in awards.values('id', 'piid', 'parent_award_piid', 'fain', 'uri'):
+                award_lookups[field].setdefault(award[field], []).append(award['id'])
+                if field == 'piid':
+                    award_lookups['piid_parent'].setdefault((award['piid'], award['parent_award_piid']), []). \
+                        append(award['id'])
+
+    return award_lookups
+
+
+def match_award_id(award_lookups, piid=None, parent_piid=None, fain=None, uri=None):
+    """
+        Same rules as find_matching_award, but against the lookups of build_award_lookups instead of the database
+
+        :return: id of the exactly matched award OR None if no exact match found
+    """
+    if piid:
+        if parent_piid:
+            matches = award_lookups['piid_parent'].get((piid, parent_piid), [])
+        else:
+            matches = award_lookups['piid'].get(piid, [])
+    elif fain and not uri:
+        matches = award_lookups['fain'].get(fain, [])
+    elif uri and not fain:
+        matches = award_lookups['uri'].get(uri, [])
+    elif fain and uri:
+        # filter on fain first for an exact match. if no exact match found, then try the uri
+        matches = award_lookups['fain'].get(fain, [])
+        if len(matches) != 1:
+            matches = award_lookups['uri'].get(uri, [])
+    else:
+        return None
+
+    return matches[0] if len(matches) == 1 else None
+
+
 def load_file_c(submission_attributes, db_cursor, award_financial_frame):
     """
     Process and load file C broker data.
@@ -633,63 +813,53 @@ def load_file_c(submission_attributes, db_cursor, award_financial_frame):
     # rows = row numbers skipped, corresponding to the original row numbers in the file that was submitted
     skipped_tas = {}
 
-    award_financial_frame['txn'] = award_financial_frame.apply(get_award_financial_transaction, axis=1)
-    award_financial_frame['awarding_agency'] = award_financial_frame.apply(get_awarding_agency, axis=1)
-    award_financial_frame['object_class'] = award_financial_frame.apply(get_or_create_object_class_rw, axis=1,
-                                                                        logger=logger)
-    award_financial_frame['program_activity'] = award_financial_frame.apply(get_or_create_program_activity, axis=1,
-                                                                            submission_attributes=submission_attributes)
-
-    total_rows = award_financial_frame.shape[0]
-    start_time = datetime.now()
-    awards_touched = []
-
     # format award_financial_frame
     float_cols = ['transaction_obligated_amou']
     award_financial_frame[float_cols] = award_financial_frame[float_cols].fillna(0)
     award_financial_frame = award_financial_frame.replace({np.nan: None})
+    award_financial_rows = award_financial_frame.to_dict(orient='records')
+
+    # Resolve each distinct TAS, object class and program activity once for the whole file, not once per row
+    tas_lookups = {}
+    for row in award_financial_rows:
+        if row.get('tas_id') not in tas_lookups:
+            tas_lookups[row.get('tas_id')] = get_treasury_appropriation_account_tas_lookup(row.get('tas_id'),
+                                                                                           db_cursor)
+    object_classes = get_or_create_object_classes(
+        [(row['object_class'], row['by_direct_reimbursable_fun']) for row in award_financial_rows], logger)
+    program_activities = get_or_create_program_activities(award_financial_rows, submission_attributes)
+
+    for row, program_activity in zip(award_financial_rows, program_activities):
+        row['object_class'] = object_classes[(row['object_class'], row['by_direct_reimbursable_fun'])]
+        row['program_activity'] = program_activity
+        upper_case_dict_values(row)
 
-    for index, row in enumerate(award_financial_frame.to_dict(orient='records'), 1):
-        if not (index % 100):
-            logger.info('C File Load: Loading row {} of {} ({})'.format(str(index),
-                                                                        str(total_rows),
-                                                                        datetime.now() - start_time))
+    award_lookups = build_award_lookups(award_financial_rows)
 
-        upper_case_dict_values(row)
+    total_rows = len(award_financial_rows)
+    start_time = datetime.now()
+    awards_touched = set()
+    award_financial_list = []
 
+    for index, row in enumerate(award_financial_rows, 1):
         # Check and see if there is an entry for this TAS
-        treasury_account, tas_rendering_label = get_treasury_appropriation_account_tas_lookup(
-            row.get('tas_id'), db_cursor)
+        treasury_account, tas_rendering_label = tas_lookups[row.get('tas_id')]
         if treasury_account is None:
             update_skipped_tas(row, tas_rendering_label, skipped_tas)
             continue
 
-        # Find a matching transaction record, so we can use its subtier agency information to match to (or create) an
-        # Award record.
-
-        # Find the award that this award transaction belongs to. If it doesn't exist, create it.
-        filters = {}
+        # Find the award that this award transaction belongs to
         if row.get('piid'):
-            filters['piid'] = row.get('piid')
-            filters['parent_piid'] = row.get('parent_award_id')
+            award_id = match_award_id(award_lookups, piid=row.get('piid'), parent_piid=row.get('parent_award_id'))
         else:
-            if row.get('fain') and not row.get('uri'):
-                filters['fain'] = row.get('fain')
-            elif row.get('uri') and not row.get('fain'):
-                filters['uri'] = row.get('uri')
-            else:
-                filters['fain'] = row.get('fain')
-                filters['uri'] = row.get('uri')
-
-        award = find_matching_award(**filters)
+            award_id = match_award_id(award_lookups, fain=row.get('fain'), uri=row.get('uri'))
 
-        if award:
-            awards_touched += [award]
+        if award_id:
+            awards_touched.add(award_id)
 
-        award_financial_data = FinancialAccountsByAwards()
+        award_financial_data = FinancialAccountsByAwards(award_id=award_id)
 
         value_map_faba = {
-            'award': award,
             'submission': submission_attributes,
             'reporting_period_start': submission_attributes.reporting_period_start,
             'reporting_period_end': submission_attributes.reporting_period_end,
@@ -699,7 +869,16 @@ def load_file_c(submission_attributes, db_cursor, award_financial_frame):
         }
 
         # Still using the cpe|fyb regex compiled above for reverse
-        load_data_into_model(award_financial_data, row, value_map=value_map_faba, save=True, reverse=reverse)
+        award_financial_list.append(load_data_into_model(award_financial_data, row, value_map=value_map_faba,
+                                                         reverse=reverse))
+
+        if len(award_financial_list) == FILE_C_BATCH_SIZE:
+            FinancialAccountsByAwards.objects.bulk_create(award_financial_list)
+            award_financial_list = []
+            logger.info('C File Load: Loaded row {} of {} ({})'.format(index, total_rows, datetime.now() - start_time))
+
+    FinancialAccountsByAwards.objects.bulk_create(award_financial_list)
+    logger.info('C File Load: Loaded {} rows ({})'.format(total_rows, datetime.now() - start_time))
 
     awards_cache.clear()
 
@@ -712,4 +891,4 @@ def load_file_c(submission_attributes, db_cursor, award_financial_frame):
 
     logger.info('Skipped a total of {} TAS rows for File C'.format(total_tas_skipped))
 
-    return [award.id for award in awards_touched if award]
+    return list(awards_touched)
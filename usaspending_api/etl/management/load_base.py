@@ -20,7 +20,8 @@ from usaspending_api.common.long_to_terse import LONG_TO_TERSE_LABELS
 from usaspending_api.etl.broker_etl_helpers import PhonyCursor, setup_broker_fdw
 from usaspending_api.etl.helpers import update_model_description_fields
 from usaspending_api.references.helpers import canonicalize_location_dict
-from usaspending_api.references.models import (Agency, LegalEntity, Cfda, Location, )
+from usaspending_api.references.models import (LegalEntity, Cfda, Location, )
+from usaspending_api.references.reference_helpers import agency_resolver, enrich_locations
 from usaspending_api.references.abbreviations import territory_country_codes
 
 # Lists to store for update_awards and update_contract_awards
@@ -188,19 +189,19 @@ def load_file_d1(submission_attributes, procurement_data, db_cursor, quick=False
         # use the sub tier code to look it up. This code assumes that all incoming
         # records will supply an awarding subtier agency code
         if row['awarding_agency_code'] is None or len(row['awarding_agency_code'].strip()) < 1:
-            row['awarding_agency_code'] = Agency.get_by_subtier(
+            row['awarding_agency_code'] = agency_resolver.get_by_subtier(
                 row["awarding_sub_tier_agency_c"]).toptier_agency.cgac_code
         # If funding toptier agency code (aka CGAC) is empty, try using the sub
         # tier funding code to look it up. Unlike the awarding agency, we can't
         # assume that the funding agency subtier code will always be present.
         if row['funding_agency_code'] is None or len(row['funding_agency_code'].strip()) < 1:
-            funding_agency = Agency.get_by_subtier(row["funding_sub_tier_agency_co"])
+            funding_agency = agency_resolver.get_by_subtier(row["funding_sub_tier_agency_co"])
             row['funding_agency_code'] = (
                 funding_agency.toptier_agency.cgac_code if funding_agency is not None
                 else None)
 
         # Find the award that this award transaction belongs to. If it doesn't exist, create it.
-        awarding_agency = Agency.get_by_toptier_subtier(
+        awarding_agency = agency_resolver.get_by_toptier_subtier(
             row['awarding_agency_code'],
             row["awarding_sub_tier_agency_c"]
         )
@@ -218,8 +219,8 @@ def load_file_d1(submission_attributes, procurement_data, db_cursor, quick=False
         parent_txn_value_map = {
             "award": award,
             "awarding_agency": awarding_agency,
-            "funding_agency": Agency.get_by_toptier_subtier(row['funding_agency_code'],
-                                                            row["funding_sub_tier_agency_co"]),
+            "funding_agency": agency_resolver.get_by_toptier_subtier(row['funding_agency_code'],
+                                                                     row["funding_sub_tier_agency_co"]),
             "recipient": legal_entity,
             "place_of_performance": pop_location,
             'submission': submission_attributes,
@@ -365,19 +366,19 @@ def load_file_d2(
         # use the sub tier code to look it up. This code assumes that all incoming
         # records will supply an awarding subtier agency code
         if row['awarding_agency_code'] is None or len(row['awarding_agency_code'].strip()) < 1:
-            row['awarding_agency_code'] = Agency.get_by_subtier(
+            row['awarding_agency_code'] = agency_resolver.get_by_subtier(
                 row["awarding_sub_tier_agency_c"]).toptier_agency.cgac_code
         # If funding toptier agency code (aka CGAC) is empty, try using the sub
         # tier funding code to look it up. Unlike the awarding agency, we can't
         # assume that the funding agency subtier code will always be present.
         if row['funding_agency_code'] is None or len(row['funding_agency_code'].strip()) < 1:
-            funding_agency = Agency.get_by_subtier(row["funding_sub_tier_agency_co"])
+            funding_agency = agency_resolver.get_by_subtier(row["funding_sub_tier_agency_co"])
             row['funding_agency_code'] = (
                 funding_agency.toptier_agency.cgac_code if funding_agency is not None
                 else None)
 
         # Find the award that this award transaction belongs to. If it doesn't exist, create it.
-        awarding_agency = Agency.get_by_toptier_subtier(
+        awarding_agency = agency_resolver.get_by_toptier_subtier(
             row['awarding_agency_code'],
             row["awarding_sub_tier_agency_c"]
         )
@@ -393,8 +394,8 @@ def load_file_d2(
         parent_txn_value_map = {
             "award": award,
             "awarding_agency": awarding_agency,
-            "funding_agency": Agency.get_by_toptier_subtier(row['funding_agency_code'],
-                                                            row["funding_sub_tier_agency_co"]),
+            "funding_agency": agency_resolver.get_by_toptier_subtier(row['funding_agency_code'],
+                                                                     row["funding_sub_tier_agency_co"]),
             "recipient": legal_entity,
             "place_of_performance": pop_location,
             'submission': submission_attributes,
@@ -537,6 +538,24 @@ def create_location(location_map, row, location_value_map=None):
     return Location.objects.create(**location_data)
 
 
+def build_location(location_map, row, location_value_map=None):
+    """
+    Same as create_location, but the Location is returned unsaved so that it can be bulk created. Bulk creation skips
+    Location.save(), so the derivations it would make are already applied, with the city/county data looked up in
+    memory by enrich_locations.
+    """
+    if location_value_map is None:
+        location_value_map = {}
+
+    row = canonicalize_location_dict(row)
+    location_data = load_data_into_model(
+        Location(), row, value_map=location_value_map, field_map=location_map, as_dict=True, save=False)
+
+    location = Location(**location_data)
+    enrich_locations([location])
+    return location
+
+
 def get_or_create_location(location_map, row, location_value_map=None, empty_location=None, d_file=False, save=True):
     """
     Retrieve or create a location object
@@ -1,16 +1,22 @@
 import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
 
 from usaspending_api.awards.models import Award, Subaward
-from usaspending_api.references.models import LegalEntity, Cfda, Agency
-from usaspending_api.etl.helpers import get_or_create_location
+from usaspending_api.common.helpers.etl_helpers import bulk_update
+from usaspending_api.references.helpers import get_reference_data_map
+from usaspending_api.references.models import Cfda, RefCountryCode
+from usaspending_api.references.reference_helpers import agency_resolver, city_county_index
 from usaspending_api.etl.award_helpers import update_award_subawards
 from usaspending_api.etl.broker_etl_helpers import dictfetchall
 
 logger = logging.getLogger("console")
 
-# These queries are directly from the broker
+# These queries are directly from the broker, plus the FSRS award's id and internal id (which the joined tables' own
+# id columns would shadow), which load_fsrs matches the subawards it loads on
 D1_FILE_F_QUERY = """
-SELECT DISTINCT ON (subcontract_num, fsrs_procurement.contract_number, fsrs_procurement.idv_reference_number) *
+SELECT DISTINCT ON (subcontract_num, fsrs_procurement.contract_number, fsrs_procurement.idv_reference_number) *,
+       fsrs_procurement.id AS fsrs_award_id, fsrs_procurement.internal_id AS fsrs_internal_id
 FROM   fsrs_procurement
        LEFT OUTER JOIN award_procurement ON fsrs_procurement.contract_number = award_procurement.piid
                                          AND fsrs_procurement.idv_reference_number = award_procurement.parent_award_id
@@ -19,7 +25,8 @@ WHERE  award_procurement.submission_id = %s AND award_procurement.piid IN %s
 """
 
 D2_FILE_F_QUERY = """
-SELECT DISTINCT ON (subaward_num, award_financial_assistance.fain, award_financial_assistance.uri) *
+SELECT DISTINCT ON (subaward_num, award_financial_assistance.fain, award_financial_assistance.uri) *,
+       fsrs_grant.id AS fsrs_award_id, fsrs_grant.internal_id AS fsrs_internal_id
 FROM   fsrs_grant
        LEFT OUTER JOIN award_financial_assistance ON fsrs_grant.fain = award_financial_assistance.fain
        LEFT OUTER JOIN fsrs_subgrant ON fsrs_grant.id = fsrs_subgrant.parent_id
@@ -28,6 +35,14 @@ WHERE  award_financial_assistance.submission_id = %s
 """
 
 
+# Number of awards or subawards read or written per query while loading File F
+SUBAWARD_BATCH_SIZE = 10000
+
+# The award values each subaward copies from its prime award
+PRIME_AWARD_FIELDS = ('id', 'awarding_agency_id', 'funding_agency_id', 'recipient_id', 'recipient__recipient_name',
+                      'type', 'latest_transaction_id', 'last_modified_date')
+
+
 def load_subawards(submission_attributes, awards_touched, db_cursor):
     """
     Loads File F from the broker. db_cursor should be the db_cursor for Broker
@@ -35,51 +50,40 @@ def load_subawards(submission_attributes, awards_touched, db_cursor):
     # A list of award id's to update the subaward accounts and totals on
     award_ids_to_update = set()
 
-    # Get a list of PIIDs from this submission
+    # Get a list of PIIDs and FAINs from this submission
     # TODO: URIS
-    awards_touched = [Award.objects.filter(id=award_id).first() for award_id in awards_touched]
-    piids = list([award.piid for award in awards_touched if award.piid])
-    fains = list([award.fain for award in awards_touched if award.fain])
-    uris = list([award.uri for award in awards_touched if award.uri])
+    piids, fains = set(), set()
+    awards_touched = list(awards_touched)
+    for batch_start in range(0, len(awards_touched), SUBAWARD_BATCH_SIZE):
+        for piid, fain in Award.objects.filter(
+                id__in=awards_touched[batch_start:batch_start + SUBAWARD_BATCH_SIZE]).values_list('piid', 'fain'):
+            if piid:
+                piids.add(piid)
+            if fain:
+                fains.add(fain)
 
     # This allows us to handle an empty list in the SQL without changing the query
-    piids.append(None)
-    fains.append(None)
+    piids = list(piids) + [None]
+    fains = list(fains) + [None]
+
+    # Country and city/county values of the subawards' locations, derived once per distinct location
+    location_columns = {}
 
     # D1 File F
     db_cursor.execute(D1_FILE_F_QUERY, [submission_attributes.broker_submission_id, tuple(piids)])
     d1_f_data = dictfetchall(db_cursor)
     logger.info("Creating D1 F File Entries (Subcontracts): {}".format(len(d1_f_data)))
-    d1_create_count = 0
-    d1_update_count = 0
-    d1_empty_count = 0
 
-    for row in d1_f_data:
-        if row['subcontract_num'] is None:
-            if row['id'] is not None and row['subcontract_amount'] is not None:
-                logger.warn("Subcontract of broker id {} has amount, but no number".format(row["id"]))
-                logger.warn("Failing row: {}".format(row))
-            else:
-                d1_empty_count += 1
-            continue
-
-        # Get the agency
-        agency = get_valid_awarding_agency(row)
-
-        if not agency:
-            logger.warn(
-                "Subaward number {} cannot find matching agency with toptier code {} and subtier code {}".format(
-                    row['subcontract_num'], row['awarding_agency_code'], row['awarding_sub_tier_agency_c']))
-            continue
+    d1_f_data, d1_empty_count = drop_unnumbered_rows(d1_f_data, 'subcontract_num', 'subcontract_amount')
+    d1_f_data = get_rows_with_agency(d1_f_data, 'subcontract_num')
+    award_lookup = build_contract_award_lookup(d1_f_data)
 
+    d1_subawards = []
+    for row, agency in d1_f_data:
         # Find the award to attach this sub-contract to
         # We perform this lookup by finding the Award containing a transaction with a matching parent award id, piid,
         # and submission attributes
-        award = Award.objects.filter(
-            awarding_agency=agency,
-            latest_transaction__contract_data__piid=row['piid'],
-            latest_transaction__contract_data__parent_award_id=row['parent_award_id']).distinct().order_by(
-            "-date_signed").first()
+        award = award_lookup.get((agency.id, row['piid'], row['parent_award_id']))
 
         # We don't have a matching award for this subcontract, log a warning and continue to the next row
         if not award:
@@ -88,30 +92,17 @@ def load_subawards(submission_attributes, awards_touched, db_cursor):
                     row['subcontract_num'], row['piid'], row['parent_award_id']))
             continue
 
-        award_ids_to_update.add(award.id)
-
-        # Get or create unique DUNS-recipient pair
-        recipient, created = LegalEntity.objects.get_or_create(
-            recipient_unique_id=row['duns'],
-            recipient_name=row['company_name']
-        )
-
-        if created:
-            recipient.parent_recipient_unique_id = row['parent_duns']
-            recipient.location = get_or_create_location(row, location_d1_recipient_mapper)
-            recipient.save()
-
-        # Get or create POP
-        place_of_performance = get_or_create_location(row, pop_mapper)
+        award_ids_to_update.add(award['id'])
 
         d1_f_dict = {
-            'award': award,
-            'recipient': recipient,
+            'recipient_unique_id': row['duns'],
+            'recipient_name': row['company_name'],
+            'parent_recipient_unique_id': row['parent_duns'],
             'data_source': "DBR",
-            'cfda': None,
-            'awarding_agency': award.awarding_agency,
-            'funding_agency': award.funding_agency,
-            'place_of_performance': place_of_performance,
+            'award_type': 'procurement',
+            'broker_award_id': row['fsrs_award_id'],
+            'internal_id': (row['fsrs_internal_id'] or '').upper(),
+            'updated_at': datetime.now(timezone.utc),
             'subaward_number': row['subcontract_num'],
             'amount': row['subcontract_amount'],
             'description': row['overall_description'],
@@ -119,62 +110,35 @@ def load_subawards(submission_attributes, awards_touched, db_cursor):
             'recovery_model_question2': row['recovery_model_q2'],
             'action_date': row['subcontract_date'],
             'award_report_fy_month': row['report_period_mon'],
-            'award_report_fy_year': row['report_period_year']
+            'award_report_fy_year': row['report_period_year'],
+            'piid': row['piid'],
         }
-
-        # Create the subaward
-        subaward, created = Subaward.objects.update_or_create(subaward_number=row['subcontract_num'],
-                                                              award=award,
-                                                              defaults=d1_f_dict)
-        if created:
-            d1_create_count += 1
-        else:
-            d1_update_count += 1
+        d1_f_dict.update(get_prime_award_columns(award))
+        d1_f_dict.update(get_location_columns(
+            location_d1_recipient_mapper(row), 'recipient_location_', location_columns))
+        d1_f_dict.update(get_location_columns(pop_mapper(row), 'pop_', location_columns))
+        d1_subawards.append(d1_f_dict)
 
     # D2 File F
-    db_cursor.execute(D2_FILE_F_QUERY, [tuple(fains), tuple(uris)])
+    db_cursor.execute(D2_FILE_F_QUERY, [submission_attributes.broker_submission_id, tuple(fains)])
     d2_f_data = dictfetchall(db_cursor)
     logger.info("Creating D2 F File Entries (Subawards): {}".format(len(d2_f_data)))
-    d2_create_count = 0
-    d2_update_count = 0
-    d2_empty_count = 0
-
-    for row in d2_f_data:
-        if row['subaward_num'] is None:
-            if row['id'] is not None and row['subaward_amount'] is not None:
-                logger.warn("Subcontract of broker id {} has amount, but no number".format(row["id"]))
-                logger.warn("Failing row: {}".format(row))
-            else:
-                d2_empty_count += 1
-            continue
-
-        agency = get_valid_awarding_agency(row)
 
-        if not agency:
-            logger.warn("Subaward number {} cannot find matching agency with toptier code {} and subtier "
-                        "code {}".format(row['subaward_num'], row['awarding_agency_code'],
-                                         row['awarding_sub_tier_agency_c']))
-            continue
+    d2_f_data, d2_empty_count = drop_unnumbered_rows(d2_f_data, 'subaward_num', 'subaward_amount')
+    d2_f_data = get_rows_with_agency(d2_f_data, 'subaward_num')
+    fain_lookup, uri_lookup = build_assistance_award_lookups(d2_f_data)
+    cfda_map = get_reference_data_map(Cfda, 'program_number', ['id', 'program_title'])
 
+    d2_subawards = []
+    for row, agency in d2_f_data:
         # Find the award to attach this sub-award to
         # We perform this lookup by finding the Award containing a transaction with a matching fain and submission.
         # If this fails, try submission and uri
-        if row['fain'] and len(row['fain']) > 0:
-            award = Award.objects.filter(awarding_agency=agency,
-                                         latest_transaction__assistance_data__fain=row['fain']).\
-                distinct().order_by("-date_signed").first()
-
-        # Couldn't find a match on FAIN, try URI if it exists
-        if not award and row['uri'] and len(row['uri']) > 0:
-            award = Award.objects.filter(awarding_agency=agency,
-                                         latest_transaction__assistance_data__uri=row['uri']).distinct().first()
-
-        # Try both
-        if not award and row['fain'] and len(row['fain']) > 0 and row['uri'] and len(row['uri']) > 0:
-            award = Award.objects.filter(awarding_agency=agency,
-                                         latest_transaction__assistance_data__fain=row['fain'],
-                                         latest_transaction__assistance_data__uri=row['uri']).\
-                distinct().order_by("-date_signed").first()
+        award = None
+        if row['fain']:
+            award = fain_lookup.get((agency.id, row['fain']))
+        if not award and row['uri']:
+            award = uri_lookup.get((agency.id, row['uri']))
 
         # We don't have a matching award for this subcontract, log a warning and continue to the next row
         if not award:
@@ -182,7 +146,7 @@ def load_subawards(submission_attributes, awards_touched, db_cursor):
                         "skipping...".format(row['subaward_num'], row['fain'], row['uri']))
             continue
 
-        award_ids_to_update.add(award.id)
+        award_ids_to_update.add(award['id'])
 
         recipient_name = row['awardee_name']
         if recipient_name is None:
@@ -190,31 +154,21 @@ def load_subawards(submission_attributes, awards_touched, db_cursor):
         if recipient_name is None:
             recipient_name = ""
 
-        # Get or create unique DUNS-recipient pair
-        recipient, created = LegalEntity.objects.get_or_create(
-            recipient_unique_id=row['duns'],
-            recipient_name=recipient_name
-        )
-
-        if created:
-            recipient.parent_recipient_unique_id = row['parent_duns']
-            recipient.location = get_or_create_location(row, location_d2_recipient_mapper)
-            recipient.save()
-
-        # Get or create POP
-        place_of_performance = get_or_create_location(row, pop_mapper)
-
         # Get CFDA Program
-        cfda = Cfda.objects.filter(program_number=row['cfda_number']).first()
+        cfda = cfda_map.get(row['cfda_number'])
 
         d2_f_dict = {
-            'award': award,
-            'recipient': recipient,
+            'recipient_unique_id': row['duns'],
+            'recipient_name': recipient_name,
+            'parent_recipient_unique_id': row['parent_duns'],
             'data_source': "DBR",
-            'cfda': cfda,
-            'awarding_agency': award.awarding_agency,
-            'funding_agency': award.funding_agency,
-            'place_of_performance': place_of_performance,
+            'award_type': 'grant',
+            'broker_award_id': row['fsrs_award_id'],
+            'internal_id': (row['fsrs_internal_id'] or '').upper(),
+            'updated_at': datetime.now(timezone.utc),
+            'cfda_id': cfda['id'] if cfda else None,
+            'cfda_number': cfda['program_number'] if cfda else None,
+            'cfda_title': cfda['program_title'] if cfda else None,
             'subaward_number': row['subaward_num'],
             'amount': row['subaward_amount'],
             'description': row['project_description'],
@@ -222,19 +176,17 @@ def load_subawards(submission_attributes, awards_touched, db_cursor):
             'recovery_model_question2': row['compensation_q2'],
             'action_date': row['subaward_date'],
             'award_report_fy_month': row['report_period_mon'],
-            'award_report_fy_year': row['report_period_year']
+            'award_report_fy_year': row['report_period_year'],
+            'fain': row['fain'],
         }
+        d2_f_dict.update(get_prime_award_columns(award))
+        d2_f_dict.update(get_location_columns(
+            location_d2_recipient_mapper(row), 'recipient_location_', location_columns))
+        d2_f_dict.update(get_location_columns(pop_mapper(row), 'pop_', location_columns))
+        d2_subawards.append(d2_f_dict)
 
-        # Create the subaward
-        subaward, created = Subaward.objects.update_or_create(
-            subaward_number=row['subaward_num'],
-            award=award,
-            defaults=d2_f_dict
-        )
-        if created:
-            d2_create_count += 1
-        else:
-            d2_update_count += 1
+    d1_create_count, d1_update_count = save_subawards(d1_subawards)
+    d2_create_count, d2_update_count = save_subawards(d2_subawards)
 
     # Update Award objects with subaward aggregates
     update_award_subawards(tuple(award_ids_to_update))
@@ -255,6 +207,153 @@ def load_subawards(submission_attributes, awards_touched, db_cursor):
                                              d2_empty_count))
 
 
+def drop_unnumbered_rows(rows, number_field, amount_field):
+    """ Returns the File F rows that have a subaward number, and how many of the others were empty """
+    numbered_rows = []
+    empty_count = 0
+    for row in rows:
+        if row[number_field] is None:
+            if row['id'] is not None and row[amount_field] is not None:
+                logger.warn("Subcontract of broker id {} has amount, but no number".format(row["id"]))
+                logger.warn("Failing row: {}".format(row))
+            else:
+                empty_count += 1
+            continue
+        numbered_rows.append(row)
+    return numbered_rows, empty_count
+
+
+def get_rows_with_agency(rows, number_field):
+    """ Pairs each File F row with its awarding agency, dropping the rows whose agency cannot be found """
+    rows_with_agency = []
+    for row in rows:
+        agency = get_valid_awarding_agency(row)
+        if not agency:
+            logger.warn("Subaward number {} cannot find matching agency with toptier code {} and subtier "
+                        "code {}".format(row[number_field], row['awarding_agency_code'],
+                                         row['awarding_sub_tier_agency_c']))
+            continue
+        rows_with_agency.append((row, agency))
+    return rows_with_agency
+
+
+def build_award_lookup(key_fields, filter_field, values):
+    """
+    Maps (awarding agency id, *key_fields) to the values of the award most recently signed among those whose
+    `filter_field` is one of `values`, like the per-row `.order_by("-date_signed").first()` lookups did
+    """
+    values = list(values)
+    lookup = {}
+    for batch_start in range(0, len(values), SUBAWARD_BATCH_SIZE):
+        batch = values[batch_start:batch_start + SUBAWARD_BATCH_SIZE]
+        awards = Award.objects.filter(**{filter_field + '__in': batch}).order_by('-date_signed'). \
+            values(*(PRIME_AWARD_FIELDS + key_fields))
+        for award in awards:
+            lookup.setdefault((award['awarding_agency_id'],) + tuple(award[field] for field in key_fields), award)
+    return lookup
+
+
+def build_contract_award_lookup(rows_with_agency):
+    """ Maps (awarding agency id, piid, parent award id) to the award each subcontract belongs to """
+    piid_field = 'latest_transaction__contract_data__piid'
+    parent_field = 'latest_transaction__contract_data__parent_award_id'
+    piids = {row['piid'] for row, agency in rows_with_agency if row['piid'] is not None}
+    return build_award_lookup((piid_field, parent_field), piid_field, piids)
+
+
+def build_assistance_award_lookups(rows_with_agency):
+    """ Maps (awarding agency id, fain) and (awarding agency id, uri) to the award each subgrant belongs to """
+    fain_field = 'latest_transaction__assistance_data__fain'
+    uri_field = 'latest_transaction__assistance_data__uri'
+    fains = {row['fain'] for row, agency in rows_with_agency if row['fain']}
+    uris = {row['uri'] for row, agency in rows_with_agency if row['uri']}
+    return build_award_lookup((fain_field,), fain_field, fains), build_award_lookup((uri_field,), uri_field, uris)
+
+
+def get_prime_award_columns(award):
+    return {
+        'award_id': award['id'],
+        'awarding_agency_id': award['awarding_agency_id'],
+        'funding_agency_id': award['funding_agency_id'],
+        'prime_recipient_id': award['recipient_id'],
+        'prime_recipient_name': award['recipient__recipient_name'],
+        'prime_award_type': award['type'],
+        'latest_transaction_id': award['latest_transaction_id'],
+        'last_modified_date': award['last_modified_date'],
+    }
+
+
+def get_location_columns(location, prefix, location_columns):
+    """
+    Flattens a mapped location into the subaward columns starting with `prefix`, adding its country name and its
+    county and city codes. Each distinct location is derived once and kept in `location_columns`.
+    """
+    key = (prefix,) + tuple(sorted(location.items()))
+    if key in location_columns:
+        return location_columns[key]
+
+    country = get_reference_data_map(RefCountryCode, 'country_code', ['country_name']).get(
+        location['location_country_code'])
+    city_county = {}
+    if location['state_code'] and location['city_name']:
+        matches = city_county_index.match({'state_code': location['state_code'], 'city_name': location['city_name']})
+        if matches:
+            city_county = matches[0]
+
+    columns = {
+        'country_code': location['location_country_code'],
+        'country_name': country['country_name'] if country else None,
+        'state_code': location['state_code'],
+        'city_name': location['city_name'],
+        'county_code': city_county.get('county_code'),
+        'county_name': city_county.get('county_name'),
+        'city_code': city_county.get('city_code'),
+        'zip4': location['location_zip'],
+        'street_address': location['address_line1'],
+        'congressional_code': location['congressional_code'],
+    }
+    if prefix == 'recipient_location_':
+        columns['zip5'] = location['location_zip'][:5] if location['location_zip'] else None
+
+    location_columns[key] = {prefix + column: value for column, value in columns.items()}
+    return location_columns[key]
+
+
+def save_subawards(subawards):
+    """
+    Writes the subawards given as dicts of their columns. A subaward with the same award and number as an existing one
+    only updates the columns this loader sets, so the ones load_fsrs and the subaward search vectors fill in are kept,
+    and so are its FSRS ids; the others are created. Of rows sharing an award and number, the last one wins. Returns
+    how many subawards were created and how many updated.
+    """
+    unique_subawards = OrderedDict()
+    for subaward in subawards:
+        unique_subawards[(subaward['award_id'], subaward['subaward_number'])] = subaward
+
+    existing_ids = {}
+    award_ids = list({award_id for award_id, subaward_number in unique_subawards})
+    for batch_start in range(0, len(award_ids), SUBAWARD_BATCH_SIZE):
+        for subaward_id, award_id, subaward_number in Subaward.objects.filter(
+                award_id__in=award_ids[batch_start:batch_start + SUBAWARD_BATCH_SIZE]).values_list(
+                'id', 'award_id', 'subaward_number'):
+            if (award_id, subaward_number) in unique_subawards:
+                existing_ids.setdefault((award_id, subaward_number), subaward_id)
+
+    new_subawards, updated_subawards = [], []
+    for key, subaward in unique_subawards.items():
+        if key in existing_ids:
+            updated_subawards.append(Subaward(id=existing_ids[key], **subaward))
+        else:
+            new_subawards.append(Subaward(**subaward))
+
+    if updated_subawards:
+        fields = [field for field in subawards[0] if field not in ('broker_award_id', 'internal_id')]
+        bulk_update(Subaward, updated_subawards, fields)
+    Subaward.objects.bulk_create(new_subawards, batch_size=SUBAWARD_BATCH_SIZE)
+
+    return len(new_subawards), len(updated_subawards)
+
+
 def get_valid_awarding_agency(row):
     agency_subtier_code = row['awarding_sub_tier_agency_c']
     agency_toptier_code = row['awarding_agency_code']
@@ -267,13 +366,13 @@ def get_valid_awarding_agency(row):
     agency = None
     # Get the awarding agency
     if valid_subtier_code and valid_toptier_code:
-        agency = Agency.get_by_toptier_subtier(row['awarding_agency_code'], row['awarding_sub_tier_agency_c'])
+        agency = agency_resolver.get_by_toptier_subtier(row['awarding_agency_code'], row['awarding_sub_tier_agency_c'])
 
     if not agency and valid_subtier_code:
-        agency = Agency.get_by_subtier(row['awarding_sub_tier_agency_c'])
+        agency = agency_resolver.get_by_subtier(row['awarding_sub_tier_agency_c'])
 
     if not agency and valid_toptier_code:
-        agency = Agency.get_by_toptier(row['awarding_agency_code'])
+        agency = agency_resolver.get_by_toptier(row['awarding_agency_code'])
 
     return agency
 
@@ -10,8 +10,10 @@ from model_mommy import mommy
 from unittest.mock import MagicMock
 
 # Imports from your apps
+from usaspending_api.accounts.models import AppropriationAccountBalances
 from usaspending_api.awards.models import (Award, FinancialAccountsByAwards, TransactionNormalized,
                                            TreasuryAppropriationAccount)
+from usaspending_api.etl.management.commands import load_submission
 
 
 DB_CURSOR_PARAMS = {
@@ -405,3 +407,16 @@ def test_load_submission_transaction_obligated_amount(mock_db_cursor):
         filter(Q(transaction_obligated_amount='NaN') | Q(transaction_obligated_amount=None)).count()
 
     assert expected_results == actual_results
+
+
+@pytest.mark.django_db
+def test_load_file_b_duplicate_file_a_records(monkeypatch):
+    submission = mommy.make('submissions.SubmissionAttributes')
+    treasury_account = mommy.make(TreasuryAppropriationAccount)
+    mommy.make(AppropriationAccountBalances, submission=submission, treasury_account_identifier=treasury_account,
+               _quantity=2)
+    monkeypatch.setitem(load_submission.TAS_ID_TO_ACCOUNT, -1, (treasury_account, 'TAS -1'))
+
+    # A File B row must not be linked to either of a TAS' File A records at random
+    with pytest.raises(AppropriationAccountBalances.MultipleObjectsReturned):
+        load_submission.load_file_b(submission, [{'tas_id': -1}], MagicMock())
@@ -3,6 +3,7 @@ import datetime
 from model_mommy import mommy
 import pytest
 
+from usaspending_api.etl import award_helpers
 from usaspending_api.etl.award_helpers import (get_award_financial_transaction, update_awards, update_contract_awards)
 
 
@@ -180,6 +181,37 @@ def test_award_update_with_list():
     assert awards[4].total_obligation == 0
 
 
+@pytest.mark.django_db
+def test_award_update_skips_unchanged_awards():
+    """Test that awards already in sync with their transactions are not rewritten."""
+    award = mommy.make('awards.Award', total_obligation=0)
+    mommy.make('awards.TransactionNormalized', award=award, federal_action_obligation=1000, _quantity=2)
+
+    assert update_awards((award.id, award.id)) == 1
+    assert update_awards((award.id,)) == 0
+    assert update_awards() == 0
+
+    award.refresh_from_db()
+    assert award.total_obligation == 2000
+
+
+@pytest.mark.django_db
+def test_award_update_in_chunks(monkeypatch):
+    """Test that award ids are rolled up chunk by chunk."""
+    monkeypatch.setattr(award_helpers, 'UPDATE_AWARDS_CHUNK_SIZE', 2)
+    awards = mommy.make('awards.Award', total_obligation=0, _quantity=5)
+    for index, award in enumerate(awards):
+        mommy.make('awards.TransactionNormalized', award=award, federal_action_obligation=index + 1,
+                   action_date=datetime.date(2017, 1, 1))
+
+    count = update_awards(tuple(award.id for award in awards[:4]))
+
+    assert count == 4
+    for index, award in enumerate(awards):
+        award.refresh_from_db()
+        assert award.total_obligation == (index + 1 if index < 4 else 0)
+
+
 @pytest.mark.django_db
 def test_award_update_from_contract_transaction():
     """Test award updates specific to contract transactions."""
@@ -0,0 +1,134 @@
+import datetime
+
+from model_mommy import mommy
+import pytest
+
+from usaspending_api.awards.models import Subaward
+from usaspending_api.etl.subaward_etl import get_location_columns, load_subawards, save_subawards
+
+
+class FileFCursor:
+    """Returns the D1 and then the D2 File F rows, like the broker cursor load_subawards queries"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.rows = []
+
+    def execute(self, statement, parameters=None):
+        self.rows = self.results.pop(0)
+
+    @property
+    def description(self):
+        return [(column,) for column in self.rows[0]] if self.rows else []
+
+    def fetchall(self):
+        return [list(row.values()) for row in self.rows]
+
+
+def d1_row(**kwargs):
+    row = {'id': 1, 'subcontract_num': None, 'subcontract_amount': None, 'awarding_agency_code': '097',
+           'awarding_sub_tier_agency_c': '1700', 'piid': 'PIID1', 'parent_award_id': 'PARENT1', 'duns': '123456789',
+           'company_name': 'SUB RECIPIENT', 'parent_duns': None, 'overall_description': None,
+           'recovery_model_q1': None, 'recovery_model_q2': None, 'subcontract_date': datetime.date(2018, 1, 1),
+           'report_period_mon': 1, 'report_period_year': 2018, 'principle_place_country': 'USA', 'fsrs_award_id': 10,
+           'fsrs_internal_id': 'abc-10'}
+    row.update(kwargs)
+    return row
+
+
+def d2_row(**kwargs):
+    row = {'id': 2, 'subaward_num': None, 'subaward_amount': None, 'awarding_agency_code': '097',
+           'awarding_sub_tier_agency_c': '1700', 'fain': 'FAIN1', 'uri': None, 'awardee_name': None,
+           'awardee_or_recipient_legal': 'SUB GRANTEE', 'duns': '987654321', 'parent_duns': None,
+           'cfda_number': '10.001', 'project_description': None, 'compensation_q1': None, 'compensation_q2': None,
+           'subaward_date': datetime.date(2018, 1, 1), 'report_period_mon': 1, 'report_period_year': 2018,
+           'fsrs_award_id': 20, 'fsrs_internal_id': 'def-20'}
+    row.update(kwargs)
+    return row
+
+
+@pytest.mark.django_db
+def test_load_subawards():
+    agency = mommy.make('references.Agency', toptier_agency__cgac_code='097', subtier_agency__subtier_code='1700')
+    mommy.make('references.RefCountryCode', country_code='USA', country_name='UNITED STATES')
+    cfda = mommy.make('references.Cfda', program_number='10.001', program_title='AGRICULTURAL RESEARCH')
+    submission = mommy.make('submissions.SubmissionAttributes', broker_submission_id=1)
+
+    contract = mommy.make('awards.Award', awarding_agency=agency, piid='PIID1')
+    mommy.make('awards.TransactionFPDS', transaction__award=contract, piid='PIID1', parent_award_id='PARENT1')
+    contract.latest_transaction = contract.transactionnormalized_set.first()
+    contract.save()
+
+    grant = mommy.make('awards.Award', awarding_agency=agency, fain='FAIN1')
+    mommy.make('awards.TransactionFABS', transaction__award=grant, fain='FAIN1')
+    grant.latest_transaction = grant.transactionnormalized_set.first()
+    grant.save()
+
+    existing = mommy.make('awards.Subaward', award=contract, subaward_number='SUB1', amount=1,
+                          award_report_fy_month=1, award_report_fy_year=2018, internal_id='FSRS-1', broker_award_id=1,
+                          officer_1_name='OFFICER')
+
+    cursor = FileFCursor(
+        [d1_row(subcontract_num='SUB1', subcontract_amount=100), d1_row(subcontract_num='SUB2', subcontract_amount=200),
+         d1_row(id=None), d1_row(subcontract_num='SUB3', subcontract_amount=300, piid='PIID_DNE')],
+        [d2_row(subaward_num='SUBG1', subaward_amount=400), d2_row(subaward_num='SUBG2', fain='FAIN_DNE')])
+    load_subawards(submission, [contract.id, grant.id], cursor)
+
+    assert Subaward.objects.count() == 3
+
+    updated = Subaward.objects.get(subaward_number='SUB1')
+    assert updated.id == existing.id
+    assert updated.amount == 100
+    assert updated.recipient_name == 'SUB RECIPIENT'
+    assert updated.pop_country_name == 'UNITED STATES'
+    # columns this loader does not set are left as load_fsrs wrote them
+    assert updated.internal_id == 'FSRS-1'
+    assert updated.broker_award_id == 1
+    assert updated.officer_1_name == 'OFFICER'
+
+    created = Subaward.objects.get(subaward_number='SUB2')
+    assert created.award_id == contract.id
+    assert created.awarding_agency_id == agency.id
+    assert created.award_type == 'procurement'
+    assert created.internal_id == 'ABC-10'
+    assert created.broker_award_id == 10
+
+    subgrant = Subaward.objects.get(subaward_number='SUBG1')
+    assert subgrant.award_id == grant.id
+    assert subgrant.cfda_id == cfda.id
+    assert subgrant.recipient_name == 'SUB GRANTEE'
+
+
+@pytest.mark.django_db
+def test_save_subawards_counts():
+    award = mommy.make('awards.Award')
+    mommy.make('awards.Subaward', award=award, subaward_number='SUB1', amount=1, award_report_fy_month=1,
+               award_report_fy_year=2018)
+
+    def subaward(subaward_number, amount):
+        return {'award_id': award.id, 'subaward_number': subaward_number, 'amount': amount,
+                'award_report_fy_month': 1, 'award_report_fy_year': 2018}
+
+    # Rows sharing an award and number are one subaward, counted once
+    assert save_subawards([subaward('SUB1', 2), subaward('SUB1', 3), subaward('SUB2', 4), subaward('SUB2', 5)]) == \
+        (1, 1)
+    assert sorted(Subaward.objects.values_list('subaward_number', 'amount')) == [('SUB1', 3), ('SUB2', 5)]
+
+
+@pytest.mark.django_db
+def test_get_location_columns():
+    mommy.make('references.RefCityCountyCode', state_code='VA', city_name='ARLINGTON', city_code='03000',
+               county_code='013', county_name='ARLINGTON')
+    location = {'location_country_code': 'USA', 'city_name': 'ARLINGTON', 'location_zip': '222011234',
+                'state_code': 'VA', 'address_line1': '1 MAIN ST', 'congressional_code': '08'}
+    location_columns = {}
+
+    columns = get_location_columns(location, 'recipient_location_', location_columns)
+
+    assert columns['recipient_location_county_code'] == '013'
+    assert columns['recipient_location_city_code'] == '03000'
+    assert columns['recipient_location_zip5'] == '22201'
+    assert columns['recipient_location_zip4'] == '222011234'
+    # the same location is only derived once
+    assert get_location_columns(dict(location), 'recipient_location_', location_columns) is columns
+    assert 'pop_county_code' in get_location_columns(location, 'pop_', location_columns)
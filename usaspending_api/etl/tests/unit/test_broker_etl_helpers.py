@@ -0,0 +1,27 @@
+from usaspending_api.etl.broker_etl_helpers import dictfetchmany
+
+
+class NamedCursor:
+    """Like a server-side cursor, only describes its columns once rows have been fetched"""
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        self.description = None
+
+    def fetchmany(self, size):
+        self.description = [(column,) for column in self.columns]
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+def test_dictfetchmany():
+    cursor = NamedCursor(['id', 'name'], [(1, 'a'), (2, 'b'), (3, 'c')])
+
+    batches = list(dictfetchmany(cursor, size=2))
+    assert batches == [[{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}], [{'id': 3, 'name': 'c'}]]
+    assert list(batches[0][0].keys()) == ['id', 'name']
+
+
+def test_dictfetchmany_no_rows():
+    assert list(dictfetchmany(NamedCursor(['id'], []))) == []
@@ -0,0 +1,76 @@
+import json
+from threading import Timer
+from unittest.mock import Mock
+
+import pytest
+
+from usaspending_api.etl.es_etl_helpers import CsvBackPressure, csv_chunk_gen, delete_actions, transaction_actions
+
+
+def test_csv_chunk_gen(tmpdir):
+    csv_file = tmpdir.join('transactions.csv')
+    csv_file.write('transaction_id,piid,recipient_name\n1,ABC,"SMITH, JOHN"\n2,,NA\n3,0001,\n')
+
+    chunks = list(csv_chunk_gen(str(csv_file), 2, None))
+
+    assert [len(rows) for columns, rows in chunks] == [2, 1]
+    assert chunks[0][0] == ['transaction_id', 'piid', 'recipient_name']
+    assert chunks[0][1][0] == ['1', 'ABC', 'SMITH, JOHN']
+
+
+def test_csv_chunk_gen_header_only(tmpdir):
+    csv_file = tmpdir.join('transactions.csv')
+    csv_file.write('transaction_id,piid\n')
+
+    assert list(csv_chunk_gen(str(csv_file), 2, None)) == []
+
+
+def test_transaction_actions():
+    columns = ['transaction_id', 'piid', 'recipient_name']
+    actions = list(transaction_actions(columns, [['2', '', 'NA'], ['3', '0001', '']]))
+
+    assert [json.loads(action['_source']) for action in actions] == [
+        {'transaction_id': '2', 'piid': None, 'recipient_name': 'NA'},
+        {'transaction_id': '3', 'piid': '0001', 'recipient_name': None},
+    ]
+
+
+def test_csv_back_pressure():
+    back_pressure = CsvBackPressure(10, consumers=1, timeout=0.01)
+
+    back_pressure.add(4)
+    assert back_pressure.wait_for_room() is False
+
+    back_pressure.add(6)
+    # An index process finishing a CSV releases its bytes and wakes the waiting download process up
+    Timer(0.05, back_pressure.release, args=(6,)).start()
+    assert back_pressure.wait_for_room() is True
+    assert back_pressure.pending_bytes.value == 4
+
+
+def test_csv_back_pressure_without_consumers():
+    back_pressure = CsvBackPressure(10, consumers=1, timeout=0.01)
+    back_pressure.add(10)
+
+    # Nothing would ever release the pending bytes once the index processes stopped
+    Timer(0.05, back_pressure.consumer_stopped).start()
+    with pytest.raises(RuntimeError):
+        back_pressure.wait_for_room()
+
+
+def test_delete_actions():
+    def search(index, body, size):
+        values = [query['match_phrase']['transaction_id'] for query in json.loads(body)['query']['bool']['should'][0]]
+        return {'hits': {'hits': [{'_index': 'transactions-2018', '_type': 'transaction_mapping', '_id': 'doc' + value}
+                                  for value in values[:size]]}}
+
+    client = Mock(**{'search.side_effect': search})
+    actions = delete_actions(client, 'transactions-*', 'transaction_id', list(range(1500)), max_query_size=600)
+
+    assert next(actions) == {'_op_type': 'delete', '_index': 'transactions-2018', '_type': 'transaction_mapping',
+                             '_id': 'doc0'}
+    # The values are looked up 1000 at a time, each search returning up to max_query_size documents
+    assert len(list(actions)) == 600 + 500 - 1
+    assert [call[1]['size'] for call in client.search.call_args_list] == [600, 600]
+    assert [len(json.loads(call[1]['body'])['query']['bool']['should'][0])
+            for call in client.search.call_args_list] == [1000, 500]
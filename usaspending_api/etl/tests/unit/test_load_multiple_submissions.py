@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from django.core.management.base import CommandError
+
+from usaspending_api.etl.management.commands import load_multiple_submissions
+from usaspending_api.etl.management.commands.load_multiple_submissions import (group_submissions_by_agency,
+                                                                               load_agency_submissions)
+
+
+def test_group_submissions_by_agency():
+    missing_submissions = [
+        (3, 'Agency A', datetime(2018, 2, 1), datetime(2000, 1, 1), '020'),
+        (1, 'Agency A', datetime(2018, 1, 1), datetime(2000, 1, 1), '020'),
+        (2, 'Agency B', datetime(2018, 1, 15), datetime(2000, 1, 1), '1100'),
+        (4, 'Agency C', datetime(2018, 1, 20), datetime(2000, 1, 1), '075'),
+    ]
+
+    # Each agency's submissions stay in the order they were certified
+    assert group_submissions_by_agency(missing_submissions) == [[1, 3], [2], [4]]
+
+
+def test_load_agency_submissions_skips_failures(monkeypatch):
+    def load_submission(command, *args):
+        submission_id = args[-1]
+        if submission_id == 1:
+            raise CommandError('Submission 1 not found')
+        if submission_id == 2:
+            raise ValueError('bad row')
+
+    monkeypatch.setattr(load_multiple_submissions, 'call_command', load_submission)
+
+    # A failed submission does not stop the agency's later ones
+    assert load_agency_submissions([1, 2, 3]) == [
+        (1, 'CommandError (bad ID)'), (2, 'ValueError: bad row'), (3, None)]
+
+
+def test_report_progress_returns_failed_submissions():
+    results = [[(1, None), (3, 'ValueError: bad row')], [(2, 'CommandError (bad ID)')], [(4, None)]]
+
+    assert load_multiple_submissions.Command.report_progress(iter(results), 4) == [3, 2]
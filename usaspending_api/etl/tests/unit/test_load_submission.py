@@ -0,0 +1,27 @@
+from usaspending_api.etl.management.commands.load_submission import match_award_id
+
+
+AWARD_LOOKUPS = {
+    'piid': {'PIID1': [1], 'PIID2': [2, 3]},
+    'piid_parent': {('PIID1', None): [1], ('PIID2', 'PARENT2'): [2], ('PIID2', 'PARENT3'): [3]},
+    'fain': {'FAIN1': [4], 'FAIN2': [5, 6]},
+    'uri': {'URI1': [7], 'URI2': [8, 9]},
+}
+
+
+def test_match_award_id_piid():
+    assert match_award_id(AWARD_LOOKUPS, piid='PIID1') == 1
+    assert match_award_id(AWARD_LOOKUPS, piid='PIID1', parent_piid='PARENT1') is None
+    assert match_award_id(AWARD_LOOKUPS, piid='PIID2') is None
+    assert match_award_id(AWARD_LOOKUPS, piid='PIID2', parent_piid='PARENT3') == 3
+    assert match_award_id(AWARD_LOOKUPS, piid='PIID_DNE') is None
+
+
+def test_match_award_id_fain_and_uri():
+    assert match_award_id(AWARD_LOOKUPS, fain='FAIN1') == 4
+    assert match_award_id(AWARD_LOOKUPS, uri='URI1') == 7
+    assert match_award_id(AWARD_LOOKUPS, fain='FAIN1', uri='URI2') == 4
+    # no exact fain match, so the uri is tried instead
+    assert match_award_id(AWARD_LOOKUPS, fain='FAIN2', uri='URI1') == 7
+    assert match_award_id(AWARD_LOOKUPS, fain='FAIN2', uri='URI2') is None
+    assert match_award_id(AWARD_LOOKUPS) is None
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from usaspending_api.awards.models import Award, TransactionNormalized
+from usaspending_api.common.helpers.etl_helpers import bulk_update
+from usaspending_api.common.helpers.generic_helper import fy, upper_case_dict_values
+from usaspending_api.etl.management.load_base import build_location
+from usaspending_api.references.models import Location
+
+
+def dedupe_broker_rows(to_insert, unique_id_field):
+    """Upper-cases the rows; when a transaction appears more than once, its last version wins, as it would row by row"""
+    for row in to_insert:
+        upper_case_dict_values(row)
+    return list(OrderedDict((row[unique_id_field], row) for row in to_insert).values())
+
+
+def bulk_create_locations(rows, location_field_map, location_value_map):
+    """Creates a Location from each row, the way create_location would one at a time"""
+    locations = [build_location(location_field_map, row, dict(location_value_map)) for row in rows]
+    Location.objects.bulk_create(locations)
+    return locations
+
+
+def get_or_create_summary_awards(rows, generated_unique_ids, build_award, update_award=None, update_fields=()):
+    """
+    Returns the summary Award of each generated unique award id, like Award.get_or_create_summary_award would for
+    each row: the existing award with the lowest id, or a new one from `build_award(row, generated_unique_id)`.
+
+    `update_award(award, row)` is then applied for every row, the last row of an award winning, and the existing
+    awards are saved with their `update_fields` and a new update_date, as award.save() would.
+    """
+    awards = {}
+    for award in Award.objects.filter(generated_unique_award_id__in=set(generated_unique_ids)).order_by('-id'):
+        awards[award.generated_unique_award_id] = award
+    existing_awards = list(awards.values())
+
+    new_awards = []
+    for row, generated_unique_id in zip(rows, generated_unique_ids):
+        award = awards.get(generated_unique_id)
+        if award is None:
+            award = build_award(row, generated_unique_id)
+            awards[generated_unique_id] = award
+            new_awards.append(award)
+        if update_award:
+            update_award(award, row)
+
+    bulk_update(Award, existing_awards, list(update_fields) + ['update_date'])
+    Award.objects.bulk_create(new_awards)
+    return awards
+
+
+def upsert_transactions(rows, transactions, unique_id_field, detail_model):
+    """
+    Writes each row's (TransactionNormalized dict, TransactionFABS/TransactionFPDS dict) pair: the transactions whose
+    `unique_id_field` is already loaded are updated in place, the others created. Returns the number created.
+    """
+    existing_transaction_ids = dict(
+        detail_model.objects.filter(**{'{}__in'.format(unique_id_field): [row[unique_id_field] for row in rows]})
+        .values_list(unique_id_field, 'transaction_id')
+    )
+
+    new_transactions, new_details, updated_transactions, updated_details = [], [], [], []
+    transaction_normalized_fields, detail_fields = set(), set()
+    for row, (transaction_normalized_dict, detail_dict) in zip(rows, transactions):
+        transaction_normalized_fields.update(transaction_normalized_dict)
+        detail_fields.update(detail_dict)
+
+        transaction_normalized = TransactionNormalized(**transaction_normalized_dict)
+        # Set by TransactionNormalized.save(), which bulk_create skips
+        transaction_normalized.fiscal_year = fy(transaction_normalized.action_date)
+        detail = detail_model(**detail_dict)
+
+        transaction_id = existing_transaction_ids.get(row[unique_id_field])
+        if transaction_id:
+            transaction_normalized.id = transaction_id
+            transaction_normalized.update_date = datetime.now(timezone.utc)
+            detail.transaction_id = transaction_id
+            updated_transactions.append(transaction_normalized)
+            updated_details.append(detail)
+        else:
+            new_transactions.append(transaction_normalized)
+            new_details.append(detail)
+
+    bulk_update(TransactionNormalized, updated_transactions,
+                transaction_normalized_fields | {'update_date', 'fiscal_year'})
+    bulk_update(detail_model, updated_details, detail_fields)
+
+    TransactionNormalized.objects.bulk_create(new_transactions)
+    # The new transactions only have their ids once they are created
+    for transaction_normalized, detail in zip(new_transactions, new_details):
+        detail.transaction = transaction_normalized
+    detail_model.objects.bulk_create(new_details)
+
+    return len(new_transactions)
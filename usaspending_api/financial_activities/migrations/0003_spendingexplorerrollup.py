@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.15 on 2019-01-24 10:12
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import rest_framework.utils.encoders
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial_activities', '0002_auto_20181126_1528'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendingExplorerRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fiscal_year', models.IntegerField()),
+                ('fiscal_quarter', models.IntegerField()),
+                ('type', models.TextField()),
+                ('filter_path', models.TextField()),
+                ('results', django.contrib.postgres.fields.jsonb.JSONField(encoder=rest_framework.utils.encoders.JSONEncoder)),
+                ('create_date', models.DateTimeField(auto_now_add=True, null=True)),
+                ('update_date', models.DateTimeField(auto_now=True, null=True)),
+            ],
+            options={
+                'db_table': 'spending_explorer_rollup',
+                'managed': True,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='spendingexplorerrollup',
+            unique_together=set([('fiscal_year', 'fiscal_quarter', 'type', 'filter_path')]),
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.contrib.postgres.fields import JSONField
 from django.db import models, connection
+from rest_framework.utils.encoders import JSONEncoder
 
 from usaspending_api.accounts.models import TreasuryAppropriationAccount
 from usaspending_api.references.models import ObjectClass, RefProgramActivity
@@ -117,10 +119,61 @@ class FinancialAccountsByProgramActivityObjectClass(DataSourceTrackedModel):
                    FY(s.reporting_period_start),
                    s.reporting_period_start DESC)"""
 
+    # FINAL_OF_FY_SQL, restricted to the rows whose flag can change when the File B of %(submission_id)s is (re)loaded:
+    # those of the submissions, in its fiscal year, that share an account with any submission of the same agency.
+    # Whether one of those submissions is final depends on the accounts it reports, which are all recomputed too.
+    SUBMISSION_FINAL_OF_FY_SQL = """
+        WITH submission_scope AS (
+            SELECT cgac_code, FY(reporting_period_start) AS fiscal_year
+            FROM submission_attributes
+            WHERE submission_id = %(submission_id)s
+        ),
+        fiscal_year_submissions AS (
+            SELECT s.submission_id, s.cgac_code, s.reporting_period_start
+            FROM submission_attributes s
+            JOIN submission_scope ss ON (FY(s.reporting_period_start) = ss.fiscal_year)
+        ),
+        agency_accounts AS (
+            SELECT DISTINCT fabpaoc.treasury_account_id
+            FROM financial_accounts_by_program_activity_object_class fabpaoc
+            JOIN fiscal_year_submissions s ON (s.submission_id = fabpaoc.submission_id)
+            JOIN submission_scope ss ON (s.cgac_code IS NOT DISTINCT FROM ss.cgac_code)
+        ),
+        affected_submissions AS (
+            SELECT DISTINCT fabpaoc.submission_id
+            FROM financial_accounts_by_program_activity_object_class fabpaoc
+            JOIN fiscal_year_submissions s ON (s.submission_id = fabpaoc.submission_id)
+            WHERE fabpaoc.treasury_account_id IN (SELECT treasury_account_id FROM agency_accounts)
+        ),
+        affected_accounts AS (
+            SELECT DISTINCT fabpaoc.treasury_account_id
+            FROM financial_accounts_by_program_activity_object_class fabpaoc
+            WHERE fabpaoc.submission_id IN (SELECT submission_id FROM affected_submissions)
+        ),
+        final_submissions AS (
+            SELECT DISTINCT ON (fabpaoc.treasury_account_id)
+              s.submission_id
+            FROM fiscal_year_submissions s
+            JOIN financial_accounts_by_program_activity_object_class fabpaoc
+                ON (s.submission_id = fabpaoc.submission_id)
+            WHERE fabpaoc.treasury_account_id IN (SELECT treasury_account_id FROM affected_accounts)
+            ORDER BY fabpaoc.treasury_account_id,
+                     s.reporting_period_start DESC
+        )
+        UPDATE financial_accounts_by_program_activity_object_class
+        SET final_of_fy = submission_id IN (SELECT submission_id FROM final_submissions)
+        WHERE submission_id IN (SELECT submission_id FROM affected_submissions)"""
+
     @classmethod
-    def populate_final_of_fy(cls):
+    def populate_final_of_fy(cls, submission_id=None):
+        """ Recomputes final_of_fy for every row or, given a submission_id, only for the agency and fiscal year of that
+            submission
+        """
         with connection.cursor() as cursor:
-            cursor.execute(cls.FINAL_OF_FY_SQL)
+            if submission_id is None:
+                cursor.execute(cls.FINAL_OF_FY_SQL)
+            else:
+                cursor.execute(cls.SUBMISSION_FINAL_OF_FY_SQL, {'submission_id': submission_id})
 
     # TODO: is the self-joining SQL below do-able via the ORM?
     QUARTERLY_SQL = """
@@ -386,3 +439,24 @@ class TasProgramActivityObjectClassQuarterly(DataSourceTrackedModel):
             cls.objects.filter(submission=downstream_submission).delete()
             cls.insert_quarterly_numbers(submission_id=downstream_submission.submission_id)
             cls.refresh_downstream_quarterly_numbers(downstream_submission)
+
+
+class SpendingExplorerRollup(models.Model):
+    """
+    Precomputed Spending Explorer responses for the File B drilldowns, keyed by the fiscal period, the drilldown type
+    and the other filters of the request (see spending_explorer.v2.filters.rollup). They are rebuilt by
+    load_submission for the periods and agencies a submission changes, and read by type_filter.
+    """
+    fiscal_year = models.IntegerField()
+    fiscal_quarter = models.IntegerField()
+    type = models.TextField()
+    filter_path = models.TextField()
+    # Encoded like the API response, so Decimals are stored as the numbers the endpoint renders
+    results = JSONField(encoder=JSONEncoder)
+    create_date = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    update_date = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        managed = True
+        db_table = 'spending_explorer_rollup'
+        unique_together = ('fiscal_year', 'fiscal_quarter', 'type', 'filter_path')
@@ -1,3 +1,4 @@
+from datetime import date
 from decimal import Decimal
 
 import pytest
@@ -138,3 +139,32 @@ def test_insert_quarterly_numbers(tas_oc_pa_data):
     assert quarters.get(submission=sub1).id != quarter_sub1.id
     # submission 2 record should not be updated
     assert quarters.get(submission=sub2).id == quarter_sub2.id
+
+
+@pytest.mark.django_db
+def test_populate_final_of_fy_for_submission():
+    """Only the rows of the submission's agency and fiscal year (and the accounts they share) are recomputed"""
+    agency_q1 = mommy.make('submissions.SubmissionAttributes', cgac_code='020', reporting_period_start=date(2016, 1, 1))
+    agency_q2 = mommy.make('submissions.SubmissionAttributes', cgac_code='020', reporting_period_start=date(2016, 4, 1))
+    agency_fy17 = mommy.make('submissions.SubmissionAttributes', cgac_code='020',
+                             reporting_period_start=date(2016, 10, 1))
+    shared_q1 = mommy.make('submissions.SubmissionAttributes', cgac_code='097', reporting_period_start=date(2016, 1, 1))
+    other_q1 = mommy.make('submissions.SubmissionAttributes', cgac_code='075', reporting_period_start=date(2016, 1, 1))
+    other_q2 = mommy.make('submissions.SubmissionAttributes', cgac_code='075', reporting_period_start=date(2016, 4, 1))
+    tas1, tas2, tas3 = mommy.make('accounts.TreasuryAppropriationAccount', _quantity=3)
+
+    for submission, tas in [(agency_q1, tas1), (agency_q2, tas1), (agency_fy17, tas1), (shared_q1, tas1),
+                            (shared_q1, tas2), (other_q1, tas3), (other_q2, tas3)]:
+        mommy.make('financial_activities.FinancialAccountsByProgramActivityObjectClass', submission=submission,
+                   treasury_account=tas)
+
+    FinancialAccountsByProgramActivityObjectClass.populate_final_of_fy(agency_q2.submission_id)
+
+    # shared_q1 is the latest submission of tas2, so all of its rows stay final; other_q2 and agency_fy17 are untouched
+    finals = FinancialAccountsByProgramActivityObjectClass.objects.filter(final_of_fy=True)
+    assert sorted(finals.values_list('submission_id', flat=True)) == sorted(
+        [agency_q2.submission_id, shared_q1.submission_id, shared_q1.submission_id])
+
+    FinancialAccountsByProgramActivityObjectClass.populate_final_of_fy()
+    assert finals.filter(submission__cgac_code__in=['020', '097'],
+                         submission__reporting_period_start__lt=date(2016, 10, 1)).count() == 3
@@ -1,3 +1,6 @@
+import time
+
+
 def canonicalize_string(val):
     """
     Return version of string in UPPERCASE and without redundant whitespace.
@@ -49,3 +52,90 @@ def canonicalize_location_instance(loc):
         if current_val:
             setattr(loc, field, canonicalize_string(current_val))
     loc.save()
+
+
+REFERENCE_DATA_CACHE_SECONDS = 60 * 60
+_reference_data_cache = {}
+
+
+def _get_cached_reference_data(cache_key, build):
+    """Returns what `build()` returned for cache_key, calling it again once REFERENCE_DATA_CACHE_SECONDS have passed"""
+    cached = _reference_data_cache.get(cache_key)
+    if cached and time.time() - cached[0] < REFERENCE_DATA_CACHE_SECONDS:
+        return cached[1]
+
+    reference_data = build()
+    _reference_data_cache[cache_key] = (time.time(), reference_data)
+    return reference_data
+
+
+def get_reference_data_map(model, key_field, value_fields):
+    """
+    Map every `key_field` value of a small, static reference table (CFDA, PSC, NAICS, country, state) to a dict of
+    its `value_fields`. The table is read once and kept in process for REFERENCE_DATA_CACHE_SECONDS; if a key appears
+    more than once, the row with the lowest primary key wins, like `.filter(...).first()` would.
+    """
+    def build():
+        reference_map = {}
+        for row in model.objects.order_by('pk').values(key_field, *value_fields):
+            reference_map.setdefault(row[key_field], row)
+        return reference_map
+
+    return _get_cached_reference_data((model.__name__, key_field, tuple(value_fields)), build)
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ReferenceSearchIndex:
+    """
+    Case-insensitive substring search over the text fields of a small reference table, matching like `__icontains`
+    without scanning every row: each field is indexed by trigram, so a search of three or more characters only checks
+    the rows holding all of its trigrams. Shorter searches check every row.
+    """
+
+    def __init__(self, rows, search_fields):
+        self.rows = rows
+        self.search_fields = tuple(search_fields)
+        self._texts = {}
+        self._postings = {}
+        for field in self.search_fields:
+            texts = [(row[field] or '').upper() for row in rows]
+            postings = {}
+            for position, text in enumerate(texts):
+                for trigram in _trigrams(text):
+                    postings.setdefault(trigram, set()).add(position)
+            self._texts[field] = texts
+            self._postings[field] = postings
+
+    def search(self, search_text, fields=None, limit=None):
+        """Returns, in table order, up to `limit` rows where any of `fields` (default: all) contains search_text"""
+        needle = search_text.upper()
+        needle_trigrams = _trigrams(needle)
+        positions = set()
+        for field in fields or self.search_fields:
+            texts = self._texts[field]
+            if needle_trigrams:
+                postings = sorted((self._postings[field].get(trigram, set()) for trigram in needle_trigrams), key=len)
+                candidates = postings[0].intersection(*postings[1:])
+            else:
+                candidates = range(len(texts))
+            positions.update(position for position in candidates if needle in texts[position])
+        return [self.rows[position] for position in sorted(positions)[:limit]]
+
+
+def get_reference_search_index(model, value_fields, search_fields):
+    """
+    A ReferenceSearchIndex over the `value_fields` of every row of a small, static reference table (agencies, CFDA,
+    NAICS, PSC), searchable on `search_fields` (a subset of `value_fields`). Rows are kept in primary key order and
+    the index is rebuilt every REFERENCE_DATA_CACHE_SECONDS.
+    """
+    def build():
+        return ReferenceSearchIndex(list(model.objects.order_by('pk').values(*value_fields)), search_fields)
+
+    return _get_cached_reference_data(('search', model.__name__, tuple(value_fields), tuple(search_fields)), build)
+
+
+def clear_reference_data_cache():
+    _reference_data_cache.clear()
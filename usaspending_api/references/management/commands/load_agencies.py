@@ -1,6 +1,8 @@
 from django.db import connection
 from django.core.management.base import BaseCommand
 from usaspending_api.references.models import ToptierAgency, SubtierAgency, Agency
+from usaspending_api.references.reference_helpers import agency_resolver
+from usaspending_api.spending_explorer.v2.filters.rollup import refresh_rollups
 import os
 import csv
 import logging
@@ -158,5 +160,12 @@ class Command(BaseCommand):
                 with connection.cursor() as cursor:
                     cursor.execute(MATVIEW_SQL)
 
+                # Loaders in this process must not resolve agencies from maps built before this load
+                agency_resolver.invalidate()
+
+                # The Spending Explorer rollup shows the agency names
+                self.logger.info('Rebuilding the Spending Explorer rollup')
+                refresh_rollups()
+
         except IOError:
             self.logger.log("Could not open file to load from")
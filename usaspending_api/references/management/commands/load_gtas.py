@@ -4,7 +4,9 @@ from django.core.management.base import BaseCommand
 from django.db import connections, transaction
 
 from usaspending_api.etl.broker_etl_helpers import dictfetchall
+from usaspending_api.financial_activities.models import SpendingExplorerRollup
 from usaspending_api.references.models import GTASTotalObligation
+from usaspending_api.spending_explorer.v2.filters.rollup import rebuild_rollup
 
 logger = logging.getLogger('console')
 
@@ -49,4 +51,10 @@ class Command(BaseCommand):
         total_obligation_objs = [GTASTotalObligation(**values) for values in total_obligation_values]
         GTASTotalObligation.objects.bulk_create(total_obligation_objs)
 
+        # The unreported amounts of the Spending Explorer roots are measured against these totals
+        logger.info('Rebuilding the Spending Explorer rollup')
+        periods = SpendingExplorerRollup.objects.values_list('fiscal_year', 'fiscal_quarter').distinct()
+        for fiscal_year, fiscal_quarter in list(periods):
+            rebuild_rollup(fiscal_year, fiscal_quarter, agency_ids=[])
+
         logger.info('GTAS loader finished successfully!')
@@ -9,6 +9,7 @@ from django.db.models.functions import Upper
 
 from usaspending_api.etl.csv_data_reader import CsvDataReader
 from usaspending_api.references.models import RefProgramActivity
+from usaspending_api.spending_explorer.v2.filters.rollup import refresh_rollups
 
 BUCKET_NAME = 'gtas-sf133'
 FILE_NAME = 'program_activity.csv'
@@ -63,6 +64,10 @@ class Command(BaseCommand):
                 # integrity and to speed things up a bit
                 for idx, row in enumerate(reader):
                     get_or_create_program_activity(row)
+
+            # The Spending Explorer rollup shows the program activity names
+            self.logger.info('Rebuilding the Spending Explorer rollup')
+            refresh_rollups()
         except Exception as e:
             self.logger.exception(e)
         finally:
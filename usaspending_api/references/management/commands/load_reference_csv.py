@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
 from usaspending_api.references.models import RefCityCountyCode, RefCountryCode, ObjectClass, RefProgramActivity
 from usaspending_api.common.threaded_data_loader import ThreadedDataLoader
+from usaspending_api.references.reference_helpers import city_county_index
+from usaspending_api.spending_explorer.v2.filters.rollup import refresh_rollups
 import logging
 
 logger = logging.getLogger('console')
@@ -32,3 +34,10 @@ class Command(BaseCommand):
 
         loader = ThreadedDataLoader(model_class=possible_models[model], collision_behavior='update')
         loader.load_from_file(path, encoding)
+
+        if model == "RefCityCountyCode":
+            city_county_index.invalidate()
+        elif model in ("ObjectClass", "RefProgramActivity"):
+            # The Spending Explorer rollup shows the object class and program activity names
+            logger.info("Rebuilding the Spending Explorer rollup")
+            refresh_rollups()
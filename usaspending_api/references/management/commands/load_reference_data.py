@@ -3,6 +3,7 @@ from django.core.management import call_command
 from django.conf import settings
 import logging
 from usaspending_api.references.models import RefCityCountyCode
+from usaspending_api.references.reference_helpers import city_county_index
 
 
 class Command(BaseCommand):
@@ -41,6 +42,7 @@ class Command(BaseCommand):
         call_command('load_reference_csv', 'RefCityCountyCode', 'usaspending_api/data/ref_city_county_code.csv',
                      'Latin-1')
         RefCityCountyCode.canonicalize()
+        city_county_index.invalidate()
 
         self.logger.info("Loading CFDA data")
         call_command('loadcfda')
@@ -9,6 +9,7 @@ from usaspending_api.accounts.models import TreasuryAppropriationAccount
 from usaspending_api.references.models import ToptierAgency
 from usaspending_api.references.reference_helpers import (insert_federal_accounts, update_federal_accounts,
                                                           remove_empty_federal_accounts)
+from usaspending_api.spending_explorer.v2.filters.rollup import refresh_rollups
 
 logger = logging.getLogger("console")
 
@@ -50,6 +51,10 @@ class Command(BaseCommand):
             deletes = remove_empty_federal_accounts()
             logger.info("   Removed {} Federal Account Rows".format(deletes))
 
+            # The Spending Explorer rollup groups File B by the TAS' agencies, budget functions and federal accounts
+            logger.info("\n=== Rebuilding the Spending Explorer rollup ===")
+            refresh_rollups()
+
             logger.info("\n=== TAS loader finished successfully! ===")
         except Exception as e:
             logger.error(e)
@@ -9,6 +9,7 @@ from usaspending_api.references.models import ToptierAgency
 from usaspending_api.common.threaded_data_loader import ThreadedDataLoader, SkipRowException
 from usaspending_api.references.reference_helpers import insert_federal_accounts, update_federal_accounts, \
     remove_empty_federal_accounts
+from usaspending_api.spending_explorer.v2.filters.rollup import refresh_rollups
 
 
 class Command(BaseCommand):
@@ -85,6 +86,10 @@ class Command(BaseCommand):
         update_federal_accounts()
         insert_federal_accounts()
 
+        # The Spending Explorer rollup groups File B by the TAS' agencies, budget functions and federal accounts
+        self.logger.info('Rebuilding the Spending Explorer rollup')
+        refresh_rollups()
+
     def generate_tas_rendering_label(self, row):
         return TreasuryAppropriationAccount.generate_tas_rendering_label(row["ATA"], row["Agency AID"], row["A"],
                                                                          row["BPOA"], row["EPOA"], row["MAIN"],
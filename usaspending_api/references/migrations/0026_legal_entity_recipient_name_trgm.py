@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('references', '0025_auto_20181126_1528'),
+    ]
+
+    operations = [
+        # Recipient autocomplete filters on recipient_name__icontains, which compares UPPER(recipient_name).  Django
+        # does not allow operation classes (gin_trgm_ops) in index creation until 2.2, so the index is added here.
+        migrations.RunSQL(
+            sql='create index idx_legal_entity_recipient_name_trgm on legal_entity '
+                'using gin (upper(recipient_name) gin_trgm_ops)',
+            reverse_sql='drop index idx_legal_entity_recipient_name_trgm'
+        ),
+    ]
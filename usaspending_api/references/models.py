@@ -38,6 +38,9 @@ class RefCityCountyCode(models.Model):
     create_date = models.DateTimeField(auto_now_add=True, blank=True, null=True)
     update_date = models.DateTimeField(auto_now=True, null=True)
 
+    # The fields a matched reference fills in on a Location
+    CITY_COUNTY_FIELDS = ('city_code', 'county_code', 'state_code', 'city_name', 'county_name')
+
     class Meta:
         managed = True
         db_table = 'ref_city_county_code'
@@ -314,55 +317,61 @@ class Location(DataSourceTrackedModel, DeleteIfChildlessMixin):
             if match:
                 self.zip5 = match.group(1)
 
+    def city_county_filters(self):
+        """The RefCityCountyCode values a US location must match to have its city and county data filled in"""
+        if self.location_country_code != "USA":
+            return {}
+
+        # TODO: this should be checked to see if this is even necessary... are these fields always uppercased?
+        if self.state_code:
+            temp_state_code = self.state_code.upper()
+        else:
+            temp_state_code = None
+
+        if self.city_name:
+            temp_city_name = self.city_name.upper()
+        else:
+            temp_city_name = None
+
+        if self.county_name:
+            temp_county_name = self.county_name.upper()
+        else:
+            temp_county_name = None
+
+        q_kwargs = {
+            "city_code": self.city_code,
+            "county_code": self.county_code,
+            "state_code": temp_state_code,
+            "city_name": temp_city_name,
+            "county_name": temp_county_name
+        }
+        # Clear out any blank or None values in our filter, so we can find the best match
+        return dict((k, v) for k, v in q_kwargs.items() if v)
+
+    def fill_city_county_data(self, matched_reference):
+        """Copies the city and county data of a RefCityCountyCode values() row onto this location"""
+        for field in RefCityCountyCode.CITY_COUNTY_FIELDS:
+            setattr(self, field, matched_reference[field])
+
     def load_city_county_data(self):
         # Here we fill in missing information from the ref city county code data
-        if self.location_country_code == "USA":
-
-            # TODO: this should be checked to see if this is even necessary... are these fields always uppercased?
-            if self.state_code:
-                temp_state_code = self.state_code.upper()
-            else:
-                temp_state_code = None
-
-            if self.city_name:
-                temp_city_name = self.city_name.upper()
-            else:
-                temp_city_name = None
-
-            if self.county_name:
-                temp_county_name = self.county_name.upper()
-            else:
-                temp_county_name = None
-
-            q_kwargs = {
-                "city_code": self.city_code,
-                "county_code": self.county_code,
-                "state_code": temp_state_code,
-                "city_name": temp_city_name,
-                "county_name": temp_county_name
-            }
-            # Clear out any blank or None values in our filter, so we can find the best match
-            q_kwargs = dict((k, v) for k, v in q_kwargs.items() if v)
-
-            # if q_kwargs = {} the filter below will return everything. There's no point in continuing if nothing is
-            # being filtered
-            if not q_kwargs:
-                return
-
-            matched_reference = RefCityCountyCode.objects.filter(Q(**q_kwargs))
-            # We only load the data if our matched reference count is one; otherwise,
-            # we don't have data (count=0) or the match is ambiguous (count>1)
-            if matched_reference.count() == 1:
-                # Load this data
-                matched_reference = matched_reference.first()
-                self.city_code = matched_reference.city_code
-                self.county_code = matched_reference.county_code
-                self.state_code = matched_reference.state_code
-                self.city_name = matched_reference.city_name
-                self.county_name = matched_reference.county_name
-            else:
-                logging.getLogger('debug').info("Could not find single matching city/county for following arguments:" +
-                                                str(q_kwargs) + "; got " + str(matched_reference.count()))
+        q_kwargs = self.city_county_filters()
+
+        # if q_kwargs = {} the filter below will return everything. There's no point in continuing if nothing is
+        # being filtered
+        if not q_kwargs:
+            return
+
+        matched_reference = RefCityCountyCode.objects.filter(Q(**q_kwargs)).values(
+            *RefCityCountyCode.CITY_COUNTY_FIELDS)
+        # We only load the data if our matched reference count is one; otherwise,
+        # we don't have data (count=0) or the match is ambiguous (count>1)
+        if matched_reference.count() == 1:
+            # Load this data
+            self.fill_city_county_data(matched_reference.first())
+        else:
+            logging.getLogger('debug').info("Could not find single matching city/county for following arguments:" +
+                                            str(q_kwargs) + "; got " + str(matched_reference.count()))
 
 
 class LegalEntity(DataSourceTrackedModel):
@@ -599,6 +608,13 @@ class LegalEntity(DataSourceTrackedModel):
         managed = True
         db_table = 'legal_entity'
         index_together = ['recipient_unique_id', 'recipient_name', 'update_date']
+        # Note:  A custom index was added in the migration because there's
+        # currently not a Django native means by which to add a GinIndex with
+        # a specific Postgres operator class:
+        #
+        #     create index idx_legal_entity_recipient_name_trgm on
+        #         legal_entity using gin (upper(recipient_name) gin_trgm_ops)
+        #
 
 
 class LegalEntityOfficers(models.Model):
@@ -1,8 +1,11 @@
+import logging
+
 from django.db import connection
 from django.db.models.functions import Coalesce
 from django.db.models import Value
 
 from usaspending_api.accounts.models import FederalAccount, TreasuryAppropriationAccount
+from usaspending_api.references.models import Agency, RefCityCountyCode
 
 
 def remove_empty_federal_accounts(tas_tuple=None):
@@ -89,3 +92,125 @@ def insert_federal_accounts():
         return len(fa_objects)
     else:
         return 0
+
+
+class AgencyResolver:
+    """
+    Resolves agencies with the same semantics as Agency.get_by_toptier, get_by_subtier, get_by_toptier_subtier and
+    get_by_subtier_only, but from maps of every Agency built once per process instead of one or two queries per call.
+
+    The maps are built on first use (or by preload()); call invalidate() once the agency tables change, as
+    load_agencies does.
+    """
+
+    def __init__(self):
+        self._maps = None
+
+    def preload(self):
+        by_toptier, by_subtier, by_toptier_subtier, by_subtier_only = {}, {}, {}, {}
+
+        # Ordered like the Agency lookups, so the first agency kept for a key is the one .first() would return
+        agencies = Agency.objects.select_related('toptier_agency', 'subtier_agency').order_by('-update_date')
+        for agency in agencies:
+            toptier_agency, subtier_agency = agency.toptier_agency, agency.subtier_agency
+            cgac_code = toptier_agency.cgac_code if toptier_agency else None
+            subtier_code = subtier_agency.subtier_code if subtier_agency else None
+
+            if toptier_agency and subtier_agency and toptier_agency.name is not None and \
+                    subtier_agency.name == toptier_agency.name:
+                by_toptier.setdefault(cgac_code, agency)
+            by_subtier.setdefault(subtier_code, agency)
+            by_toptier_subtier.setdefault((cgac_code, subtier_code), agency)
+            by_subtier_only.setdefault(subtier_code, []).append(agency)
+
+        self._maps = {
+            'toptier': by_toptier,
+            'subtier': by_subtier,
+            'toptier_subtier': by_toptier_subtier,
+            'subtier_only': by_subtier_only,
+        }
+
+    def invalidate(self):
+        self._maps = None
+
+    def _get_map(self, name):
+        if self._maps is None:
+            self.preload()
+        return self._maps[name]
+
+    def get_by_toptier(self, toptier_cgac_code):
+        return self._get_map('toptier').get(toptier_cgac_code)
+
+    def get_by_subtier(self, subtier_code):
+        if subtier_code:
+            return self._get_map('subtier').get(subtier_code)
+
+    def get_by_toptier_subtier(self, toptier_cgac_code, subtier_code):
+        return self._get_map('toptier_subtier').get((toptier_cgac_code, subtier_code))
+
+    def get_by_subtier_only(self, subtier_code):
+        agencies = self._get_map('subtier_only').get(subtier_code, [])
+        return agencies[0] if len(agencies) == 1 else None
+
+
+agency_resolver = AgencyResolver()
+
+
+class CityCountyIndex:
+    """
+    Matches locations against RefCityCountyCode with the same semantics as Location.load_city_county_data, but from
+    the reference table read once per process instead of one or two queries per location.
+
+    One index is built for each combination of fields that locations are matched on, the first time a location
+    filters on it; call invalidate() once the reference table changes, as load_reference_csv does.
+    """
+
+    def __init__(self):
+        self._references = None
+        self._indexes = {}
+
+    def preload(self):
+        self._references = list(RefCityCountyCode.objects.values(*RefCityCountyCode.CITY_COUNTY_FIELDS))
+        self._indexes = {}
+
+    def invalidate(self):
+        self._references = None
+        self._indexes = {}
+
+    def match(self, filters):
+        """Returns every reference row equal to all of the (non-blank) filters"""
+        fields = tuple(sorted(filters))
+        index = self._indexes.get(fields)
+        if index is None:
+            if self._references is None:
+                self.preload()
+            index = {}
+            for reference in self._references:
+                key = tuple(reference[field] for field in fields)
+                # Like the SQL equality the filter compiles to, a NULL never matches
+                if None not in key:
+                    index.setdefault(key, []).append(reference)
+            self._indexes[fields] = index
+        return index.get(tuple(filters[field] for field in fields), [])
+
+
+city_county_index = CityCountyIndex()
+
+
+def enrich_locations(locations):
+    """
+    Applies the derivations of Location.pre_save to a batch of unsaved locations, e.g. before they are bulk created
+    (which skips save()), looking the city/county data up in city_county_index rather than per location.
+    """
+    for location in locations:
+        q_kwargs = location.city_county_filters()
+        if q_kwargs:
+            matched_reference = city_county_index.match(q_kwargs)
+            if len(matched_reference) == 1:
+                location.fill_city_county_data(matched_reference[0])
+            else:
+                logging.getLogger('debug').info("Could not find single matching city/county for following arguments:"
+                                                + str(q_kwargs) + "; got " + str(len(matched_reference)))
+        location.fill_missing_state_data()
+        location.fill_missing_zip5()
+    return locations
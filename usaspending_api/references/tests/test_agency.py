@@ -6,6 +6,7 @@ import pytest
 from django.core.management import call_command
 
 from usaspending_api.references.models import Agency
+from usaspending_api.references.reference_helpers import agency_resolver
 
 
 @pytest.fixture()
@@ -119,3 +120,37 @@ def test_get_by_toptier_subtier():
     assert Agency.get_by_toptier_subtier('nope', 'nada') is None
     assert Agency.get_by_toptier_subtier('xyz', 'nada') is None
     assert Agency.get_by_toptier_subtier('nope', 'bbb') is None
+
+
+@pytest.mark.django_db
+def test_agency_resolver_matches_agency_lookups():
+    """The resolver's maps must return the same agencies as the Agency lookups"""
+    toptier = mommy.make('references.ToptierAgency', cgac_code='xyz', name='yo')
+    subtier = mommy.make('references.SubtierAgency', subtier_code='abc', name='yo')
+    mommy.make('references.Agency', toptier_agency=toptier, subtier_agency=subtier)
+    mommy.make('references.Agency', toptier_agency=toptier,
+               subtier_agency=mommy.make('references.SubtierAgency', subtier_code='bbb', name='hi'))
+    mommy.make('references.Agency', toptier_agency=toptier, subtier_agency=subtier)
+
+    for code in ('xyz', 'nope', None):
+        assert agency_resolver.get_by_toptier(code) == Agency.get_by_toptier(code)
+    for code in ('abc', 'bbb', 'nope', '', None):
+        assert agency_resolver.get_by_subtier(code) == Agency.get_by_subtier(code)
+        assert agency_resolver.get_by_subtier_only(code) == Agency.get_by_subtier_only(code)
+        assert agency_resolver.get_by_toptier_subtier('xyz', code) == Agency.get_by_toptier_subtier('xyz', code)
+
+    assert agency_resolver.get_by_subtier_only('abc') is None
+    assert agency_resolver.get_by_subtier_only('bbb') is not None
+
+
+@pytest.mark.django_db
+def test_agency_resolver_invalidate():
+    toptier = mommy.make('references.ToptierAgency', cgac_code='xyz', name='yo')
+    assert agency_resolver.get_by_subtier('abc') is None
+
+    agency = mommy.make('references.Agency', toptier_agency=toptier,
+                        subtier_agency=mommy.make('references.SubtierAgency', subtier_code='abc'))
+    assert agency_resolver.get_by_subtier('abc') is None
+
+    agency_resolver.invalidate()
+    assert agency_resolver.get_by_subtier('abc') == agency
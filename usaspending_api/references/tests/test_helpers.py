@@ -57,3 +57,19 @@ def test_canonicalize_location_inst():
     actual = set(loc.__dict__.items())
     desired_set = set(desired_actual_field_names.items())
     assert not (desired_set - actual)
+
+
+def test_reference_search_index():
+    rows = [
+        {'code': '212113', 'description': 'Anthracite Mining'},
+        {'code': '111331', 'description': 'Apple Orchards'},
+        {'code': '212112', 'description': 'Bituminous Coal Underground Mining'},
+    ]
+    search_index = h.ReferenceSearchIndex(rows, ('code', 'description'))
+
+    assert search_index.search('mining') == [rows[0], rows[2]]
+    assert search_index.search('MINING', limit=1) == [rows[0]]
+    assert search_index.search('2121', ['code']) == [rows[0], rows[2]]
+    assert search_index.search('2121', ['description']) == []
+    assert search_index.search('ap') == [rows[1]]
+    assert search_index.search('Coal Mining') == []
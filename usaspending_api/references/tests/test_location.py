@@ -3,6 +3,7 @@ import pytest
 
 from usaspending_api.common.api_request_utils import GeoCompleteHandler
 from usaspending_api.references.models import Location, RefCityCountyCode
+from usaspending_api.references.reference_helpers import city_county_index, enrich_locations
 
 
 @pytest.mark.django_db
@@ -16,6 +17,50 @@ def test_location_reference_fill():
     assert location.state_code == city_county_code.state_code
 
 
+@pytest.mark.django_db
+def test_enrich_locations_matches_save():
+    mommy.make('references.RefCityCountyCode', city_code="A", county_code="B", state_code="VA", city_name="ARLINGTON",
+               county_name="ARLINGTON")
+    mommy.make('references.RefCityCountyCode', city_code="C", county_code="D", state_code="VA", city_name="VIENNA",
+               county_name="FAIRFAX")
+    mommy.make('references.RefCityCountyCode', city_code="E", county_code="D", state_code="VA", city_name="RESTON",
+               county_name="FAIRFAX")
+
+    rows = [
+        {"location_country_code": "USA", "city_code": "A", "county_code": "B"},
+        {"location_country_code": "USA", "city_name": "vienna"},
+        {"location_country_code": "USA", "county_name": "Fairfax", "state_code": "va"},  # ambiguous
+        {"location_country_code": "USA", "city_code": "Z"},  # no match
+        {"location_country_code": "CAN", "city_code": "A"},
+        {"country_name": "UNITED STATES", "state_code": "MN", "zip4": "55401-1234"},
+    ]
+    enriched = enrich_locations([Location(**row) for row in rows])
+    assert enriched[0].city_name == "ARLINGTON"
+    assert enriched[1].city_code == "C"
+    assert enriched[1].county_name == "FAIRFAX"
+    assert enriched[2].city_code is None
+    assert enriched[3].county_code is None
+    assert enriched[4].county_code is None
+    assert enriched[5].state_name == "MINNESOTA"
+    assert enriched[5].zip5 == "55401"
+
+    for row, location in zip(rows, enriched):
+        saved = mommy.make('references.Location', **row)
+        for field in RefCityCountyCode.CITY_COUNTY_FIELDS + ('state_name', 'zip5'):
+            assert getattr(location, field) == getattr(saved, field)
+
+
+@pytest.mark.django_db
+def test_city_county_index_invalidate():
+    assert city_county_index.match({"city_code": "A"}) == []
+
+    mommy.make('references.RefCityCountyCode', city_code="A", county_code="B")
+    assert city_county_index.match({"city_code": "A"}) == []
+
+    city_county_index.invalidate()
+    assert len(city_county_index.match({"city_code": "A"})) == 1
+
+
 @pytest.mark.django_db
 def test_location_state_fill():
     "Test populating missing state info"
@@ -69,3 +69,15 @@ def test_recipient_autocomplete_failure(client):
         content_type='application/json',
         data=json.dumps({'search_text': ''}))
     assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_recipient_autocomplete_limit(client, recipients_data):
+    """Only the requested number of recipients are returned, the most similar names first"""
+    resp = client.post(
+        '/api/v2/autocomplete/recipient/',
+        content_type='application/json',
+        data=json.dumps({'search_text': 'Human', 'limit': 1}))
+    assert resp.status_code == status.HTTP_200_OK
+    # "The Human Childship" shares as many trigrams with the search text as "The Human Partnership", out of fewer
+    assert resp.data['results']['recipient_id_list'] == [342467]
@@ -89,3 +89,36 @@ def test_award_type_endpoint(client, financial_spending_data):
                          'obligated_amount': 2.0,
                          'outlay_amount': 2.0,
                          'percentage_of_total_budget_authority': 2.391930450298678e-13}]}
+
+
+@pytest.mark.django_db
+def test_toptier_agencies_dod_and_latest_submission(client):
+    dod = mommy.make('references.ToptierAgency', name="Department of Defense", cgac_code='097', abbreviation=None)
+    army = mommy.make('references.ToptierAgency', name="Army", cgac_code='021')
+    no_submissions = mommy.make('references.ToptierAgency', name="No Submissions", cgac_code='300')
+    mommy.make('references.Agency', id=3, toptier_agency=dod, toptier_flag=True)
+    mommy.make('references.Agency', id=4, toptier_agency=dod, toptier_flag=True)
+    mommy.make('references.Agency', id=5, toptier_agency=no_submissions, toptier_flag=True)
+
+    old_submission = mommy.make('submissions.SubmissionAttributes', reporting_fiscal_year=2016,
+                                reporting_fiscal_quarter=4, cgac_code='097')
+    latest_submission = mommy.make('submissions.SubmissionAttributes', reporting_fiscal_year=2017,
+                                   reporting_fiscal_quarter=1, cgac_code='097')
+    for submission, funding_agency, amount in ((old_submission, dod, 100), (latest_submission, dod, 3),
+                                               (latest_submission, army, 4)):
+        mommy.make('accounts.AppropriationAccountBalances', final_of_fy=True, submission=submission,
+                   total_budgetary_resources_amount_cpe=amount, obligations_incurred_total_by_tas_cpe=amount,
+                   gross_outlay_amount_by_tas_cpe=amount,
+                   treasury_account_identifier=mommy.make('accounts.TreasuryAppropriationAccount',
+                                                          funding_toptier_agency=funding_agency))
+
+    resp = client.get('/api/v2/references/toptier_agencies/')
+    assert resp.status_code == status.HTTP_200_OK
+    assert len(resp.data['results']) == 1
+
+    result = resp.data['results'][0]
+    assert result['agency_id'] == 3
+    assert result['abbreviation'] == ''
+    assert (result['active_fy'], result['active_fq']) == ('2017', '1')
+    assert result['budget_authority_amount'] == 7.0
+    assert result['obligated_amount'] == 7.0
@@ -1,10 +1,11 @@
-from django.db.models import F, Q
+from django.contrib.postgres.search import TrigramSimilarity
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from usaspending_api.common.cache_decorator import cache_response
 from usaspending_api.awards.models import LegalEntity
 
 from usaspending_api.common.exceptions import InvalidParameterException
+from usaspending_api.references.helpers import get_reference_data_map, get_reference_search_index
 from usaspending_api.references.models import Agency, Cfda, NAICS, PSC
 from usaspending_api.references.v1.serializers import AgencySerializer
 
@@ -30,6 +31,8 @@ class BaseAutocompleteViewSet(APIView):
             limit = int(json_request.get('limit', 10))
         except ValueError:
             raise InvalidParameterException('Limit request parameter is not a valid, positive integer')
+        if limit < 1:
+            raise InvalidParameterException('Limit request parameter is not a valid, positive integer')
 
         # required query parameters were not provided
         if not search_text:
@@ -43,10 +46,13 @@ class BaseAutocompleteViewSet(APIView):
 
         search_text, limit = self.get_request_payload(request)
 
-        queryset = Agency.objects.filter(
-            Q(subtier_agency__name__icontains=search_text)
-            | Q(subtier_agency__abbreviation__icontains=search_text)
-            ).order_by('-toptier_flag', 'toptier_agency_id', 'subtier_agency__name').distinct(
+        search_index = get_reference_search_index(
+            Agency, ('id', 'subtier_agency__name', 'subtier_agency__abbreviation'),
+            ('subtier_agency__name', 'subtier_agency__abbreviation'))
+        agency_ids = [agency['id'] for agency in search_index.search(search_text)]
+
+        queryset = Agency.objects.filter(id__in=agency_ids).order_by(
+            '-toptier_flag', 'toptier_agency_id', 'subtier_agency__name').distinct(
             'toptier_flag', 'toptier_agency_id', 'subtier_agency__name')
         # The below is a one-off fix to promote FEMA as a subtier to the top when "FEMA" is searched
         # This is the only way to do this because you cannot use annotate and distinct together
@@ -84,18 +90,18 @@ class CFDAAutocompleteViewSet(BaseAutocompleteViewSet):
         """Return CFDA matches by number, title, or name"""
         search_text, limit = self.get_request_payload(request)
 
-        queryset = Cfda.objects.all()
+        search_index = get_reference_search_index(
+            Cfda, ('program_number', 'program_title', 'popular_name'),
+            ('program_number', 'program_title', 'popular_name'))
 
         # Program numbers are 10.4839, 98.2718, etc...
         if search_text.replace('.', '').isnumeric():
-            queryset = queryset.filter(program_number__icontains=search_text)
+            results = search_index.search(search_text, ['program_number'], limit)
         else:
-            title_filter = queryset.filter(program_title__icontains=search_text)
-            popular_name_filter = queryset.filter(popular_name__icontains=search_text)
-            queryset = title_filter | popular_name_filter
+            results = search_index.search(search_text, ['program_title', 'popular_name'], limit)
 
         return Response(
-            {'results': list(queryset.values('program_number', 'program_title', 'popular_name')[:limit])}
+            {'results': results}
         )
 
 
@@ -108,19 +114,17 @@ class NAICSAutocompleteViewSet(BaseAutocompleteViewSet):
         """Return all NAICS table entries matching the provided search text"""
         search_text, limit = self.get_request_payload(request)
 
-        queryset = NAICS.objects.all()
+        search_index = get_reference_search_index(NAICS, ('code', 'description'), ('code', 'description'))
 
         # NAICS codes are 111150, 112310, and there are no numeric NAICS descriptions...
         if search_text.isnumeric():
-            queryset = queryset.filter(code__icontains=search_text)
+            matches = search_index.search(search_text, ['code'], limit)
         else:
-            queryset = queryset.filter(description__icontains=search_text)
+            matches = search_index.search(search_text, ['description'], limit)
 
         # rename columns...
-        queryset = queryset.annotate(naics=F('code'), naics_description=F('description'))
-
         return Response(
-            {'results': list(queryset.values('naics', 'naics_description')[:limit])}
+            {'results': [{'naics': naics['code'], 'naics_description': naics['description']} for naics in matches]}
         )
 
 
@@ -135,20 +139,19 @@ class PSCAutocompleteViewSet(BaseAutocompleteViewSet):
         """Return all PSC table entries matching the provided search text"""
         search_text, limit = self.get_request_payload(request)
 
-        queryset = PSC.objects.all()
+        psc_code = get_reference_data_map(PSC, 'code', ['description']).get(search_text.upper())
 
         # PSC codes are 4-digit, but we have some numeric PSC descriptions, so limit to 4...
-        if len(search_text) == 4 and queryset.filter(code=search_text.upper()).exists():
-            queryset = queryset.filter(code=search_text.upper())
+        if len(search_text) == 4 and psc_code:
+            matches = [psc_code]
         else:
-            queryset = queryset.filter(description__icontains=search_text)
+            search_index = get_reference_search_index(PSC, ('code', 'description'), ('description',))
+            matches = search_index.search(search_text, limit=limit)
 
         # rename columns...
-        queryset = queryset.annotate(product_or_service_code=F('code'), psc_description=F('description'))
-
         return Response(
-            {'results': list(
-                queryset.values('product_or_service_code', 'psc_description')[:limit])}
+            {'results': [{'product_or_service_code': psc['code'], 'psc_description': psc['description']}
+                         for psc in matches]}
         )
 
 
@@ -159,12 +162,11 @@ class RecipientAutocompleteViewSet(BaseAutocompleteViewSet):
     """
     @cache_response()
     def post(self, request):
-        """Return a list of legal entity IDs whose recipient name contains search_text,
+        """Return up to limit legal entity IDs whose recipient name contains search_text, most similar first,
         OR a list od legal entity IDs matching a valid DUNS number.
         Include search_text in response for frontend. """
 
-        # Limit not used here
-        search_text, _ = self.get_request_payload(request)
+        search_text, limit = self.get_request_payload(request)
 
         queryset = LegalEntity.objects.all()
 
@@ -177,9 +179,12 @@ class RecipientAutocompleteViewSet(BaseAutocompleteViewSet):
             is_duns = True
 
         if is_duns:
-            queryset = queryset.filter(recipient_unique_id=search_text)
+            queryset = queryset.filter(recipient_unique_id=search_text).order_by('legal_entity_id')
         else:
-            queryset = queryset.filter(recipient_name__icontains=search_text)
+            # Served by the trigram index on UPPER(recipient_name), which is what __icontains compares
+            queryset = queryset.filter(recipient_name__icontains=search_text). \
+                annotate(similarity=TrigramSimilarity('recipient_name', search_text)). \
+                order_by('-similarity', 'legal_entity_id')
 
         recipients = queryset
 
@@ -187,7 +192,7 @@ class RecipientAutocompleteViewSet(BaseAutocompleteViewSet):
             'results': {
                 'search_text': search_text,
                 'recipient_id_list':
-                    recipients.values_list('legal_entity_id', flat=True)
+                    list(recipients.values_list('legal_entity_id', flat=True)[:limit])
             }
         }
 
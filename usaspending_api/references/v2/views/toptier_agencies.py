@@ -1,4 +1,7 @@
-from django.db.models import F, Sum
+from functools import reduce
+from operator import or_
+
+from django.db.models import OuterRef, Q, Subquery, Sum
 from django.db.models.functions import Coalesce
 from usaspending_api.references.models import Agency
 from usaspending_api.references.constants import DOD_ARMED_FORCES_CGAC, DOD_CGAC
@@ -36,54 +39,63 @@ class ToptierAgenciesViewSet(APIDocumentationView):
             raise InvalidParameterException('The order value provided is not a valid option. '
                                             "Please choose from the following: ['asc', 'desc']")
 
+        # get the most up to date fy and quarter of each agency's submissions through the cgac code
+        latest_submission = SubmissionAttributes.objects.filter(cgac_code=OuterRef('toptier_agency__cgac_code')) \
+            .order_by('-reporting_fiscal_year', '-reporting_fiscal_quarter')
+
         # get agency queryset, distinct toptier id to avoid duplicates, take first ordered agency id for consistency
         agency_queryset = Agency.objects.filter(toptier_flag=True) \
             .order_by('toptier_agency_id', 'id') \
-            .distinct('toptier_agency_id')
-
-        for agency in agency_queryset:
-            toptier_agency = agency.toptier_agency
-            # get corresponding submissions through cgac code
-            queryset = SubmissionAttributes.objects.all()
-            queryset = queryset.filter(cgac_code=toptier_agency.cgac_code)
-
-            # get the most up to date fy and quarter
-            queryset = queryset.order_by('-reporting_fiscal_year', '-reporting_fiscal_quarter')
-            queryset = queryset.annotate(
-                fiscal_year=F('reporting_fiscal_year'),
-                fiscal_quarter=F('reporting_fiscal_quarter')
-            )
-            submission = queryset.first()
-            if submission is None:
-                continue
-            active_fiscal_year = submission.reporting_fiscal_year
-            active_fiscal_quarter = submission.fiscal_quarter
-
-            # using final_objects below ensures that we're only pulling the latest
-            # set of financial information for each fiscal year
-            queryset = AppropriationAccountBalances.final_objects.all()
-            # get the incoming agency's toptier agency, because that's what we'll
-            # need to filter on
-            # (used filter() instead of get() b/c we likely don't want to raise an
-            # error on a bad agency id)
+            .distinct('toptier_agency_id') \
+            .annotate(latest_submission_id=Subquery(latest_submission.values('submission_id')[:1]),
+                      active_fiscal_year=Subquery(latest_submission.values('reporting_fiscal_year')[:1]),
+                      active_fiscal_quarter=Subquery(latest_submission.values('reporting_fiscal_quarter')[:1])) \
+            .values('id', 'latest_submission_id', 'active_fiscal_year', 'active_fiscal_quarter', 'toptier_agency',
+                    'toptier_agency__name', 'toptier_agency__abbreviation', 'toptier_agency__cgac_code')
+        agencies = [agency for agency in agency_queryset if agency['latest_submission_id'] is not None]
+        if not agencies:
+            return Response(response)
+
+        # using final_objects below ensures that we're only pulling the latest
+        # set of financial information for each fiscal year
+        # Balances are summed per funding agency for every active fiscal year and quarter at once
+        active_periods = set((agency['active_fiscal_year'], agency['active_fiscal_quarter']) for agency in agencies)
+        balances_queryset = AppropriationAccountBalances.final_objects \
+            .filter(reduce(or_, (Q(submission__reporting_fiscal_year=fiscal_year,
+                                   submission__reporting_fiscal_quarter=fiscal_quarter)
+                                 for fiscal_year, fiscal_quarter in active_periods))) \
+            .values('treasury_account_identifier__funding_toptier_agency',
+                    'treasury_account_identifier__funding_toptier_agency__cgac_code',
+                    'submission__reporting_fiscal_year', 'submission__reporting_fiscal_quarter') \
+            .annotate(budget_authority_amount=Coalesce(Sum('total_budgetary_resources_amount_cpe'), 0),
+                      obligated_amount=Coalesce(Sum('obligations_incurred_total_by_tas_cpe'), 0),
+                      outlay_amount=Coalesce(Sum('gross_outlay_amount_by_tas_cpe'), 0))
+        # Index the balances once by period and funding agency, instead of scanning them all for every agency
+        balances = {}
+        armed_forces_agencies = set()
+        for row in balances_queryset:
+            funding_agency = row['treasury_account_identifier__funding_toptier_agency']
+            balances[(row['submission__reporting_fiscal_year'], row['submission__reporting_fiscal_quarter'],
+                      funding_agency)] = row
+            if row['treasury_account_identifier__funding_toptier_agency__cgac_code'] in DOD_ARMED_FORCES_CGAC:
+                armed_forces_agencies.add(funding_agency)
+
+        for agency in agencies:
+            active_fiscal_year = agency['active_fiscal_year']
+            active_fiscal_quarter = agency['active_fiscal_quarter']
+
             # DS-1655: if the AID is "097" (DOD), Include the branches of the military in the queryset
-            if toptier_agency.cgac_code == DOD_CGAC:
-                tta_list = DOD_ARMED_FORCES_CGAC
-                queryset = queryset.filter(
-                    submission__reporting_fiscal_year=active_fiscal_year,
-                    submission__reporting_fiscal_quarter=active_fiscal_quarter,
-                    treasury_account_identifier__funding_toptier_agency__cgac_code__in=tta_list
-                )
+            if agency['toptier_agency__cgac_code'] == DOD_CGAC:
+                funding_agencies = armed_forces_agencies
             else:
-                queryset = queryset.filter(
-                    submission__reporting_fiscal_year=active_fiscal_year,
-                    submission__reporting_fiscal_quarter=active_fiscal_quarter,
-                    treasury_account_identifier__funding_toptier_agency=toptier_agency
-                )
-            aggregate_dict = queryset.aggregate(
-                budget_authority_amount=Coalesce(Sum('total_budgetary_resources_amount_cpe'), 0),
-                obligated_amount=Coalesce(Sum('obligations_incurred_total_by_tas_cpe'), 0),
-                outlay_amount=Coalesce(Sum('gross_outlay_amount_by_tas_cpe'), 0))
+                funding_agencies = [agency['toptier_agency']]
+
+            aggregate_dict = {'budget_authority_amount': 0, 'obligated_amount': 0, 'outlay_amount': 0}
+            for funding_agency in funding_agencies:
+                row = balances.get((active_fiscal_year, active_fiscal_quarter, funding_agency))
+                if row is not None:
+                    for amount in aggregate_dict:
+                        aggregate_dict[amount] += row[amount]
 
             # TODO: Rework this block to calculate the total once consumption of the latest GTAS file is implemented
             # # get the overall total government budget authority (to craft a budget authority percentage)
@@ -99,13 +111,13 @@ class ToptierAgenciesViewSet(APIDocumentationView):
             #     percentage = (float(aggregate_dict['budget_authority_amount']) / float(total_budget_authority_amount))
 
             abbreviation = ""
-            if toptier_agency.abbreviation is not None:
-                abbreviation = toptier_agency.abbreviation
+            if agency['toptier_agency__abbreviation'] is not None:
+                abbreviation = agency['toptier_agency__abbreviation']
 
             # craft response
-            response['results'].append({'agency_id': agency.id,
+            response['results'].append({'agency_id': agency['id'],
                                         'abbreviation': abbreviation,
-                                        'agency_name': toptier_agency.name,
+                                        'agency_name': agency['toptier_agency__name'],
                                         'active_fy': str(active_fiscal_year),
                                         'active_fq': str(active_fiscal_quarter),
                                         'outlay_amount': float(aggregate_dict['outlay_amount']),
@@ -0,0 +1,106 @@
+import copy
+from unittest.mock import Mock
+
+import pytest
+from elasticsearch import ConnectionError
+
+from usaspending_api.core.elasticsearch import client
+from usaspending_api.search.v2 import elasticsearch_helper
+from usaspending_api.search.v2.elasticsearch_helper import get_download_ids, spending_by_transaction_count
+
+
+def mock_es_client(monkeypatch, **methods):
+    es_client = Mock(**methods)
+    monkeypatch.setattr(client, 'CLIENT', es_client)
+    return es_client
+
+
+def test_es_client_msearch(monkeypatch):
+    es_client = mock_es_client(monkeypatch, **{'msearch.return_value': {'responses': [{'hits': {'total': 1}},
+                                                                                      {'hits': {'total': 2}}]}})
+
+    responses = client.es_client_msearch([('index-a*', {'size': 0}), ('index-b*', {'size': 1})])
+
+    assert responses == [{'hits': {'total': 1}}, {'hits': {'total': 2}}]
+    es_client.msearch.assert_called_once_with(
+        body=[{'index': 'index-a*'}, {'size': 0}, {'index': 'index-b*'}, {'size': 1}])
+
+
+def test_es_client_msearch_retries_errors(monkeypatch):
+    es_client = mock_es_client(monkeypatch, **{'msearch.side_effect': ConnectionError('N/A', 'unreachable', None)})
+
+    # _es_call logs the client's errors and returns None, so each retry is another request
+    assert client.es_client_msearch([('index-a*', {'size': 0})], retries=3) is None
+    assert es_client.msearch.call_count == 3
+
+
+def test_spending_by_transaction_count(monkeypatch):
+    totals = {'contracts': 5, 'directpayments': 0, 'grants': 7, 'loans': 1, 'other': 2}
+    searched_indices = []
+
+    def msearch(body):
+        searched_indices.extend(header['index'] for header in body[::2])
+        index_root = '{}-'.format(elasticsearch_helper.TRANSACTIONS_INDEX_ROOT)
+        return {'responses': [{'hits': {'total': totals[header['index'][len(index_root):-1]]}}
+                              for header in body[::2]]}
+
+    es_client = mock_es_client(monkeypatch, **{'msearch.side_effect': msearch})
+
+    response = spending_by_transaction_count({'filters': {'keywords': 'test'}})
+
+    # One request counts every award type category
+    assert es_client.msearch.call_count == 1
+    assert not es_client.search.called
+    assert len(searched_indices) == len(totals)
+    assert response == {'contracts': 5, 'direct_payments': 0, 'grants': 7, 'loans': 1, 'other': 2}
+
+
+def test_spending_by_transaction_count_error(monkeypatch):
+    mock_es_client(monkeypatch, **{'msearch.return_value': {'responses': [{'error': 'index not found'}] * 5}})
+
+    assert spending_by_transaction_count({'filters': {'keywords': 'test'}}) is None
+
+
+def mock_download_search(monkeypatch, transaction_ids):
+    """Serves the sorted transaction ids a page at a time, after the search_after value of the request"""
+    queries = []
+
+    def es_client_query(index, body, retries, timeout):
+        queries.append(copy.deepcopy(body))
+        after = body.get('search_after', [float('-inf')])[0]
+        page = [transaction_id for transaction_id in sorted(transaction_ids) if transaction_id > after][:body['size']]
+        return {'hits': {'hits': [{'sort': [transaction_id]} for transaction_id in page]}}
+
+    monkeypatch.setattr(elasticsearch_helper, 'es_client_query', es_client_query)
+    return queries
+
+
+def test_get_download_ids_pages_with_search_after(monkeypatch):
+    queries = mock_download_search(monkeypatch, [7, 3, 1, 9, 5])
+
+    assert list(get_download_ids('test', 'transaction_id', size=2)) == [[1, 3], [5, 7], [9]]
+    assert [query.get('search_after') for query in queries] == [None, [3], [7]]
+    assert all(query['sort'] == [{'transaction_id': 'asc'}] for query in queries)
+
+
+def test_get_download_ids_stops_at_the_download_limit(monkeypatch):
+    queries = mock_download_search(monkeypatch, range(1, 11))
+    monkeypatch.setattr(elasticsearch_helper, 'DOWNLOAD_QUERY_SIZE', 5)
+
+    # The last page only asks for the ids left under the limit
+    assert list(get_download_ids('test', 'transaction_id', size=2)) == [[1, 2], [3, 4], [5]]
+    assert [query['size'] for query in queries] == [2, 2, 1]
+
+
+def test_get_download_ids_without_matches(monkeypatch):
+    queries = mock_download_search(monkeypatch, [])
+
+    assert list(get_download_ids('test', 'transaction_id', size=2)) == []
+    assert len(queries) == 1
+
+
+def test_get_download_ids_unreachable_cluster(monkeypatch):
+    monkeypatch.setattr(elasticsearch_helper, 'es_client_query', lambda **kwargs: None)
+
+    with pytest.raises(Exception):
+        list(get_download_ids('test', 'transaction_id'))
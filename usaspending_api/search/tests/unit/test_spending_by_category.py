@@ -9,7 +9,8 @@ from model_mommy import mommy
 
 # Imports from your apps
 from usaspending_api.common.helpers.unit_test_helper import add_to_mock_objects
-from usaspending_api.search.v2.views.spending_by_category import BusinessLogic
+from usaspending_api.search.v2.views.spending_by_category import (BusinessLogic, fetch_agency_tier_ids_by_agency,
+                                                                  fetch_recipient_lookups_by_hash)
 
 
 def test_category_awarding_agency_awards(mock_matviews_qs, mock_agencies):
@@ -842,3 +843,56 @@ def test_category_federal_accounts_subawards(
     }
 
     assert expected_response == spending_by_category_logic
+
+
+@pytest.mark.django_db
+def test_fetch_agency_tier_ids_by_agency():
+    pizza = mommy.make("references.ToptierAgency", name="Department of Pizza")
+    mommy.make("references.Agency", id=3, toptier_agency=pizza, subtier_agency__name="Pizza Delivery",
+               toptier_flag=False)
+    mommy.make("references.Agency", id=2, toptier_agency=pizza, subtier_agency__name="Department of Pizza",
+               toptier_flag=True)
+    mommy.make("references.Agency", id=4, toptier_agency=pizza, subtier_agency__name="Department of Pizza",
+               toptier_flag=True)
+
+    # Of several agencies with the same name, the first one by pk wins; names without an agency are left out
+    assert fetch_agency_tier_ids_by_agency(["Department of Pizza", "Department of Pizza", "Missing Agency"]) == {
+        "Department of Pizza": 2
+    }
+    assert fetch_agency_tier_ids_by_agency(["Pizza Delivery", "Department of Pizza"], is_subtier=True) == {
+        "Pizza Delivery": 3,
+        "Department of Pizza": 2,
+    }
+    assert fetch_agency_tier_ids_by_agency(["Pizza Delivery"]) == {}
+
+
+@pytest.mark.django_db
+def test_fetch_recipient_lookups_by_hash():
+    mommy.make(
+        "recipient.RecipientLookup",
+        recipient_hash="3725ba78-a607-7ab4-1cf6-2a08207bac3c",
+        legal_business_name="John Doe",
+        duns="1234JD4321",
+    )
+    mommy.make(
+        "recipient.RecipientLookup",
+        recipient_hash="18569a71-3b0a-1586-50a9-cbb8bb070136",
+        legal_business_name="MULTIPLE RECIPIENTS",
+        duns=None,
+    )
+
+    recipient_lookups = fetch_recipient_lookups_by_hash(
+        [
+            "3725ba78-a607-7ab4-1cf6-2a08207bac3c",
+            "3725ba78-a607-7ab4-1cf6-2a08207bac3c",
+            "18569a71-3b0a-1586-50a9-cbb8bb070136",
+            "59f9a646-cd1c-cbdc-63dd-1020fac59336",
+        ]
+    )
+
+    # A hash requested more than once is looked up once; hashes without a recipient are left out
+    assert {recipient_hash: (lookup["legal_business_name"], lookup["duns"])
+            for recipient_hash, lookup in recipient_lookups.items()} == {
+        "3725ba78-a607-7ab4-1cf6-2a08207bac3c": ("John Doe", "1234JD4321"),
+        "18569a71-3b0a-1586-50a9-cbb8bb070136": ("MULTIPLE RECIPIENTS", None),
+    }
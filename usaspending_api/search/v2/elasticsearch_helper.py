@@ -6,7 +6,7 @@ from django.conf import settings
 from usaspending_api.awards.v2.lookups.elasticsearch_lookups import KEYWORD_DATATYPE_FIELDS
 from usaspending_api.awards.v2.lookups.elasticsearch_lookups import indices_to_award_types
 from usaspending_api.awards.v2.lookups.elasticsearch_lookups import TRANSACTIONS_LOOKUP
-from usaspending_api.core.elasticsearch.client import es_client_query
+from usaspending_api.core.elasticsearch.client import es_client_msearch, es_client_query
 
 logger = logging.getLogger("console")
 
@@ -86,33 +86,30 @@ def search_transactions(request_data, lower_limit, limit):
         return False, "There was an error connecting to the ElasticSearch cluster", None
 
 
-def get_total_results(keyword, sub_index, retries=3):
-    index_name = "{}-{}*".format(TRANSACTIONS_INDEX_ROOT, sub_index.replace("_", ""))
-    query = {"query": base_query(keyword)}
-
-    response = es_client_query(index=index_name, body=query, retries=retries)
-    if response:
-        try:
-            return response["hits"]["total"]
-        except KeyError:
-            logger.error("Unexpected Response")
-    else:
+def spending_by_transaction_count(request_data):
+    """Counts the keyword's matches in every award type category's indices, all in one _msearch request"""
+    keyword = request_data["filters"]["keywords"]
+    categories = list(indices_to_award_types.keys())
+    searches = [
+        ("{}-{}*".format(TRANSACTIONS_INDEX_ROOT, category.replace("_", "")), {"query": base_query(keyword), "size": 0})
+        for category in categories
+    ]
+
+    responses = es_client_msearch(searches, retries=3)
+    if responses is None:
         logger.error("No Response")
         return None
 
-
-def spending_by_transaction_count(request_data):
-    keyword = request_data["filters"]["keywords"]
     response = {}
-
-    for category in indices_to_award_types.keys():
-        total = get_total_results(keyword, category)
-        if total is not None:
-            if category == "directpayments":
-                category = "direct_payments"
-            response[category] = total
-        else:
-            return total
+    for category, category_response in zip(categories, responses):
+        try:
+            total = category_response["hits"]["total"]
+        except KeyError:
+            logger.error("Unexpected Response: {}".format(category_response.get("error")))
+            return None
+        if category == "directpayments":
+            category = "direct_payments"
+        response[category] = total
     return response
 
 
@@ -138,39 +135,31 @@ def spending_by_transaction_sum(filters):
 def get_download_ids(keyword, field, size=10000):
     """
     returns a generator that
-    yields list of transaction ids in chunksize SIZE
+    yields list of transaction ids in chunksize SIZE, in ascending order
 
+    Pages through the matches with search_after on the sorted field, so each page only fetches the next SIZE ids
+    instead of re-running the query over every match per terms partition. Stops after DOWNLOAD_QUERY_SIZE ids.
     Note: this only works for fields in ES of integer type.
     """
     index_name = "{}-*".format(TRANSACTIONS_INDEX_ROOT)
-    n_iter = DOWNLOAD_QUERY_SIZE // size
-
     max_iterations = 10
-    total = get_total_results(keyword, "*", max_iterations)
-    if total is None:
-        logger.error("Error retrieving total results. Max number of attempts reached")
-        return
-    required_iter = (total // size) + 1
-    n_iter = min(max(1, required_iter), n_iter)
-    for i in range(n_iter):
-        query = {
-            "_source": [field],
-            "query": base_query(keyword),
-            "aggs": {
-                "results": {
-                    "terms": {"field": field, "include": {"partition": i, "num_partitions": n_iter}, "size": size}
-                }
-            },
-            "size": 0,
-        }
+    query = {"_source": False, "query": base_query(keyword), "sort": [{field: "asc"}]}
 
+    total = 0
+    while total < DOWNLOAD_QUERY_SIZE:
+        query["size"] = min(size, DOWNLOAD_QUERY_SIZE - total)
         response = es_client_query(index=index_name, body=query, retries=max_iterations, timeout="3m")
         if not response:
             raise Exception("Breaking generator, unable to reach cluster")
-        results = []
-        for result in response["aggregations"]["results"]["buckets"]:
-            results.append(result["key"])
+        hits = response["hits"]["hits"]
+        if not hits:
+            return
+        results = [hit["sort"][0] for hit in hits]
+        total += len(results)
         yield results
+        if len(hits) < query["size"]:
+            return
+        query["search_after"] = hits[-1]["sort"]
 
 
 def get_sum_and_count_aggregation_results(keyword):
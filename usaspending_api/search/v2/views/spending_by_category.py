@@ -17,6 +17,7 @@ from usaspending_api.core.validator.award_filter import AWARD_FILTER
 from usaspending_api.core.validator.pagination import PAGINATION
 from usaspending_api.core.validator.tinyshield import TinyShield
 from usaspending_api.recipient.models import RecipientLookup, StateData
+from usaspending_api.references.helpers import get_reference_data_map
 from usaspending_api.references.models import Agency, Cfda, LegalEntity, NAICS, PSC, RefCountryCode
 
 
@@ -191,8 +192,11 @@ class BusinessLogic:
         # DB hit here
         query_results = list(self.queryset[self.lower_limit:self.upper_limit])
         results = alias_response(ALIAS_DICT[self.category], query_results)
+        agency_ids = fetch_agency_tier_ids_by_agency(
+            [row["name"] for row in results], self.category == "awarding_subagency"
+        )
         for row in results:
-            row["id"] = fetch_agency_tier_id_by_agency(row["name"], self.category == "awarding_subagency")
+            row["id"] = agency_ids.get(row["name"])
         return results
 
     def funding_agency(self) -> list:
@@ -214,8 +218,11 @@ class BusinessLogic:
         query_results = list(self.queryset[self.lower_limit:self.upper_limit])
 
         results = alias_response(ALIAS_DICT[self.category], query_results)
+        agency_ids = fetch_agency_tier_ids_by_agency(
+            [row["name"] for row in results], self.category == "funding_subagency"
+        )
         for row in results:
-            row["id"] = fetch_agency_tier_id_by_agency(row["name"], self.category == "funding_subagency")
+            row["id"] = agency_ids.get(row["name"])
         return results
 
     def recipient(self) -> list:
@@ -237,19 +244,14 @@ class BusinessLogic:
         self.queryset = self.common_db_query(filters, values)
         # DB hit here
         query_results = list(self.queryset[self.lower_limit:self.upper_limit])
+        if not self.subawards:
+            recipient_lookups = fetch_recipient_lookups_by_hash([row["recipient_hash"] for row in query_results])
         for row in query_results:
             row["recipient_id"] = None
             if not self.subawards:
-                lookup = (
-                    RecipientLookup.objects.filter(recipient_hash=row["recipient_hash"])
-                    .values("legal_business_name", "duns")
-                    .first()
-                )
-
                 # The Recipient Name + DUNS should always be retrievable in RecipientLookup
                 # For odd edge cases or data sync issues, handle gracefully:
-                if lookup is None:
-                    lookup = {}
+                lookup = recipient_lookups.get(str(row["recipient_hash"]), {})
 
                 row["recipient_name"] = lookup.get("legal_business_name", None)
                 row["recipient_unique_id"] = lookup.get("duns", "DUNS Number not provided")
@@ -348,18 +350,28 @@ class BusinessLogic:
         return alias_response(ALIAS_DICT[self.category], query_results)
 
 
-def fetch_agency_tier_id_by_agency(agency_name, is_subtier=False):
+def fetch_agency_tier_ids_by_agency(agency_names, is_subtier=False):
+    """Returns a dict of agency name to agency id for all of the agency names, in a single query"""
     agency_type = "subtier_agency" if is_subtier else "toptier_agency"
-    columns = ["id"]
-    filters = {"{}__name".format(agency_type): agency_name}
+    name_column = "{}__name".format(agency_type)
+    filters = {"{}__in".format(name_column): agency_names}
     if not is_subtier:
         # Note: The awarded/funded subagency can be a toptier agency, so we don't filter only subtiers in that case.
         filters["toptier_flag"] = True
-    result = Agency.objects.filter(**filters).values(*columns).first()
-    if not result:
-        logger.warning("{} not found for agency_name: {}".format(",".join(columns), agency_name))
-        return None
-    return result[columns[0]]
+
+    agency_ids = {}
+    for result in Agency.objects.filter(**filters).order_by("pk").values("id", name_column):
+        agency_ids.setdefault(result[name_column], result["id"])
+    for agency_name in set(agency_names) - set(agency_ids):
+        logger.warning("id not found for agency_name: {}".format(agency_name))
+    return agency_ids
+
+
+def fetch_recipient_lookups_by_hash(recipient_hashes):
+    """Returns a dict of recipient hash (as a string) to its RecipientLookup name and DUNS, in a single query"""
+    columns = ["recipient_hash", "legal_business_name", "duns"]
+    results = RecipientLookup.objects.filter(recipient_hash__in=recipient_hashes).values(*columns)
+    return {str(result["recipient_hash"]): result for result in results}
 
 
 def fetch_recipient_id_by_duns(duns):
@@ -373,7 +385,7 @@ def fetch_recipient_id_by_duns(duns):
 
 def fetch_cfda_id_title_by_number(cfda_number):
     columns = ["id", "program_title"]
-    result = Cfda.objects.filter(program_number=cfda_number).values(*columns).first()
+    result = get_reference_data_map(Cfda, "program_number", columns).get(cfda_number)
     if not result:
         logger.warning("{} not found for cfda_number: {}".format(",".join(columns), cfda_number))
         return None, None
@@ -382,7 +394,7 @@ def fetch_cfda_id_title_by_number(cfda_number):
 
 def fetch_psc_description_by_code(psc_code):
     columns = ["description"]
-    result = PSC.objects.filter(code=psc_code).values(*columns).first()
+    result = get_reference_data_map(PSC, "code", columns).get(psc_code)
     if not result:
         logger.warning("{} not found for psc_code: {}".format(",".join(columns), psc_code))
         return None
@@ -391,7 +403,7 @@ def fetch_psc_description_by_code(psc_code):
 
 def fetch_country_name_from_code(country_code):
     columns = ["country_name"]
-    result = RefCountryCode.objects.filter(country_code=country_code).values(*columns).first()
+    result = get_reference_data_map(RefCountryCode, "country_code", columns).get(country_code)
     if not result:
         logger.warning("{} not found for country_code: {}".format(",".join(columns), country_code))
         return None
@@ -400,7 +412,7 @@ def fetch_country_name_from_code(country_code):
 
 def fetch_state_name_from_code(state_code):
     columns = ["name"]
-    result = StateData.objects.filter(code=state_code).values(*columns).first()
+    result = get_reference_data_map(StateData, "code", columns).get(state_code)
     if not result:
         logger.warning("{} not found for state_code: {}".format(",".join(columns), state_code))
         return None
@@ -409,7 +421,7 @@ def fetch_state_name_from_code(state_code):
 
 def fetch_naics_description_from_code(naics_code, passthrough=None):
     columns = ["description"]
-    result = NAICS.objects.filter(code=naics_code).values(*columns).first()
+    result = get_reference_data_map(NAICS, "code", columns).get(naics_code)
     if not result:
         logger.warning("{} not found for naics_code: {}".format(",".join(columns), naics_code))
         return passthrough
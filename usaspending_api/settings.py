@@ -47,6 +47,8 @@ if not USASPENDING_AWS_REGION:
 CSV_LOCAL_PATH = os.path.join(BASE_DIR, 'csv_downloads', '')
 DOWNLOAD_ENV = ""
 BULK_DOWNLOAD_LOCAL_PATH = os.path.join(BASE_DIR, 'bulk_downloads', '')
+# Number of concurrent PSQL processes generating a download's id range slices; 1 runs each source as one query
+DOWNLOAD_PARTITION_WORKERS = int(os.environ.get('DOWNLOAD_PARTITION_WORKERS') or 1)
 
 BULK_DOWNLOAD_S3_BUCKET_NAME = ""
 BUCK_DOWNLOAD_S3_REDIRECT_DIR = "generated_downloads"
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from django.core.management import call_command
+from model_mommy import mommy
+
+from usaspending_api.etl.management.commands import load_spending_explorer_rollup
+
+from usaspending_api.financial_activities.models import FinancialAccountsByProgramActivityObjectClass, \
+    SpendingExplorerRollup
+from usaspending_api.spending_explorer.v2.filters import rollup
+from usaspending_api.references.models import ToptierAgency
+from usaspending_api.spending_explorer.v2.filters.rollup import build_rollup, rebuild_rollup, refresh_rollups
+from usaspending_api.spending_explorer.v2.filters.type_filter import type_filter
+
+
+@pytest.fixture
+def file_b_data(db):
+    mommy.make('references.GTASTotalObligation', fiscal_year=1600, fiscal_quarter=1, total_obligation=-10)
+    mommy.make('submissions.SubmissionAttributes', submission_id=-1, reporting_fiscal_year=1600,
+               reporting_fiscal_quarter=1)
+    for agency_id in (-1, -2):
+        mommy.make('references.ToptierAgency', toptier_agency_id=agency_id, name='agency {}'.format(agency_id),
+                   cgac_code='99{}'.format(-agency_id))
+        mommy.make('references.Agency', id=agency_id, toptier_agency_id=agency_id, toptier_flag=True)
+        mommy.make('accounts.TreasuryAppropriationAccount', treasury_account_identifier=agency_id,
+                   funding_toptier_agency_id=agency_id, budget_function_code='05{}'.format(-agency_id))
+    for pk, treasury_account_id, obligations in ((-1, -1, -5), (-2, -1, -10), (-3, -2, -1)):
+        mommy.make(FinancialAccountsByProgramActivityObjectClass,
+                   financial_accounts_by_program_activity_object_class_id=pk, submission_id=-1,
+                   treasury_account_id=treasury_account_id,
+                   obligations_incurred_by_program_object_class_cpe=obligations)
+
+
+def as_response(results):
+    return json.loads(json.dumps(results, default=float))
+
+
+@pytest.mark.django_db
+def test_rollup_matches_live_results(file_b_data):
+    filters = {'fy': '1600', 'quarter': '1'}
+    live = {_type: as_response(type_filter(_type, filters)) for _type in ('agency', 'budget_function')}
+
+    # The three roots, the budget subfunctions of both budget functions and the federal accounts of both agencies
+    assert build_rollup(1600, 1) >= 7
+    assert SpendingExplorerRollup.objects.filter(filter_path='{"agency": "-1"}', type='federal_account').exists()
+
+    for _type, results in live.items():
+        assert type_filter(_type, filters) == results
+    assert type_filter('federal_account', dict(filters, agency='-2')) == \
+        as_response(type_filter('federal_account', dict(filters, agency='-2'), use_rollup=False))
+
+
+@pytest.mark.django_db
+def test_rollup_is_rebuilt_for_the_given_agencies(file_b_data):
+    filters = {'fy': '1600', 'quarter': '1'}
+    build_rollup(1600, 1)
+
+    FinancialAccountsByProgramActivityObjectClass.objects.filter(pk=-3). \
+        update(obligations_incurred_by_program_object_class_cpe=-100)
+    assert type_filter('federal_account', dict(filters, agency='-2'))['total'] == -1
+
+    build_rollup(1600, 1, agency_ids=[-2])
+    assert type_filter('federal_account', dict(filters, agency='-2'))['total'] == -100
+    assert [result['amount'] for result in type_filter('agency', filters)['results']] == [105, -15, -100]
+
+
+@pytest.mark.django_db
+def test_rollup_is_dropped_when_it_cannot_be_rebuilt(file_b_data, monkeypatch):
+    build_rollup(1600, 1)
+
+    def store_rollup(_type, filters):
+        raise ValueError('cannot compute {}'.format(_type))
+
+    monkeypatch.setattr(rollup, 'store_rollup', store_rollup)
+    with pytest.raises(ValueError):
+        rebuild_rollup(1600, 1, agency_ids=[-2])
+
+    # Requests of the period are computed live rather than served stale
+    assert not SpendingExplorerRollup.objects.filter(fiscal_year=1600, fiscal_quarter=1).exists()
+
+
+@pytest.mark.django_db
+def test_rollup_is_refreshed_after_reference_loads(file_b_data):
+    filters = {'fy': '1600', 'quarter': '1'}
+    build_rollup(1600, 1)
+
+    ToptierAgency.objects.filter(toptier_agency_id=-1).update(name='renamed agency')
+    refresh_rollups()
+
+    assert 'renamed agency' in [result['name'] for result in type_filter('agency', filters)['results']]
+
+
+@pytest.mark.django_db
+def test_missing_rollup_periods_are_built(file_b_data, monkeypatch):
+    mommy.make('submissions.SubmissionAttributes', submission_id=-2, reporting_fiscal_year=1600,
+               reporting_fiscal_quarter=2)
+    build_rollup(1600, 1)
+
+    built = []
+    monkeypatch.setattr(load_spending_explorer_rollup, 'build_rollup',
+                        lambda fiscal_year, fiscal_quarter: built.append((fiscal_year, fiscal_quarter)))
+    call_command('load_spending_explorer_rollup', '--missing')
+
+    # Only the period skipped so far is built again
+    assert built == [(1600, 2)]
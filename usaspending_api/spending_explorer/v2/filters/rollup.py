@@ -0,0 +1,123 @@
+import logging
+
+from django.db import transaction
+from django.db.models import Q
+
+from usaspending_api.common.exceptions import InvalidParameterException
+from usaspending_api.financial_activities.models import FinancialAccountsByProgramActivityObjectClass, \
+    SpendingExplorerRollup
+from usaspending_api.references.constants import DOD_ARMED_FORCES_CGAC, DOD_CGAC
+from usaspending_api.references.models import Agency
+from usaspending_api.spending_explorer.v2.filters.type_filter import rollup_filter_path, type_filter
+
+logger = logging.getLogger('console')
+
+# The first page of each Spending Explorer path, and the drilldown it leads to for each of its results
+ROLLUP_ROOTS = {
+    'budget_function': 'budget_subfunction',
+    'agency': 'federal_account',
+    'object_class': 'agency',
+}
+
+
+def store_rollup(_type, filters):
+    """ Computes a request's results from Files B and C and stores them in the rollup, returning them """
+    results = type_filter(_type, filters, use_rollup=False)
+    SpendingExplorerRollup.objects.update_or_create(
+        fiscal_year=int(filters['fy']), fiscal_quarter=int(filters['quarter']), type=_type,
+        filter_path=rollup_filter_path(_type, filters), defaults={'results': results})
+    return results
+
+
+@transaction.atomic
+def build_rollup(fiscal_year, fiscal_quarter, agency_ids=None):
+    """ (Re)builds the rollup of one fiscal period: the roots of the Spending Explorer and the drilldown below each of
+        their results.
+
+        With agency_ids, only the rows that can include data of those (toptier) agencies are rebuilt; rows filtered
+        on any other agency are left as they are. Returns the number of rows built, or None when the period cannot be
+        requested yet.
+    """
+    period = {'fy': str(fiscal_year), 'quarter': str(fiscal_quarter)}
+    try:
+        roots = {_type: store_rollup(_type, period) for _type in ROLLUP_ROOTS}
+    except InvalidParameterException:
+        logger.info('Skipping the Spending Explorer rollup of FY{} Q{}, which cannot be requested yet'.format(
+            fiscal_year, fiscal_quarter))
+        return None
+
+    if agency_ids is not None:
+        agency_ids = {str(agency_id) for agency_id in agency_ids}
+
+    # Drop the drilldowns being rebuilt, so that results which no longer exist do not keep theirs
+    stale = SpendingExplorerRollup.objects.filter(fiscal_year=fiscal_year, fiscal_quarter=fiscal_quarter). \
+        exclude(filter_path=rollup_filter_path('agency', period))
+    if agency_ids is not None:
+        agency_paths = [rollup_filter_path('federal_account', dict(period, agency=agency_id))
+                        for agency_id in agency_ids]
+        stale = stale.exclude(Q(filter_path__startswith='{"agency": ') & ~Q(filter_path__in=agency_paths))
+    stale.delete()
+
+    built = len(roots)
+    for _type, child_type in ROLLUP_ROOTS.items():
+        for result in roots[_type]['results']:
+            if result['id'] is None:
+                # Unreported Data
+                continue
+            if _type == 'agency' and agency_ids is not None and result['id'] not in agency_ids:
+                continue
+            store_rollup(child_type, dict(period, **{_type: str(result['id'])}))
+            built += 1
+
+    return built
+
+
+def delete_rollup(fiscal_year, fiscal_quarter):
+    """ Drops the rollup of one fiscal period, so that its requests are computed from Files B and C again """
+    SpendingExplorerRollup.objects.filter(fiscal_year=fiscal_year, fiscal_quarter=fiscal_quarter).delete()
+
+
+def rebuild_rollup(fiscal_year, fiscal_quarter, agency_ids=None):
+    """ build_rollup, dropping the period's rollup instead when it cannot be rebuilt, so that it is never served
+        stale
+    """
+    try:
+        return build_rollup(fiscal_year, fiscal_quarter, agency_ids=agency_ids)
+    except Exception:
+        delete_rollup(fiscal_year, fiscal_quarter)
+        raise
+
+
+def refresh_rollups():
+    """ Rebuilds the rollup of every period that has one, after a reference data load changed the agencies, accounts,
+        program activities or object classes its results show. A period that cannot be rebuilt is dropped and logged,
+        so that the reference load itself still goes through.
+    """
+    periods = SpendingExplorerRollup.objects.values_list('fiscal_year', 'fiscal_quarter').distinct(). \
+        order_by('fiscal_year', 'fiscal_quarter')
+    for fiscal_year, fiscal_quarter in list(periods):
+        try:
+            rebuild_rollup(fiscal_year, fiscal_quarter)
+        except Exception:
+            logger.exception('Error rebuilding the Spending Explorer rollup of FY{} Q{}; it is computed live until '
+                             'the rollup is rebuilt'.format(fiscal_year, fiscal_quarter))
+
+
+def get_submission_rollup_agency_ids(submission_attributes):
+    """ The (toptier) agencies whose Spending Explorer results a submission's File B rows count towards """
+    cgac_codes = set()
+    for cgac_code in FinancialAccountsByProgramActivityObjectClass.objects.filter(
+            submission=submission_attributes).values_list('treasury_account__funding_toptier_agency__cgac_code',
+                                                          flat=True).distinct():
+        # The Spending Explorer shows the armed forces as the Department of Defense
+        cgac_codes.add(DOD_CGAC if cgac_code in DOD_ARMED_FORCES_CGAC else cgac_code)
+    return list(Agency.objects.filter(toptier_flag=True, toptier_agency__cgac_code__in=cgac_codes).
+                values_list('id', flat=True))
+
+
+def refresh_rollup_for_submission(submission_attributes):
+    """ Rebuilds the rollup a loaded submission can have changed: its own quarter, for the agencies funding its
+        accounts
+    """
+    rebuild_rollup(submission_attributes.reporting_fiscal_year, submission_attributes.reporting_fiscal_quarter,
+                   agency_ids=get_submission_rollup_agency_ids(submission_attributes))
@@ -1,9 +1,12 @@
+import json
+
 from django.db.models import Sum
 
 from usaspending_api.awards.models import FinancialAccountsByAwards
 from usaspending_api.common.exceptions import InvalidParameterException
 from usaspending_api.common.helpers.generic_helper import generate_last_completed_fiscal_quarter
-from usaspending_api.financial_activities.models import FinancialAccountsByProgramActivityObjectClass
+from usaspending_api.financial_activities.models import FinancialAccountsByProgramActivityObjectClass, \
+    SpendingExplorerRollup
 from usaspending_api.references.models import GTASTotalObligation
 from usaspending_api.spending_explorer.v2.filters.explorer import Explorer
 from usaspending_api.spending_explorer.v2.filters.spending_filter import spending_filter
@@ -13,6 +16,24 @@ UNREPORTED_DATA_NAME = 'Unreported Data'
 VALID_UNREPORTED_DATA_TYPES = ['agency', 'budget_function', 'object_class']
 VALID_UNREPORTED_FILTERS = ['fy', 'quarter']
 
+# File B drilldowns, which only change when a submission is loaded, are served from SpendingExplorerRollup
+ROLLUP_TYPES = ['budget_function', 'budget_subfunction', 'federal_account', 'program_activity', 'object_class',
+                'agency']
+# Filtering on these reads File C award data, which the nightly award loads change as well
+ROLLUP_EXCLUDED_FILTERS = ['recipient', 'award', 'award_category']
+
+
+def rollup_filter_path(_type, filters):
+    """ Returns the key of a request's results in SpendingExplorerRollup, besides its fiscal period, or None if the
+        request is not served from the rollup
+    """
+    if _type not in ROLLUP_TYPES or 'fy' not in filters or 'quarter' not in filters:
+        return None
+    if any(key in filters for key in ROLLUP_EXCLUDED_FILTERS):
+        return None
+    return json.dumps({key: str(value) for key, value in filters.items() if key not in VALID_UNREPORTED_FILTERS},
+                      sort_keys=True)
+
 
 def get_unreported_data_obj(queryset, filters, limit, spending_type, actual_total, fiscal_year, fiscal_quarter) -> \
         (list, float):
@@ -72,7 +93,7 @@ def get_unreported_data_obj(queryset, filters, limit, spending_type, actual_tota
     return result_set, expected_total
 
 
-def type_filter(_type, filters, limit=None):
+def type_filter(_type, filters, limit=None, use_rollup=True):
     fiscal_year = None
     fiscal_quarter = None
     fiscal_date = None
@@ -110,6 +131,13 @@ def type_filter(_type, filters, limit=None):
         fiscal_date, fiscal_quarter = generate_last_completed_fiscal_quarter(fiscal_year=fiscal_year,
                                                                              fiscal_quarter=fiscal_quarter)
 
+    filter_path = rollup_filter_path(_type, filters) if use_rollup else None
+    if filter_path is not None:
+        rollup = SpendingExplorerRollup.objects.filter(fiscal_year=fiscal_year, fiscal_quarter=fiscal_quarter,
+                                                       type=_type, filter_path=filter_path).first()
+        if rollup is not None:
+            return rollup.results
+
     # Recipient, Award Queryset
     alt_set = FinancialAccountsByAwards.objects.all(). \
         exclude(transaction_obligated_amount__isnull=True). \
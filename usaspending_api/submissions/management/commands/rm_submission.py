@@ -3,6 +3,8 @@ import signal
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.management.base import BaseCommand
 
+from usaspending_api.download.helpers import stamp_data_load_watermark
+from usaspending_api.spending_explorer.v2.filters.rollup import get_submission_rollup_agency_ids, rebuild_rollup
 from usaspending_api.submissions.models import SubmissionAttributes
 from django.db import transaction
 
@@ -36,10 +38,19 @@ class Command(BaseCommand):
         except ObjectDoesNotExist:
             raise "Broker submission id {} does not exist".format(broker_submission_id)
 
+        rollup_agency_ids = get_submission_rollup_agency_ids(submission)
         deleted_stats = submission.delete()
 
         self.logger.info('Finished deletions.')
 
+        # Account downloads made before the deletion would otherwise keep being reused
+        stamp_data_load_watermark('account')
+
+        # The Spending Explorer rollup would otherwise keep serving the deleted File B amounts
+        rebuild_rollup(submission.reporting_fiscal_year, submission.reporting_fiscal_quarter,
+                       agency_ids=rollup_agency_ids)
+        self.logger.info('Rebuilt the Spending Explorer rollup.')
+
         statistics = "Statistics:\n  Total objects removed: {}".format(deleted_stats[0])
         for (model, count) in deleted_stats[1].items():
             statistics += "\n  {}: {}".format(model, count)